@@ -0,0 +1,70 @@
+"""Сравнение скорости заливки: построчная (один поток) и параллельная по тайлам
+
+Запуск: python -m benchmarks.fill_benchmark --size 10000 --workers 8
+"""
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt6.QtGui import QGuiApplication, QImage, QPainter, QPen, QColor
+from PyQt6.QtCore import QPoint, Qt
+from models.drawing_tools import FillTool
+
+
+def create_image(size):
+    """Создает белое изображение с сеткой линий, чтобы у заливки были границы"""
+    image = QImage(size, size, QImage.Format.Format_RGB32)
+    image.fill(Qt.GlobalColor.white)
+    painter = QPainter(image)
+    painter.setPen(QPen(QColor(0, 0, 0), 3))
+    step = max(size // 7, 1)
+    for position in range(step, size, step):
+        # Линии с разрывами: область заливки остается связной
+        painter.drawLine(position, 0, position, size - step // 2)
+        painter.drawLine(step // 2, position, size, position)
+    painter.end()
+    return image
+
+
+def measure(name, fill, image, repeats):
+    best = None
+    for _ in range(repeats):
+        copy = image.copy()
+        started = time.perf_counter()
+        fill(copy)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    megapixels = image.width() * image.height() / 1e6
+    print(f"{name:<28} {best:8.3f} с  {megapixels / best:8.1f} Мпикс/с")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=6000, help="сторона изображения в пикселях")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="число потоков")
+    parser.add_argument("--repeats", type=int, default=3, help="число повторов")
+    args = parser.parse_args()
+
+    app = QGuiApplication(sys.argv)
+    image = create_image(args.size)
+    seed = QPoint(1, 1)
+    color = QColor(255, 0, 0)
+    tool = FillTool()
+    tool.workers = args.workers
+
+    print(f"Изображение {args.size}x{args.size}, потоков: {args.workers}")
+    single = measure("flood_fill (один поток)", lambda copy: tool.flood_fill(copy, seed, color),
+                     image, args.repeats)
+    for workers in sorted({1, max(args.workers // 2, 1), args.workers}):
+        tool.workers = workers
+        tiled = measure(f"tiled_fill ({workers} потоков)",
+                        lambda copy: tool.tiled_fill(copy, seed, color), image, args.repeats)
+    print(f"Ускорение: {single / tiled:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,18 @@
 import sys
 import os
-from PyQt6.QtWidgets import QApplication
+import argparse
+import multiprocessing
+from PyQt6.QtWidgets import QApplication, QMessageBox
 from PyQt6.QtCore import QFile, QTextStream
 from ui.main_window import MainWindow
+from utils.database import DatabaseManager
+from utils.history_export import export_history, EXPORT_FORMATS
+from utils.autosave import replay_journal, discard_journal
+from utils.batch import run_batch
+from utils import trace
+
+# Куда выгружается журнал диагностики при аварийном завершении
+CRASH_TRACE_FILE = os.path.join("data", "crash_trace.log")
 
 def load_styles(app):
     """Загружает стили из файла"""
@@ -12,11 +22,11 @@ def load_styles(app):
             stream = QTextStream(style_file)
             app.setStyleSheet(stream.readAll())
             style_file.close()
-            print("Стили загружены успешно")
+            trace.info("Стили загружены успешно")
         else:
-            print("Не удалось открыть файл стилей")
+            trace.warning("Не удалось открыть файл стилей")
     except Exception as e:
-        print(f"Не удалось загрузить стили: {e}")
+        trace.warning("Не удалось загрузить стили: {}", e)
 
 def setup_directories():
     """Создает необходимые папки если их нет"""
@@ -24,21 +34,88 @@ def setup_directories():
     for directory in directories:
         if not os.path.exists(directory):
             os.makedirs(directory)
-            print(f"Создана папка: {directory}")
+            trace.info("Создана папка: {}", directory)
+
+def parse_args(argv):
+    """Разбирает аргументы командной строки"""
+    parser = argparse.ArgumentParser(description="Простой графический редактор")
+    parser.add_argument("--export-history", metavar="PATH",
+                        help="выгрузить историю рисования в CSV или JSON Lines (.gz - со сжатием) и выйти")
+    parser.add_argument("--format", choices=EXPORT_FORMATS,
+                        help="формат выгрузки (по умолчанию - по расширению файла)")
+    parser.add_argument("--gzip", action="store_true",
+                        help="сжать выгрузку gzip")
+    parser.add_argument("--batch", nargs=argparse.REMAINDER, metavar="COMMAND",
+                        help="пакетная обработка без интерфейса: convert, fill или thumbnail "
+                             "(подробнее: --batch COMMAND --help)")
+    # Остальные аргументы остаются Qt
+    return parser.parse_known_args(argv)
+
+
+def export_history_cli(args):
+    """Выгружает историю без запуска интерфейса"""
+    db_manager = DatabaseManager(async_writes=False)
+    try:
+        result = export_history(db_manager, args.export_history, args.format, args.gzip or None)
+        print(f"Выгружено {result['rows']} строк ({result['file_bytes']} байт) "
+              f"за {result['seconds']:.2f} с: {result['rows_per_second']:.0f} строк/с")
+        return 0
+    except Exception as e:
+        trace.error("Ошибка выгрузки истории: {}", e)
+        return 1
+    finally:
+        db_manager.close()
+
+
+def offer_autosave_recovery(window):
+    """Предлагает восстановить рисунок из журнала автосохранения прошлого сеанса
+
+    Журнал удаляется при штатном закрытии, поэтому его наличие означает,
+    что прошлый сеанс завершился аварийно.
+    """
+    image = replay_journal()
+    if image is None:
+        discard_journal()
+        return False
+    answer = QMessageBox.question(
+        window,
+        "Восстановление",
+        "Прошлый сеанс завершился аварийно. Восстановить несохраненный рисунок?"
+    )
+    if answer != QMessageBox.StandardButton.Yes:
+        discard_journal()
+        return False
+    window.canvas.apply_document_size()
+    window.canvas.set_tiles(image)
+    trace.info("Рисунок восстановлен из журнала автосохранения")
+    return True
+
 
 def main():
     setup_directories()
+    trace.install_crash_handler(CRASH_TRACE_FILE)
+    
+    args, qt_args = parse_args(sys.argv[1:])
+    if args.export_history:
+        sys.exit(export_history_cli(args))
+    if args.batch is not None:
+        sys.exit(run_batch(args.batch))
     
-    app = QApplication(sys.argv)
+    app = QApplication(sys.argv[:1] + qt_args)
     
     if os.path.exists("styles/styles.qss"):
         load_styles(app)
     else:
-        print("Файл стилей не найден, используется стандартный стиль")
+        trace.info("Файл стилей не найден, используется стандартный стиль")
     
     window = MainWindow()
     window.show()
+    offer_autosave_recovery(window)
+    window.autosave.start()
     sys.exit(app.exec())
 
 if __name__ == "__main__":
+    # В собранном PyInstaller exe процессы пакетной обработки запускают этот
+    # же файл; freeze_support выполняет в них задачу пула вместо main()
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
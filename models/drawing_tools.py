@@ -1,22 +1,94 @@
-from PyQt6.QtGui import QPainter, QPen, QColor, QImage
-from PyQt6.QtCore import QPoint, QRect, Qt
-from collections import deque
+from PyQt6.QtGui import QPen, QColor, QPolygon
+from PyQt6.QtCore import QRect, Qt
+from models.fill_engine import (image_to_array, color_to_pixel, scanline_fill,
+                                tolerance_fill, replace_color, tiled_fill, tiled_replace,
+                                ArrayTiles)
+from models.tiled_image import TiledImage
+from utils import trace
 
 class DrawingTool:
     def __init__(self):
         self.name = "base_tool"
+        # Состояние текущего мазка (begin_stroke / add_points / end_stroke)
+        self.stroke_image = None
+        self.stroke_pen = None
+        self.stroke_painters = {}
+        self.stroke_point = None
+        self.stroke_size = 0
+    
+    def create_pen(self, color, brush_size):
+        """Создает перо инструмента"""
+        return QPen(color, brush_size)
     
     def draw(self, painter, start_point, end_point, color, brush_size):
         pass
+    
+    def bounding_rect(self, start_point, end_point, brush_size):
+        """Прямоугольник, который затрагивает рисование, с учетом толщины пера"""
+        margin = brush_size // 2 + 2
+        rect = QRect(start_point, end_point).normalized()
+        return rect.adjusted(-margin, -margin, margin, margin)
+    
+    def begin_stroke(self, image, point, color, brush_size):
+        """Начинает мазок по тайловому изображению
+
+        Перо создается один раз на весь мазок, QPainter - один на каждый
+        затронутый тайл; они живут до конца мазка.
+        """
+        self.stroke_image = image
+        self.stroke_pen = self.create_pen(color, brush_size)
+        self.stroke_painters = {}
+        self.stroke_point = point
+        self.stroke_size = brush_size
+    
+    def stroke_painter(self, key):
+        """QPainter мазка для тайла (открывается при первом касании тайла)"""
+        tile = self.stroke_image.writable_tile(*key)
+        painter = self.stroke_painters.get(key)
+        if painter is None:
+            painter = self.stroke_image.begin_tile_painter(key, tile)
+            painter.setPen(self.stroke_pen)
+            self.stroke_painters[key] = painter
+        return painter
+    
+    def add_points(self, points):
+        """Продолжает мазок одной ломаной через точки, возвращает затронутый прямоугольник"""
+        if self.stroke_image is None or not points:
+            return QRect()
+        polyline = QPolygon([self.stroke_point] + list(points))
+        bounds = polyline.boundingRect()
+        dirty = self.bounding_rect(bounds.topLeft(), bounds.bottomRight(), self.stroke_size)
+        for key in self.stroke_image.tile_keys(dirty):
+            self.stroke_painter(key).drawPolyline(polyline)
+        self.stroke_point = points[-1]
+        return dirty
+    
+    def release_painters(self):
+        """Закрывает QPainter мазка, не прерывая сам мазок; возвращает ключи тайлов"""
+        keys = list(self.stroke_painters)
+        for painter in self.stroke_painters.values():
+            painter.end()
+        self.stroke_painters = {}
+        return keys
+    
+    def end_stroke(self):
+        """Завершает мазок и освобождает QPainter"""
+        if self.stroke_image is not None:
+            self.stroke_image.compact(self.release_painters())
+        self.stroke_image = None
+        self.stroke_point = None
 
 class BrushTool(DrawingTool):
     def __init__(self):
         super().__init__()
         self.name = "brush"
     
+    def create_pen(self, color, brush_size):
+        return QPen(color, brush_size, cap=Qt.PenCapStyle.RoundCap,
+                    join=Qt.PenJoinStyle.RoundJoin)
+    
     def draw(self, painter, start_point, end_point, color, brush_size):
-        pen = QPen(color, brush_size, cap=Qt.PenCapStyle.RoundCap)
-        painter.setPen(pen)
+        painter.setPen(self.create_pen(color, brush_size))
         painter.drawLine(start_point, end_point)
 
 class LineTool(DrawingTool):
@@ -25,8 +97,7 @@ class LineTool(DrawingTool):
         self.name = "line"
     
     def draw(self, painter, start_point, end_point, color, brush_size):
-        pen = QPen(color, brush_size)
-        painter.setPen(pen)
+        painter.setPen(self.create_pen(color, brush_size))
         painter.drawLine(start_point, end_point)
 
 class RectangleTool(DrawingTool):
@@ -35,8 +106,7 @@ class RectangleTool(DrawingTool):
         self.name = "rectangle"
     
     def draw(self, painter, start_point, end_point, color, brush_size):
-        pen = QPen(color, brush_size)
-        painter.setPen(pen)
+        painter.setPen(self.create_pen(color, brush_size))
         rect = QRect(start_point, end_point)
         painter.drawRect(rect)
 
@@ -46,8 +116,7 @@ class EllipseTool(DrawingTool):
         self.name = "ellipse"
     
     def draw(self, painter, start_point, end_point, color, brush_size):
-        pen = QPen(color, brush_size)
-        painter.setPen(pen)
+        painter.setPen(self.create_pen(color, brush_size))
         rect = QRect(start_point, end_point)
         painter.drawEllipse(rect)
 
@@ -56,54 +125,132 @@ class EraserTool(DrawingTool):
         super().__init__()
         self.name = "eraser"
     
+    def create_pen(self, color, brush_size):
+        return QPen(QColor(255, 255, 255), brush_size, cap=Qt.PenCapStyle.RoundCap,
+                    join=Qt.PenJoinStyle.RoundJoin)
+    
     def draw(self, painter, start_point, end_point, color, brush_size):
-        pen = QPen(QColor(255, 255, 255), brush_size, cap=Qt.PenCapStyle.RoundCap)
-        painter.setPen(pen)
+        painter.setPen(self.create_pen(color, brush_size))
         painter.drawLine(start_point, end_point)
 
 class FillTool(DrawingTool):
+    # Режимы заливки: связная область или замена цвета по всему изображению
+    MODE_CONTIGUOUS = "contiguous"
+    MODE_GLOBAL = "global"
+    
+    # С какой площади изображения (в пикселях) заливка выполняется параллельно по тайлам
+    PARALLEL_THRESHOLD = 4000000
+
     def __init__(self):
         super().__init__()
         self.name = "fill"
+        self.mode = self.MODE_CONTIGUOUS
+        self.tolerance = 0
+        self.workers = None
     
     def draw(self, painter, start_point, end_point, color, brush_size):
         """Реализация заливки области"""
         pass
     
+    def set_mode(self, mode):
+        self.mode = mode
+    
+    def set_tolerance(self, tolerance):
+        self.tolerance = max(0, min(255, int(tolerance)))
+    
+    def fill(self, image, start_point, new_color):
+        """Выполняет заливку в текущем режиме с текущим допуском"""
+        if isinstance(image, TiledImage):
+            return self.fill_tiles(image, start_point, new_color)
+        if self.mode == self.MODE_GLOBAL:
+            return self.replace_color(image, start_point, new_color, self.tolerance)
+        if image.width() * image.height() >= self.PARALLEL_THRESHOLD:
+            return self.tiled_fill(image, start_point, new_color, self.tolerance)
+        if self.tolerance > 0:
+            return self.tolerance_fill(image, start_point, new_color, self.tolerance)
+        return self.flood_fill(image, start_point, new_color)
+    
+    def fill_tiles(self, image, start_point, new_color):
+        """Заливка тайлового изображения: создаются только тайлы, где меняется цвет"""
+        try:
+            x, y = start_point.x(), start_point.y()
+            if x < 0 or x >= image.width() or y < 0 or y >= image.height():
+                return False
+            
+            generation = image.generation
+            value = color_to_pixel(image.blank_tile, new_color)
+            if self.mode == self.MODE_GLOBAL:
+                changed = tiled_replace(image, x, y, value, self.tolerance, self.workers)
+            else:
+                changed = tiled_fill(image, x, y, value, self.tolerance, self.workers)
+            
+            # Заливка белым могла вернуть тайлы к пустым
+            image.compact(image.changed_since(generation))
+            return changed > 0
+            
+        except Exception as e:
+            trace.error("Ошибка при заливке: {}", e)
+            return False
+    
     def flood_fill(self, image, start_point, new_color):
-        """Алгоритм заливки области (flood fill)"""
+        """Алгоритм заливки области (построчная заливка по буферу изображения)"""
         try:
-            old_color = image.pixelColor(start_point.x(), start_point.y())
+            x, y = start_point.x(), start_point.y()
+            
+            # Проверяем границы изображения
+            if x < 0 or x >= image.width() or y < 0 or y >= image.height():
+                return False
             
-            if old_color == new_color:
+            pixels = image_to_array(image)
+            filled = scanline_fill(pixels, x, y, color_to_pixel(image, new_color))
+            return filled > 0
+            
+        except Exception as e:
+            trace.error("Ошибка при заливке: {}", e)
+            return False
+    
+    def tolerance_fill(self, image, start_point, new_color, tolerance):
+        """Заливка связной области цветов, близких к цвету точки (с допуском)"""
+        try:
+            x, y = start_point.x(), start_point.y()
+            if x < 0 or x >= image.width() or y < 0 or y >= image.height():
                 return False
             
-            queue = deque([start_point])
-            visited = set()
+            pixels = image_to_array(image)
+            changed = tolerance_fill(pixels, x, y, color_to_pixel(image, new_color), tolerance)
+            return changed > 0
             
-            while queue:
-                point = queue.popleft()
-                x, y = point.x(), point.y()
-                
-                # Проверяем границы изображения
-                if (x < 0 or x >= image.width() or 
-                    y < 0 or y >= image.height()):
-                    continue
-                
-                if (x, y) in visited:
-                    continue
-                
-                if image.pixelColor(x, y) != old_color:
-                    continue
-                image.setPixelColor(x, y, new_color)
-                visited.add((x, y))
-                queue.append(QPoint(x + 1, y))
-                queue.append(QPoint(x - 1, y))
-                queue.append(QPoint(x, y + 1))
-                queue.append(QPoint(x, y - 1))
+        except Exception as e:
+            trace.error("Ошибка при заливке с допуском: {}", e)
+            return False
+    
+    def replace_color(self, image, start_point, new_color, tolerance=0):
+        """Заменяет цвет точки (с допуском) по всему изображению"""
+        try:
+            x, y = start_point.x(), start_point.y()
+            if x < 0 or x >= image.width() or y < 0 or y >= image.height():
+                return False
+            
+            pixels = image_to_array(image)
+            changed = replace_color(pixels, x, y, color_to_pixel(image, new_color), tolerance)
+            return changed > 0
+            
+        except Exception as e:
+            trace.error("Ошибка при замене цвета: {}", e)
+            return False
+    
+    def tiled_fill(self, image, start_point, new_color, tolerance=0):
+        """Параллельная заливка по тайлам для больших изображений"""
+        try:
+            x, y = start_point.x(), start_point.y()
+            if x < 0 or x >= image.width() or y < 0 or y >= image.height():
+                return False
             
-            return True
+            tiles = ArrayTiles(image_to_array(image))
+            changed = tiled_fill(tiles, x, y, color_to_pixel(image, new_color),
+                                 tolerance, self.workers)
+            return changed > 0
             
         except Exception as e:
-            print(f"Ошибка при заливке: {e}")
-            return False
\ No newline at end of file
+            trace.error("Ошибка при параллельной заливке: {}", e)
+            return False
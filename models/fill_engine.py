@@ -0,0 +1,452 @@
+import copy
+import ctypes
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PyQt6.QtGui import QImage
+
+# Форматы, с буфером которых движок заливки работает напрямую (32 бита на пиксель)
+DIRECT_FORMATS = (QImage.Format.Format_RGB32, QImage.Format.Format_ARGB32)
+
+# Начальный размер окна поиска границы отрезка (удваивается при каждом шаге)
+SEARCH_WINDOW = 64
+
+# Размер стороны тайла для параллельной заливки
+FILL_TILE_SIZE = 512
+
+
+def _image_pixels(image, pointer):
+    """Массив NumPy (высота x ширина, uint32) поверх буфера pointer изображения image
+
+    Массив держит ссылку на image через объект буфера (numpy хранит его в
+    base), поэтому буфер не освобождается, пока жив массив или его срезы.
+    """
+    buffer = (ctypes.c_char * image.sizeInBytes()).from_address(int(pointer))
+    buffer.image = image
+    stride = image.bytesPerLine() // 4
+    pixels = np.frombuffer(buffer, dtype=np.uint32).reshape(image.height(), stride)
+    return pixels[:, :image.width()]
+
+
+def image_to_array(image):
+    """Возвращает массив NumPy (высота x ширина, uint32), разделяющий память с QImage"""
+    if image.format() not in DIRECT_FORMATS:
+        image.convertTo(QImage.Format.Format_ARGB32)
+
+    # bits() у неконстантного изображения отделяет общий буфер, поэтому запись безопасна
+    return _image_pixels(image, image.bits())
+
+
+def image_to_readonly_array(image):
+    """Массив NumPy только для чтения поверх буфера QImage
+
+    constBits() не отделяет буфер, общий с копиями изображения (снимками и
+    историей отмены), поэтому чтение не копирует пиксели. Изображение другого
+    формата сначала преобразуется; массив держит преобразованную копию.
+    """
+    if image.format() not in DIRECT_FORMATS:
+        image = image.convertToFormat(QImage.Format.Format_ARGB32)
+    pixels = _image_pixels(image, image.constBits())
+    pixels.flags.writeable = False
+    return pixels
+
+
+def color_to_pixel(image, color):
+    """Переводит QColor в значение пикселя для формата изображения"""
+    if image.format() == QImage.Format.Format_RGB32:
+        return np.uint32(color.rgb())
+    return np.uint32(color.rgba())
+
+
+def _span_end(row, x, old_value):
+    """Находит правую (не включительно) границу отрезка цвета old_value, начиная с x"""
+    width = row.shape[0]
+    position = x
+    window = SEARCH_WINDOW
+    while position < width:
+        stop = min(position + window, width)
+        different = row[position:stop] != old_value
+        index = different.argmax()
+        if different[index]:
+            return position + int(index)
+        position = stop
+        window *= 2
+    return width
+
+
+def _span_start(row, x, old_value):
+    """Находит левую (включительно) границу отрезка цвета old_value, заканчивающегося в x"""
+    position = x + 1
+    window = SEARCH_WINDOW
+    while position > 0:
+        start = max(position - window, 0)
+        different = row[start:position][::-1] != old_value
+        index = different.argmax()
+        if different[index]:
+            return position - int(index)
+        position = start
+        window *= 2
+    return 0
+
+
+def _push_spans(row, left, right, old_value, y, stack):
+    """Добавляет в стек по одной затравке на каждый отрезок цвета old_value в row[left:right]"""
+    matches = (row[left:right] == old_value).view(np.int8)
+    starts = np.flatnonzero(np.diff(matches, prepend=np.int8(0)) == 1)
+    for start in starts.tolist():
+        stack.append((left + start, y))
+
+
+def scanline_fill(pixels, x, y, new_value):
+    """Построчная заливка отрезками (4-связность), возвращает число залитых пикселей
+
+    Залитые пиксели сразу получают новый цвет и перестают совпадать со старым,
+    поэтому множество посещенных точек не требуется.
+    """
+    height, width = pixels.shape
+    old_value = pixels[y, x]
+    new_value = np.uint32(new_value)
+    if old_value == new_value:
+        return 0
+
+    filled = 0
+    stack = [(x, y)]
+    while stack:
+        x, y = stack.pop()
+        row = pixels[y]
+        if row[x] != old_value:
+            continue
+
+        left = _span_start(row, x, old_value)
+        right = _span_end(row, x, old_value)
+        row[left:right] = new_value
+        filled += right - left
+
+        # Затравки для соседних строк берем только в пределах залитого отрезка
+        if y > 0:
+            _push_spans(pixels[y - 1], left, right, old_value, y - 1, stack)
+        if y + 1 < height:
+            _push_spans(pixels[y + 1], left, right, old_value, y + 1, stack)
+
+    return filled
+
+
+def color_distance_mask(pixels, reference, tolerance):
+    """Маска пикселей, каждый канал которых отличается от reference не более чем на tolerance"""
+    if tolerance <= 0:
+        return pixels == reference
+    reference = int(reference)
+    mask = np.ones(pixels.shape, dtype=bool)
+    for shift in (0, 8, 16, 24):
+        channel = ((pixels >> shift) & 0xFF).astype(np.int16)
+        mask &= np.abs(channel - ((reference >> shift) & 0xFF)) <= tolerance
+    return mask
+
+
+def find_runs(mask):
+    """Разбивает маску на горизонтальные отрезки: (строки, начала, концы не включительно)
+
+    Отрезки упорядочены по строкам, внутри строки - слева направо.
+    """
+    height, width = mask.shape
+    padded = np.zeros((height, width + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    return rows, starts, ends
+
+
+def _overlapping_pairs(rows, starts, ends, width):
+    """Находит пары отрезков соседних строк, касающихся друг друга (4-связность)"""
+    stride = width + 1
+    start_keys = rows * stride + starts
+    end_keys = rows * stride + ends
+    above = (rows - 1) * stride
+
+    # Для отрезка b подходят отрезки строки выше с end > start_b и start < end_b
+    lower = np.searchsorted(end_keys, above + starts, side='right')
+    upper = np.searchsorted(start_keys, above + ends, side='left')
+    counts = np.maximum(upper - lower, 0)
+
+    total = int(counts.sum())
+    below_runs = np.repeat(np.arange(len(rows)), counts)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    above_runs = np.repeat(lower, counts) + offsets
+    return above_runs, below_runs
+
+
+def label_runs(rows, starts, ends, width):
+    """Разметка связных компонент по отрезкам
+
+    Возвращает для каждого отрезка метку компоненты - индекс ее первого отрезка.
+    """
+    labels = np.arange(len(rows))
+    first, second = _overlapping_pairs(rows, starts, ends, width)
+
+    while len(first):
+        first_labels = labels[first]
+        second_labels = labels[second]
+        if np.array_equal(first_labels, second_labels):
+            break
+
+        # Подвешиваем корни компонент к меньшей метке и сжимаем пути
+        lowest = np.minimum(first_labels, second_labels)
+        np.minimum.at(labels, first_labels, lowest)
+        np.minimum.at(labels, second_labels, lowest)
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+
+    return labels
+
+
+def runs_to_mask(shape, rows, starts, ends):
+    """Собирает маску изображения из набора отрезков"""
+    height, width = shape
+    delta = np.zeros((height, width + 1), dtype=np.int8)
+    delta[rows, starts] = 1
+    delta[rows, ends] = -1
+    return np.cumsum(delta, axis=1, dtype=np.int8)[:, :width].astype(bool)
+
+
+def tolerance_fill(pixels, x, y, new_value, tolerance):
+    """Заливка связной области похожих цветов, возвращает число измененных пикселей"""
+    height, width = pixels.shape
+    new_value = np.uint32(new_value)
+    mask = color_distance_mask(pixels, pixels[y, x], tolerance)
+    rows, starts, ends = find_runs(mask)
+    labels = label_runs(rows, starts, ends, width)
+
+    # Отрезок с затравкой: последний отрезок, начинающийся не правее точки (x, y)
+    stride = width + 1
+    seed_run = np.searchsorted(rows * stride + starts, y * stride + x, side='right') - 1
+    selected = labels == labels[seed_run]
+    region = runs_to_mask(pixels.shape, rows[selected], starts[selected], ends[selected])
+
+    changed = region & (pixels != new_value)
+    pixels[changed] = new_value
+    return int(np.count_nonzero(changed))
+
+
+def replace_color(pixels, x, y, new_value, tolerance):
+    """Заменяет цвет точки (x, y) по всему изображению, возвращает число измененных пикселей"""
+    new_value = np.uint32(new_value)
+    mask = color_distance_mask(pixels, pixels[y, x], tolerance)
+    mask &= pixels != new_value
+    pixels[mask] = new_value
+    return int(np.count_nonzero(mask))
+
+
+class ArrayTiles:
+    """Сетка тайлов поверх сплошного массива пикселей (тайлы - представления массива)"""
+
+    def __init__(self, pixels, tile_size=FILL_TILE_SIZE):
+        self.pixels = pixels
+        self.tile_size = tile_size
+        height, width = pixels.shape
+        self.columns = (width + tile_size - 1) // tile_size
+        self.rows = (height + tile_size - 1) // tile_size
+
+    def read(self, tile_x, tile_y):
+        size = self.tile_size
+        return self.pixels[tile_y * size:(tile_y + 1) * size, tile_x * size:(tile_x + 1) * size]
+
+    def write(self, tile_x, tile_y):
+        return self.read(tile_x, tile_y)
+
+
+class DisjointSet:
+    """Система непересекающихся множеств со сжатием путей"""
+
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, item):
+        root = item
+        while self.parent.get(root, root) != root:
+            root = self.parent[root]
+        while item != root:
+            item, self.parent[item] = self.parent[item], root
+        return root
+
+    def union(self, first, second):
+        first, second = self.find(first), self.find(second)
+        if first != second:
+            low, high = min(first, second), max(first, second)
+            self.parent[high] = low
+
+
+class TileLabels:
+    """Отрезки и компоненты одного тайла с глобальными номерами компонент"""
+
+    def __init__(self, rows, starts, ends, labels, width, height):
+        self.rows = rows
+        self.starts = starts
+        self.ends = ends
+        self.width = width
+        self.height = height
+        # Сжимаем метки в 0..k-1, глобальный номер = смещение тайла + локальный номер
+        components, self.components = np.unique(labels, return_inverse=True)
+        self.count = len(components)
+        self.offset = 0
+
+    def global_ids(self, selection=slice(None)):
+        return self.components[selection] + self.offset
+
+    def row_runs(self, row):
+        """Индексы отрезков указанной строки тайла"""
+        first = np.searchsorted(self.rows, row, side='left')
+        last = np.searchsorted(self.rows, row, side='right')
+        return np.arange(first, last)
+
+
+def _label_tile(pixels, reference, tolerance):
+    """Разметка компонент похожих цветов внутри одного тайла"""
+    height, width = pixels.shape
+    mask = color_distance_mask(pixels, reference, tolerance)
+    rows, starts, ends = find_runs(mask)
+    labels = label_runs(rows, starts, ends, width)
+    return TileLabels(rows, starts, ends, labels, width, height)
+
+
+def _vertical_pairs(top, bottom):
+    """Пары компонент, касающихся горизонтальной границы между тайлами"""
+    upper = top.row_runs(top.height - 1)
+    lower = bottom.row_runs(0)
+    if not len(upper) or not len(lower):
+        return None
+
+    # Отрезки внутри строки упорядочены, поэтому пересечения ищем бинарным поиском
+    first = np.searchsorted(top.ends[upper], bottom.starts[lower], side='right')
+    last = np.searchsorted(top.starts[upper], bottom.ends[lower], side='left')
+    counts = np.maximum(last - first, 0)
+    offsets = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+    upper_runs = upper[np.repeat(first, counts) + offsets]
+    lower_runs = np.repeat(lower, counts)
+    return top.global_ids(upper_runs), bottom.global_ids(lower_runs)
+
+
+def _horizontal_pairs(left, right):
+    """Пары компонент, касающихся вертикальной границы между тайлами"""
+    touching_left = np.flatnonzero(left.ends == left.width)
+    touching_right = np.flatnonzero(right.starts == 0)
+    if not len(touching_left) or not len(touching_right):
+        return None
+
+    # В каждой строке не больше одного отрезка у края, сопоставляем по номеру строки
+    common_rows, left_index, right_index = np.intersect1d(
+        left.rows[touching_left], right.rows[touching_right],
+        assume_unique=True, return_indices=True)
+    return (left.global_ids(touching_left[left_index]),
+            right.global_ids(touching_right[right_index]))
+
+
+def _merge_pairs(pairs, regions):
+    """Объединяет компоненты из найденных пар, повторяющиеся пары учитываются один раз"""
+    if not pairs:
+        return
+    unique = np.unique(np.stack([np.concatenate(side) for side in zip(*pairs)], axis=1), axis=0)
+    for first, second in unique.tolist():
+        regions.union(first, second)
+
+
+def _paint_tile(pixels, tile_labels, selected, new_value):
+    """Заливает в тайле отрезки выбранной компоненты, возвращает число измененных пикселей"""
+    region = runs_to_mask(pixels.shape, tile_labels.rows[selected],
+                          tile_labels.starts[selected], tile_labels.ends[selected])
+    changed = region & (pixels != new_value)
+    pixels[changed] = new_value
+    return int(np.count_nonzero(changed))
+
+
+def tiled_fill(tiles, x, y, new_value, tolerance=0, workers=None):
+    """Параллельная заливка по тайлам, возвращает число измененных пикселей
+
+    Компоненты размечаются в каждом тайле на пуле потоков (NumPy отпускает GIL),
+    затем компоненты на границах тайлов объединяются через систему
+    непересекающихся множеств. tiles - сетка с методами read/write (ArrayTiles).
+    Если у сетки есть метод tile_token, тайлы с одинаковым токеном (например,
+    пустые) размечаются один раз.
+    """
+    size = tiles.tile_size
+    new_value = np.uint32(new_value)
+    seed_tile = (x // size, y // size)
+    reference = tiles.read(*seed_tile)[y % size, x % size]
+    keys = [(tile_x, tile_y) for tile_y in range(tiles.rows) for tile_x in range(tiles.columns)]
+    workers = workers or os.cpu_count() or 1
+    tile_token = getattr(tiles, 'tile_token', lambda tile_x, tile_y: None)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        tokens = {key: tile_token(*key) for key in keys}
+        shared = {}
+        for key, token in tokens.items():
+            if token is not None and token not in shared:
+                shared[token] = key
+        unique_keys = [key for key in keys if tokens[key] is None] + list(shared.values())
+        labelled = executor.map(lambda key: _label_tile(tiles.read(*key), reference, tolerance),
+                                unique_keys)
+        computed = dict(zip(unique_keys, labelled))
+
+        # Разметка общих тайлов копируется: у каждого тайла свое смещение номеров
+        grid = {}
+        for key in keys:
+            token = tokens[key]
+            grid[key] = computed[key] if token is None else copy.copy(computed[shared[token]])
+
+        # Глобальная нумерация компонент и объединение по границам тайлов
+        total = 0
+        for key in keys:
+            grid[key].offset = total
+            total += grid[key].count
+        pairs = []
+        for tile_x, tile_y in keys:
+            if tile_x + 1 < tiles.columns:
+                pairs.append(_horizontal_pairs(grid[(tile_x, tile_y)], grid[(tile_x + 1, tile_y)]))
+            if tile_y + 1 < tiles.rows:
+                pairs.append(_vertical_pairs(grid[(tile_x, tile_y)], grid[(tile_x, tile_y + 1)]))
+        regions = DisjointSet()
+        _merge_pairs([pair for pair in pairs if pair is not None], regions)
+
+        roots = np.arange(total)
+        for item in list(regions.parent):
+            roots[item] = regions.find(item)
+
+        seed_labels = grid[seed_tile]
+        local_x, local_y = x % size, y % size
+        stride = seed_labels.width + 1
+        seed_run = np.searchsorted(seed_labels.rows * stride + seed_labels.starts,
+                                   local_y * stride + local_x, side='right') - 1
+        seed_root = roots[seed_labels.global_ids(seed_run)]
+
+        # Тайлы для записи получаем заранее в текущем потоке, заливаем параллельно
+        jobs = []
+        for key in keys:
+            selected = roots[grid[key].global_ids()] == seed_root
+            if selected.any():
+                jobs.append((tiles.write(*key), grid[key], selected))
+        changed = executor.map(lambda job: _paint_tile(job[0], job[1], job[2], new_value), jobs)
+        return sum(changed)
+
+
+def tiled_replace(tiles, x, y, new_value, tolerance=0, workers=None):
+    """Замена цвета точки (x, y) во всех тайлах, возвращает число измененных пикселей"""
+    size = tiles.tile_size
+    new_value = np.uint32(new_value)
+    reference = tiles.read(x // size, y // size)[y % size, x % size]
+    keys = [(tile_x, tile_y) for tile_y in range(tiles.rows) for tile_x in range(tiles.columns)]
+    workers = workers or os.cpu_count() or 1
+
+    def find_matches(key):
+        pixels = tiles.read(*key)
+        return color_distance_mask(pixels, reference, tolerance) & (pixels != new_value)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        masks = dict(zip(keys, executor.map(find_matches, keys)))
+        jobs = [(tiles.write(*key), mask) for key, mask in masks.items() if mask.any()]
+        for pixels, mask in jobs:
+            pixels[mask] = new_value
+        return sum(int(np.count_nonzero(mask)) for _, mask in jobs)
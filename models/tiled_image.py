@@ -0,0 +1,232 @@
+import itertools
+
+from PyQt6.QtGui import QImage, QPainter, QColor
+from PyQt6.QtCore import QRect, QSize, Qt
+from models.fill_engine import image_to_array, image_to_readonly_array
+
+# Размер стороны тайла в пикселях
+TILE_SIZE = 256
+
+# Значение белого пикселя в формате Format_RGB32
+WHITE_PIXEL = 0xFFFFFFFF
+
+# Источник идентификаторов документов (см. TiledImage.document_id)
+_document_ids = itertools.count(1)
+
+
+class TiledImage:
+    """Разреженное изображение из тайлов
+
+    Тайлы создаются только при первой записи. Незаписанные и полностью белые
+    тайлы не хранятся: вместо них используется один общий белый тайл, поэтому
+    память растет вместе с нарисованным, а не с площадью холста.
+    """
+
+    def __init__(self, width, height, tile_size=TILE_SIZE):
+        self._width = max(0, width)
+        self._height = max(0, height)
+        self.tile_size = tile_size
+        self.tiles = {}
+        self.blank_tile = QImage(tile_size, tile_size, QImage.Format.Format_RGB32)
+        self.blank_tile.fill(Qt.GlobalColor.white)
+        self._blank_pixels = image_to_readonly_array(self.blank_tile)
+        # Счетчик записей: по нему потребители находят тайлы, измененные с прошлого раза
+        self.generation = 0
+        self.tile_generations = {}
+        # Идентификатор документа: снимки наследуют его вместе со счетчиком записей
+        self.document_id = next(_document_ids)
+
+    @classmethod
+    def from_qimage(cls, image, tile_size=TILE_SIZE):
+        """Создает тайловое изображение из QImage"""
+        tiled = cls(image.width(), image.height(), tile_size)
+        tiled.draw_image(0, 0, image)
+        return tiled
+
+    # Размеры
+
+    def width(self):
+        return self._width
+
+    def height(self):
+        return self._height
+
+    def size(self):
+        return QSize(self._width, self._height)
+
+    def rect(self):
+        return QRect(0, 0, self._width, self._height)
+
+    @property
+    def columns(self):
+        return (self._width + self.tile_size - 1) // self.tile_size
+
+    @property
+    def rows(self):
+        return (self._height + self.tile_size - 1) // self.tile_size
+
+    def resize(self, width, height):
+        """Меняет размер документа без копирования пикселей
+
+        Тайлы за новыми границами не удаляются: емкость только растет, и при
+        обратном увеличении содержимое возвращается без повторного выделения.
+        """
+        self._width, self._height = max(0, width), max(0, height)
+
+    # Доступ к тайлам
+
+    def tile_rect(self, tile_x, tile_y):
+        size = self.tile_size
+        return QRect(tile_x * size, tile_y * size, size, size)
+
+    def tile_keys(self, rect):
+        """Ключи тайлов, пересекающих прямоугольник (в пределах изображения)"""
+        rect = rect.intersected(self.rect())
+        if rect.isEmpty():
+            return []
+        size = self.tile_size
+        return [(tile_x, tile_y)
+                for tile_y in range(rect.top() // size, rect.bottom() // size + 1)
+                for tile_x in range(rect.left() // size, rect.right() // size + 1)]
+
+    def tile(self, tile_x, tile_y):
+        """Тайл для чтения (общий белый тайл, если тайл не создан)"""
+        return self.tiles.get((tile_x, tile_y), self.blank_tile)
+
+    def is_blank(self, tile_x, tile_y):
+        return (tile_x, tile_y) not in self.tiles
+
+    def writable_tile(self, tile_x, tile_y):
+        """Тайл для записи: создается при первом обращении и помечается измененным"""
+        key = (tile_x, tile_y)
+        tile = self.tiles.get(key)
+        if tile is None:
+            tile = self.blank_tile.copy()
+            self.tiles[key] = tile
+        self.generation += 1
+        self.tile_generations[key] = self.generation
+        return tile
+
+    def set_tile(self, key, tile):
+        """Заменяет тайл целиком (None - белый тайл)"""
+        if tile is None:
+            self.discard_tile(key)
+            return
+        self.tiles[key] = tile
+        self.generation += 1
+        self.tile_generations[key] = self.generation
+
+    def discard_tile(self, key):
+        """Возвращает тайл к общему белому"""
+        if self.tiles.pop(key, None) is not None:
+            self.generation += 1
+            self.tile_generations[key] = self.generation
+
+    def changed_since(self, generation):
+        """Ключи тайлов, измененных после указанного значения счетчика записей"""
+        return [key for key, changed in self.tile_generations.items() if changed > generation]
+
+    def compact(self, keys=None):
+        """Освобождает тайлы, которые стали полностью белыми"""
+        for key in list(self.tiles if keys is None else keys):
+            tile = self.tiles.get(key)
+            if tile is not None and (image_to_readonly_array(tile) == WHITE_PIXEL).all():
+                self.discard_tile(key)
+
+    def snapshot(self):
+        """Снимок изображения с копированием при записи
+
+        QImage тайлов разделяют данные неявно, поэтому снимок стоит O(число
+        тайлов), а пиксели копируются только при следующей записи в оригинал.
+        Перед снимком у тайлов не должно быть открытых QPainter.
+        """
+        copy = TiledImage(self._width, self._height, self.tile_size)
+        copy.tiles = {key: QImage(tile) for key, tile in self.tiles.items()}
+        copy.document_id = self.document_id
+        copy.generation = self.generation
+        copy.tile_generations = dict(self.tile_generations)
+        return copy
+
+    def memory_usage(self):
+        """Объем памяти под созданные тайлы в байтах"""
+        return sum(tile.sizeInBytes() for tile in self.tiles.values())
+
+    # Сетка тайлов для движка заливки (см. models.fill_engine.tiled_fill)
+
+    def _visible_size(self, tile_x, tile_y):
+        size = self.tile_size
+        return (min(size, self._height - tile_y * size), min(size, self._width - tile_x * size))
+
+    def read(self, tile_x, tile_y):
+        height, width = self._visible_size(tile_x, tile_y)
+        tile = self.tiles.get((tile_x, tile_y))
+        pixels = self._blank_pixels if tile is None else image_to_readonly_array(tile)
+        return pixels[:height, :width]
+
+    def write(self, tile_x, tile_y):
+        height, width = self._visible_size(tile_x, tile_y)
+        return image_to_array(self.writable_tile(tile_x, tile_y))[:height, :width]
+
+    def tile_token(self, tile_x, tile_y):
+        if (tile_x, tile_y) in self.tiles:
+            return None
+        return ("blank",) + self._visible_size(tile_x, tile_y)
+
+    # Рисование
+
+    def begin_tile_painter(self, key, tile):
+        """Открывает QPainter тайла в координатах изображения с отсечением по границам"""
+        painter = QPainter(tile)
+        painter.translate(-key[0] * self.tile_size, -key[1] * self.tile_size)
+        painter.setClipRect(self.rect())
+        return painter
+
+    def paint_tile(self, key, draw):
+        """Рисует в одном тайле в координатах изображения"""
+        tile = self.writable_tile(*key)
+        painter = self.begin_tile_painter(key, tile)
+        draw(painter)
+        painter.end()
+
+    def paint(self, rect, draw):
+        """Рисует функцией draw(painter) во всех тайлах, пересекающих rect"""
+        keys = self.tile_keys(rect)
+        for key in keys:
+            self.paint_tile(key, draw)
+        return keys
+
+    def draw_image(self, x, y, image):
+        """Рисует QImage в точке (x, y), пропуская полностью белые тайлы"""
+        keys = self.paint(QRect(x, y, image.width(), image.height()),
+                          lambda painter: painter.drawImage(x, y, image))
+        self.compact(keys)
+
+    def clear(self):
+        """Очищает изображение (все тайлы становятся белыми)"""
+        for key in list(self.tiles):
+            self.discard_tile(key)
+
+    def draw_to(self, painter, rect):
+        """Выводит область rect изображения через painter (в координатах изображения)"""
+        rect = rect.intersected(self.rect())
+        for key in self.tile_keys(rect):
+            tile_rect = self.tile_rect(*key)
+            target = tile_rect.intersected(rect)
+            tile = self.tiles.get(key)
+            if tile is None:
+                painter.fillRect(target, QColor(255, 255, 255))
+            else:
+                painter.drawImage(target, tile, target.translated(-tile_rect.topLeft()))
+
+    def to_qimage(self, rect=None):
+        """Собирает сплошной QImage (Format_RGB32) из области rect или всего изображения"""
+        rect = self.rect() if rect is None else rect.intersected(self.rect())
+        image = QImage(rect.size(), QImage.Format.Format_RGB32)
+        image.fill(Qt.GlobalColor.white)
+        if rect.isEmpty():
+            return image
+        painter = QPainter(image)
+        painter.translate(-rect.x(), -rect.y())
+        self.draw_to(painter, rect)
+        painter.end()
+        return image
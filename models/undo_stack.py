@@ -0,0 +1,161 @@
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt6.QtGui import QImage
+
+# Бюджет памяти истории по умолчанию (байт)
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024
+
+# Уровень сжатия zlib: быстрый, тайлы рисунка и так хорошо сжимаются
+COMPRESSION_LEVEL = 1
+
+
+def share_tile(tile):
+    """Неявно разделяемая копия тайла: данные скопируются только при записи в оригинал"""
+    return None if tile is None else QImage(tile)
+
+
+def encode_tile(tile):
+    """Сжимает пиксели тайла zlib (None - белый тайл)"""
+    if tile is None:
+        return None
+    pointer = tile.constBits()
+    pointer.setsize(tile.sizeInBytes())
+    data = zlib.compress(pointer.asstring(), COMPRESSION_LEVEL)
+    return (tile.width(), tile.height(), tile.bytesPerLine(), tile.format(), data)
+
+
+def decode_tile(encoded):
+    """Восстанавливает QImage тайла из результата encode_tile"""
+    if encoded is None:
+        return None
+    width, height, bytes_per_line, image_format, data = encoded
+    raw = zlib.decompress(data)
+    # copy() отвязывает изображение от временного буфера raw
+    return QImage(raw, width, height, bytes_per_line, image_format).copy()
+
+
+class TileDelta:
+    """Содержимое набора тайлов до изменения; сжимается в фоновом потоке"""
+
+    def __init__(self, tiles, executor):
+        self.keys = list(tiles)
+        self.tiles = tiles
+        self.raw_size = sum(tile.sizeInBytes() for tile in tiles.values() if tile is not None)
+        self.compressed_size = None
+        self.future = executor.submit(self._compress, tiles)
+
+    def _compress(self, tiles):
+        encoded = {key: encode_tile(tile) for key, tile in tiles.items()}
+        self.compressed_size = sum(len(item[4]) for item in encoded.values() if item is not None)
+        return encoded
+
+    def memory_usage(self):
+        if self.compressed_size is None:
+            return self.raw_size
+        return self.compressed_size
+
+    def restore(self, image):
+        """Возвращает тайлы в изображение"""
+        if self.future.cancel():
+            tiles = self.tiles
+        else:
+            tiles = {key: decode_tile(item) for key, item in self.future.result().items()}
+        for key, tile in tiles.items():
+            image.set_tile(key, tile)
+
+    def release(self):
+        """Освобождает несжатые тайлы после завершения сжатия"""
+        if self.future.done() and not self.future.cancelled():
+            self.tiles = None
+
+
+class UndoStack:
+    """История отмены и повтора на уровне тайлов
+
+    Перед операцией запоминается словарь тайлов (QImage разделяют данные
+    неявно, поэтому это дешево), после операции в историю попадают только
+    тайлы, измененные за операцию. Старые записи вытесняются при превышении
+    бюджета памяти.
+    """
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self.undo_entries = []
+        self.redo_entries = []
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="undo")
+        self.pending = None
+
+    def set_memory_budget(self, memory_budget):
+        self.memory_budget = memory_budget
+        self.trim()
+
+    def begin(self, image):
+        """Начинает запись операции над изображением"""
+        if self.pending is None:
+            snapshot = {key: share_tile(tile) for key, tile in image.tiles.items()}
+            self.pending = (image, snapshot, image.generation)
+
+    def commit(self):
+        """Завершает запись операции; возвращает True, если изображение изменилось"""
+        if self.pending is None:
+            return False
+        image, snapshot, generation = self.pending
+        self.pending = None
+
+        changed = image.changed_since(generation)
+        if not changed:
+            return False
+        self.undo_entries.append(TileDelta({key: snapshot.get(key) for key in changed},
+                                           self.executor))
+        self.redo_entries = []
+        self.trim()
+        return True
+
+    def can_undo(self):
+        return bool(self.undo_entries)
+
+    def can_redo(self):
+        return bool(self.redo_entries)
+
+    def undo(self, image):
+        return self._move(image, self.undo_entries, self.redo_entries)
+
+    def redo(self, image):
+        return self._move(image, self.redo_entries, self.undo_entries)
+
+    def _move(self, image, source, target):
+        """Применяет последнюю запись source, текущее состояние тайлов уходит в target"""
+        self.commit()
+        if not source:
+            return False
+        delta = source.pop()
+        current = {key: share_tile(image.tiles.get(key)) for key in delta.keys}
+        target.append(TileDelta(current, self.executor))
+        delta.restore(image)
+        self.trim()
+        return True
+
+    def memory_usage(self):
+        return sum(entry.memory_usage() for entry in self.undo_entries + self.redo_entries)
+
+    def trim(self):
+        """Вытесняет самые старые записи, пока история не уложится в бюджет"""
+        for entry in self.undo_entries + self.redo_entries:
+            entry.release()
+        while self.memory_usage() > self.memory_budget:
+            if self.undo_entries:
+                self.undo_entries.pop(0)
+            elif self.redo_entries:
+                self.redo_entries.pop(0)
+            else:
+                break
+
+    def clear(self):
+        self.undo_entries = []
+        self.redo_entries = []
+        self.pending = None
+
+    def shutdown(self):
+        self.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
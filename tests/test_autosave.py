@@ -0,0 +1,66 @@
+from PyQt6.QtCore import QRect
+from PyQt6.QtGui import QColor
+
+from models.tiled_image import TiledImage
+from utils.autosave import AutosaveService, replay_journal
+
+
+class FakeCanvas:
+    """Холст для сервиса автосохранения: только изображение и снимок"""
+
+    def __init__(self, image):
+        self.image = image
+
+    def snapshot_image(self):
+        return self.image.snapshot()
+
+
+def fill_rect(image, rect, color):
+    image.paint(rect, lambda painter: painter.fillRect(rect, QColor(*color)))
+
+
+def write_checkpoint(service, canvas):
+    service.write_checkpoint(canvas.snapshot_image())
+
+
+def test_replay_restores_last_checkpoint(qapp, tmp_path):
+    path = str(tmp_path / "autosave.journal")
+    canvas = FakeCanvas(TiledImage(800, 600))
+    service = AutosaveService(canvas, path=path)
+
+    fill_rect(canvas.image, QRect(0, 0, 300, 300), (200, 0, 0))
+    write_checkpoint(service, canvas)
+    fill_rect(canvas.image, QRect(700, 500, 50, 50), (0, 0, 200))
+    canvas.image.discard_tile((0, 0))
+    write_checkpoint(service, canvas)
+
+    replayed = replay_journal(path)
+    assert replayed.size() == canvas.image.size()
+    assert replayed.to_qimage() == canvas.image.to_qimage()
+
+
+def test_torn_tail_is_ignored(qapp, tmp_path):
+    path = tmp_path / "autosave.journal"
+    canvas = FakeCanvas(TiledImage(600, 600))
+    service = AutosaveService(canvas, path=str(path))
+
+    fill_rect(canvas.image, QRect(0, 0, 100, 100), (10, 20, 30))
+    write_checkpoint(service, canvas)
+    committed = canvas.image.to_qimage()
+    committed_size = path.stat().st_size
+
+    fill_rect(canvas.image, QRect(400, 400, 100, 100), (40, 50, 60))
+    write_checkpoint(service, canvas)
+    data = path.read_bytes()
+
+    # Обрыв в любом месте второй точки оставляет первую
+    for cut in (committed_size + 3, committed_size + 30, len(data) - 1):
+        path.write_bytes(data[:cut])
+        assert replay_journal(str(path)).to_qimage() == committed
+
+
+def test_missing_or_empty_journal(tmp_path):
+    assert replay_journal(str(tmp_path / "missing.journal")) is None
+    empty = tmp_path / "empty.journal"
+    empty.write_bytes(b"")
+    assert replay_journal(str(empty)) is None
@@ -0,0 +1,24 @@
+import os
+
+from utils.batch import plan_outputs
+
+
+def test_colliding_names_get_suffixes(tmp_path):
+    out = str(tmp_path / "out")
+    inputs = ["a/x.png", "b/x.png", "c/x.jpg", "y.bmp"]
+    plan = plan_outputs(inputs, out, ".png")
+
+    assert [output for _, output, _ in plan] == [
+        os.path.join(out, "x.png"), os.path.join(out, "x_2.png"),
+        os.path.join(out, "x_3.png"), os.path.join(out, "y.png")]
+    assert all(error is None for _, _, error in plan)
+
+
+def test_output_never_replaces_input(tmp_path):
+    source = str(tmp_path / "x.png")
+    other = str(tmp_path / "y.jpg")
+    plan = plan_outputs([source, other], str(tmp_path), ".png")
+
+    filename, output, error = plan[0]
+    assert filename == source and output is None and error
+    assert plan[1] == (other, str(tmp_path / "y.png"), None)
@@ -0,0 +1,153 @@
+import os
+import sqlite3
+
+import pytest
+
+from utils.database import DatabaseManager, migrate_stats_indexes
+
+# Схема БД до версионных миграций
+LEGACY_SCHEMA = '''
+    CREATE TABLE drawing_sessions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        start_time TEXT NOT NULL,
+        end_time TEXT,
+        tools_used TEXT
+    );
+    CREATE TABLE drawing_actions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id INTEGER,
+        tool_name TEXT NOT NULL,
+        color TEXT NOT NULL,
+        brush_size INTEGER,
+        timestamp TEXT NOT NULL,
+        FOREIGN KEY (session_id) REFERENCES drawing_sessions (id)
+    );
+    CREATE TABLE saved_files (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id INTEGER,
+        filename TEXT NOT NULL,
+        file_format TEXT NOT NULL,
+        save_time TEXT NOT NULL,
+        file_size INTEGER,
+        FOREIGN KEY (session_id) REFERENCES drawing_sessions (id)
+    );
+'''
+
+LEGACY_ACTIONS = [
+    (1, "brush", "255,0,0", 5, "2024-03-01T10:00:00.125000"),
+    (1, "brush", "255,0,0", 7, "2024-03-01T10:00:01.000000"),
+    (1, "fill", "0,0,255", 5, "2024-03-01T10:00:02.500000"),
+    (2, "eraser", "255,255,255", 20, "2024-03-02T09:30:00.000000"),
+]
+
+
+def create_legacy_db(path, version=0):
+    """БД в виде до миграций; version=1 - с уже примененной первой миграцией"""
+    conn = sqlite3.connect(path)
+    conn.executescript(LEGACY_SCHEMA)
+    conn.execute("INSERT INTO drawing_sessions (start_time, end_time) VALUES "
+                 "('2024-03-01T10:00:00', '2024-03-01T10:05:00')")
+    conn.execute("INSERT INTO drawing_sessions (start_time) VALUES ('2024-03-02T09:30:00')")
+    conn.executemany("INSERT INTO drawing_actions (session_id, tool_name, color, brush_size, timestamp) "
+                     "VALUES (?, ?, ?, ?, ?)", LEGACY_ACTIONS)
+    if version >= 1:
+        conn.execute("CREATE TABLE schema_version (version INTEGER PRIMARY KEY, "
+                     "description TEXT, applied_time TEXT NOT NULL)")
+        migrate_stats_indexes(conn.cursor())
+        conn.execute("INSERT INTO schema_version VALUES (1, 'индексы', '2024-03-03T00:00:00')")
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def legacy_db(data_dir, request):
+    create_legacy_db(os.path.join(data_dir, "paint_history.db"), getattr(request, "param", 0))
+    db = DatabaseManager(async_writes=False)
+    yield db
+    db.close()
+
+
+@pytest.mark.parametrize("legacy_db", [0, 1], indirect=True)
+def test_legacy_db_is_migrated_to_latest_schema(legacy_db):
+    assert legacy_db.get_schema_version() == 3
+    columns = [row[1] for row in legacy_db.conn.execute("PRAGMA table_info(drawing_actions)")]
+    assert columns == ["id", "session_id", "tool_id", "color", "brush_size", "timestamp"]
+
+    assert dict(legacy_db.get_tools_stats(1)) == {"brush": 2, "fill": 1}
+    assert dict(legacy_db.get_colors_stats(1)) == {"255,0,0": 2, "0,0,255": 1}
+    assert legacy_db.get_session_info(1)[1] == 3
+    assert legacy_db.get_total_actions_count() == len(LEGACY_ACTIONS)
+
+
+@pytest.mark.parametrize("legacy_db", [0], indirect=True)
+def test_migrated_actions_keep_their_values(legacy_db):
+    page = legacy_db.get_actions_page(1)
+    assert [row[1:] for row in page] == [
+        ("2024-03-01T10:00:02.500", "fill", "0,0,255", 5),
+        ("2024-03-01T10:00:01.000", "brush", "255,0,0", 7),
+        ("2024-03-01T10:00:00.125", "brush", "255,0,0", 5),
+    ]
+
+
+@pytest.mark.parametrize("legacy_db", [0], indirect=True)
+def test_rollups_follow_new_actions_after_migration(legacy_db):
+    legacy_db.log_action(2, "brush", (10, 20, 30), 3)
+    assert dict(legacy_db.get_tools_stats(2)) == {"eraser": 1, "brush": 1}
+    assert dict(legacy_db.get_colors_stats(2))["10,20,30"] == 1
+
+
+def test_new_tool_is_added_by_background_writer(data_dir):
+    db = DatabaseManager()
+    try:
+        session_id = db.start_session()
+        changes = db.conn.total_changes
+        db.log_action(session_id, "spray", (1, 2, 3), 4)
+        db.log_action(session_id, "spray", (1, 2, 3), 4)
+        # Новый инструмент записывает фоновый писатель, а не основное соединение
+        assert db.conn.total_changes == changes
+        db.flush()
+
+        assert dict(db.get_tools_stats(session_id)) == {"spray": 2}
+        assert db.get_tool_id("spray") is not None
+    finally:
+        db.close()
+
+
+def test_actions_pages_cover_history_without_gaps(data_dir):
+    db = DatabaseManager(async_writes=False)
+    try:
+        session_id = db.start_session()
+        other_id = db.start_session()
+        for index in range(53):
+            db.log_action(session_id, "brush", (index, 0, 0), index)
+            db.log_action(other_id, "line", (0, 0, 0), 1)
+
+        rows = []
+        before_id = None
+        while True:
+            page = db.get_actions_page(session_id, before_id, limit=10)
+            rows.extend(page)
+            if len(page) < 10:
+                break
+            before_id = page[-1][0]
+
+        ids = [row[0] for row in rows]
+        assert len(ids) == 53
+        assert ids == sorted(ids, reverse=True)
+        assert [row[4] for row in rows] == list(range(52, -1, -1))
+    finally:
+        db.close()
+
+
+def test_compaction_runs_in_background(legacy_db):
+    assert not legacy_db.is_incremental_vacuum()
+    stages = []
+    results = []
+    thread, _ = legacy_db.start_compaction(progress=lambda *args: stages.append(args),
+                                           finished=results.append)
+    thread.join()
+
+    assert stages == [("compact", 0, None)]
+    assert len(results) == 1 and isinstance(results[0], int)
+    assert legacy_db.is_incremental_vacuum()
+    assert legacy_db.get_total_actions_count() == len(LEGACY_ACTIONS)
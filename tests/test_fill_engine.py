@@ -0,0 +1,91 @@
+import gc
+
+import numpy as np
+import pytest
+
+from models.fill_engine import (ArrayTiles, image_to_array, image_to_readonly_array,
+                                scanline_fill, tiled_fill, tolerance_fill)
+
+NEW_VALUE = 0xFF00FF00
+
+
+def random_pixels(seed, height=300, width=420, colors=3):
+    """Изображение из нескольких цветов со сложной связностью областей"""
+    rng = np.random.default_rng(seed)
+    palette = np.array([0xFFFFFFFF, 0xFF000000, 0xFF101010][:colors], dtype=np.uint32)
+    return palette[rng.integers(0, colors, (height, width))]
+
+
+def seeds(pixels, count=5, seed=0):
+    rng = np.random.default_rng(seed)
+    height, width = pixels.shape
+    return [(int(rng.integers(0, width)), int(rng.integers(0, height))) for _ in range(count)]
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_tolerance_fill_without_tolerance_matches_scanline(seed):
+    pixels = random_pixels(seed)
+    for x, y in seeds(pixels, seed=seed):
+        expected = pixels.copy()
+        actual = pixels.copy()
+        expected_count = scanline_fill(expected, x, y, NEW_VALUE)
+        actual_count = tolerance_fill(actual, x, y, NEW_VALUE, 0)
+        assert actual_count == expected_count
+        assert np.array_equal(actual, expected)
+
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("tile_size", [16, 64, 128])
+def test_tiled_fill_matches_scanline(seed, tile_size):
+    pixels = random_pixels(seed)
+    for x, y in seeds(pixels, seed=seed):
+        expected = pixels.copy()
+        actual = pixels.copy()
+        expected_count = scanline_fill(expected, x, y, NEW_VALUE)
+        actual_count = tiled_fill(ArrayTiles(actual, tile_size), x, y, NEW_VALUE, 0, workers=2)
+        assert actual_count == expected_count
+        assert np.array_equal(actual, expected)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_tiled_fill_with_tolerance_matches_tolerance_fill(seed):
+    pixels = random_pixels(seed)
+    for x, y in seeds(pixels, seed=seed):
+        expected = pixels.copy()
+        actual = pixels.copy()
+        expected_count = tolerance_fill(expected, x, y, NEW_VALUE, 32)
+        actual_count = tiled_fill(ArrayTiles(actual, 64), x, y, NEW_VALUE, 32, workers=2)
+        assert actual_count == expected_count
+        assert np.array_equal(actual, expected)
+
+
+def test_fill_with_same_color_changes_nothing():
+    pixels = np.full((64, 64), NEW_VALUE, dtype=np.uint32)
+    assert tiled_fill(ArrayTiles(pixels, 16), 3, 3, NEW_VALUE) == 0
+    assert tolerance_fill(pixels, 3, 3, NEW_VALUE, 10) == 0
+
+
+def test_readonly_array_keeps_converted_image_alive(qapp):
+    from PyQt6.QtGui import QColor, QImage
+
+    image = QImage(300, 200, QImage.Format.Format_RGB16)
+    image.fill(QColor(255, 0, 0))
+    # Преобразованная копия существует только внутри функции
+    pixels = image_to_readonly_array(image)[10:20, 10:20]
+    image = None
+    gc.collect()
+    # Новые выделения памяти не должны попасть в буфер массива
+    garbage = [QImage(300, 200, QImage.Format.Format_ARGB32) for _ in range(8)]
+    for other in garbage:
+        other.fill(QColor(0, 0, 255))
+    assert (pixels == np.uint32(0xFFFF0000)).all()
+    assert not pixels.flags.writeable
+
+
+def test_array_keeps_image_alive(qapp):
+    from PyQt6.QtGui import QImage
+
+    pixels = image_to_array(QImage(64, 64, QImage.Format.Format_RGB32))
+    gc.collect()
+    pixels[:] = 0xFF00FF00
+    assert (pixels == np.uint32(0xFF00FF00)).all()
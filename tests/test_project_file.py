@@ -0,0 +1,99 @@
+from PyQt6.QtCore import QRect
+from PyQt6.QtGui import QColor
+
+from models.tiled_image import TiledImage
+from utils.project_file import HEADER_SIZE, ProjectLayer, ProjectReader, load_project, save_project
+
+
+def fill_rect(image, rect, color):
+    image.paint(rect, lambda painter: painter.fillRect(rect, QColor(*color)))
+
+
+def test_incremental_save_round_trip(qapp, tmp_path):
+    path = str(tmp_path / "drawing.spaint")
+    image = TiledImage(1000, 700)
+    fill_rect(image, QRect(10, 10, 600, 300), (200, 0, 0))
+    assert save_project(image.snapshot(), path) == len(image.tiles)
+    size_after_full = (tmp_path / "drawing.spaint").stat().st_size
+
+    fill_rect(image, QRect(900, 600, 20, 20), (0, 0, 200))
+    assert save_project(image.snapshot(), path) == 1
+
+    image.discard_tile((0, 0))
+    fill_rect(image, QRect(300, 300, 5, 5), (0, 200, 0))
+    assert save_project(image.snapshot(), path) == 1
+    # Повторные сохранения дописывают файл, а не переписывают его
+    assert (tmp_path / "drawing.spaint").stat().st_size > size_after_full
+
+    loaded = load_project(path)
+    assert loaded.size() == image.size()
+    assert loaded.to_qimage() == image.to_qimage()
+    assert set(loaded.tiles) == set(image.tiles)
+
+
+def test_other_document_rewrites_file(qapp, tmp_path):
+    path = str(tmp_path / "drawing.spaint")
+    first = TiledImage(512, 512)
+    fill_rect(first, QRect(0, 0, 512, 512), (1, 2, 3))
+    save_project(first, path)
+
+    second = TiledImage(300, 200)
+    fill_rect(second, QRect(50, 50, 10, 10), (4, 5, 6))
+    save_project(second, path)
+    assert load_project(path).to_qimage() == second.to_qimage()
+
+
+def test_torn_header_falls_back_to_previous_save(qapp, tmp_path):
+    path = tmp_path / "drawing.spaint"
+    image = TiledImage(600, 600)
+    fill_rect(image, QRect(0, 0, 40, 40), (10, 10, 10))
+    save_project(image.snapshot(), str(path))
+    previous = image.to_qimage()
+    fill_rect(image, QRect(500, 500, 40, 40), (20, 20, 20))
+    save_project(image.snapshot(), str(path))
+
+    data = bytearray(path.read_bytes())
+    with ProjectReader(str(path)) as reader:
+        slot = reader.generation % 2
+    data[slot * HEADER_SIZE + 12:slot * HEADER_SIZE + 20] = b"\xff" * 8
+    path.write_bytes(bytes(data))
+
+    assert load_project(str(path)).to_qimage() == previous
+
+
+def test_layers_are_composited_on_load(qapp, tmp_path):
+    path = str(tmp_path / "layers.spaint")
+    base = TiledImage(200, 200)
+    fill_rect(base, QRect(0, 0, 200, 200), (255, 0, 0))
+    top = TiledImage(200, 200)
+    fill_rect(top, QRect(0, 0, 100, 100), (0, 0, 255))
+    hidden = TiledImage(200, 200)
+    fill_rect(hidden, QRect(0, 0, 200, 200), (0, 255, 0))
+    save_project([ProjectLayer(base), ProjectLayer(top, "Верх"),
+                  ProjectLayer(hidden, "Скрытый", visible=False)], path)
+
+    with ProjectReader(path) as reader:
+        assert [layer["name"] for layer in reader.layers] == ["Фон", "Верх", "Скрытый"]
+    image = load_project(path).to_qimage()
+    assert image.pixelColor(50, 50).getRgb() == (0, 0, 255, 255)
+
+
+def test_open_project_larger_than_canvas(qapp, data_dir):
+    from ui.main_window import MainWindow
+
+    path = str(data_dir / "large.spaint")
+    image = TiledImage(1000, 700)
+    fill_rect(image, QRect(800, 600, 100, 50), (0, 120, 0))
+    save_project(image, path)
+
+    window = MainWindow()
+    try:
+        window.canvas.resize(400, 300)
+        window.open_project(path)
+        canvas_image = window.canvas.image
+        # Тайлы за пределами окна не отбрасываются
+        assert (3, 2) in canvas_image.tiles
+        assert canvas_image.width() >= 1000 and canvas_image.height() >= 700
+        assert canvas_image.to_qimage().pixelColor(850, 620) == QColor(0, 120, 0)
+    finally:
+        window.close()
@@ -0,0 +1,45 @@
+import json
+import threading
+import time
+
+from utils.settings_manager import SettingsManager
+
+
+def read_settings(data_dir):
+    with open(data_dir / "app_settings.json", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def process_events_for(qapp, seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        qapp.processEvents()
+        time.sleep(0.005)
+
+
+def test_changes_are_written_once_after_pause(qapp, data_dir):
+    manager = SettingsManager(save_delay=0.05)
+    threads = threading.active_count()
+    for size in range(1, 50):
+        manager.set_setting("brush_size", size)
+    # Таймер один и работает в потоке интерфейса, новых потоков нет
+    assert threading.active_count() == threads
+    assert not (data_dir / "app_settings.json").exists()
+
+    process_events_for(qapp, 0.2)
+    assert read_settings(data_dir)["brush_size"] == 49
+    assert not manager.dirty
+
+
+def test_flush_writes_pending_changes(qapp, data_dir):
+    manager = SettingsManager(save_delay=60)
+    manager.set_setting("last_tool", "fill")
+    manager.add_recent_file("a.png")
+    assert manager.save_timer.isActive()
+
+    assert manager.flush()
+    assert not manager.save_timer.isActive()
+    settings = read_settings(data_dir)
+    assert settings["last_tool"] == "fill"
+    assert settings["recent_files"] == ["a.png"]
+    assert not (data_dir / "app_settings.json.tmp").exists()
@@ -0,0 +1,102 @@
+import pytest
+from PyQt6.QtCore import QRect
+from PyQt6.QtGui import QColor
+
+from models.tiled_image import TiledImage
+from models.undo_stack import UndoStack
+
+
+def fill_rect(image, rect, color):
+    image.paint(rect, lambda painter: painter.fillRect(rect, QColor(*color)))
+
+
+def paint_step(stack, image, rect, color):
+    stack.begin(image)
+    fill_rect(image, rect, color)
+    return stack.commit()
+
+
+def wait_for_compression(stack):
+    for entry in stack.undo_entries + stack.redo_entries:
+        entry.future.result()
+    stack.trim()
+
+
+@pytest.fixture
+def stack():
+    stack = UndoStack()
+    yield stack
+    stack.shutdown()
+
+
+def test_undo_and_redo_round_trip(qapp, stack):
+    image = TiledImage(600, 400)
+    states = [image.to_qimage()]
+    steps = [(QRect(0, 0, 100, 100), (255, 0, 0)),
+             (QRect(200, 100, 300, 200), (0, 255, 0)),
+             (QRect(50, 50, 400, 20), (0, 0, 255))]
+    for rect, color in steps:
+        assert paint_step(stack, image, rect, color)
+        states.append(image.to_qimage())
+
+    for expected in reversed(states[:-1]):
+        assert stack.undo(image)
+        assert image.to_qimage() == expected
+    assert not stack.can_undo()
+    # Тайлы, которых до первой операции не было, снова белые и не хранятся
+    assert not image.tiles
+
+    for expected in states[1:]:
+        assert stack.redo(image)
+        assert image.to_qimage() == expected
+    assert not stack.can_redo()
+
+
+def test_new_operation_clears_redo(qapp, stack):
+    image = TiledImage(300, 300)
+    paint_step(stack, image, QRect(0, 0, 50, 50), (255, 0, 0))
+    stack.undo(image)
+    assert stack.can_redo()
+
+    paint_step(stack, image, QRect(100, 100, 50, 50), (0, 255, 0))
+    assert not stack.can_redo()
+
+
+def test_commit_without_changes_is_not_recorded(qapp, stack):
+    image = TiledImage(300, 300)
+    stack.begin(image)
+    assert not stack.commit()
+    assert not stack.can_undo()
+
+
+def test_entries_are_compressed_in_background(qapp, stack):
+    image = TiledImage(512, 512)
+    paint_step(stack, image, QRect(0, 0, 512, 512), (10, 20, 30))
+    before = image.to_qimage()
+    paint_step(stack, image, QRect(0, 0, 512, 512), (200, 100, 0))
+    wait_for_compression(stack)
+
+    delta = stack.undo_entries[-1]
+    assert delta.tiles is None
+    assert delta.memory_usage() < delta.raw_size
+    # Отмена восстанавливает тайлы из сжатой записи
+    assert stack.undo(image)
+    assert image.to_qimage() == before
+
+
+def test_oldest_entries_are_evicted_over_budget(qapp, stack):
+    image = TiledImage(512, 512)
+    for value in range(6):
+        paint_step(stack, image, QRect(0, 0, 512, 512), (value, value, value))
+    wait_for_compression(stack)
+    entry_size = max(entry.memory_usage() for entry in stack.undo_entries)
+    newest = stack.undo_entries[-2:]
+
+    stack.set_memory_budget(entry_size * 2)
+    assert stack.memory_usage() <= stack.memory_budget
+    assert stack.undo_entries[-2:] == newest
+    assert len(stack.undo_entries) <= 2
+
+    # Последние операции по-прежнему отменяются
+    stack.undo(image)
+    assert image.to_qimage().pixelColor(10, 10) == QColor(4, 4, 4)
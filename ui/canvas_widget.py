@@ -1,9 +1,20 @@
 from PyQt6.QtWidgets import QWidget
-from PyQt6.QtCore import Qt, QPoint
+from PyQt6.QtCore import Qt, QPoint, QRect, QTimer, pyqtSignal
 from PyQt6.QtGui import QPainter, QColor, QPen, QImage
 from models.drawing_tools import BrushTool, LineTool, RectangleTool, EllipseTool, EraserTool, FillTool
+from models.tiled_image import TiledImage
+from models.undo_stack import UndoStack
+from utils import trace
 
 class CanvasWidget(QWidget):
+    # Изменилось состояние истории отмены/повтора
+    history_changed = pyqtSignal()
+
+    # Частота обновления экрана, если ее не удалось определить
+    DEFAULT_REFRESH_RATE = 60
+    # Пауза (мс), после которой изменение размера окна считается завершенным
+    RESIZE_SETTLE_DELAY = 150
+
     def __init__(self):
         super().__init__()
         self.setMinimumSize(300, 250)
@@ -14,44 +25,102 @@ class CanvasWidget(QWidget):
         self.current_tool = BrushTool()
         self.current_color = QColor(0, 0, 0)
         self.brush_size = 5
-        self.temp_image = None
+        self.preview_point = None
+        self.preview_rect = QRect()
+        self.undo_stack = UndoStack()
+        
+        # Номер текущей фоновой загрузки изображения (0 - загрузки нет)
+        self.image_load_token = 0
+        
+        # Точки мыши копятся и отрисовываются один раз за кадр
+        self.pending_points = []
+        self.frame_timer = QTimer(self)
+        self.frame_timer.setSingleShot(True)
+        self.frame_timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self.frame_timer.timeout.connect(self.flush_input)
+        
+        # Размер документа подстраивается под виджет только после окончания изменения размера
+        self.resize_timer = QTimer(self)
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.timeout.connect(self.apply_document_size)
+        
         self.create_initial_image()
 
     def create_initial_image(self):
         """Создает начальное изображение при инициализации"""
-        self.image = QImage(self.size(), QImage.Format.Format_RGB32)
-        self.image.fill(Qt.GlobalColor.white)
+        self.image = TiledImage(self.width(), self.height())
+
+    def set_image(self, image):
+        """Заменяет содержимое холста изображением QImage (левый верхний угол)"""
+        self.end_stroke()
+        self.drawing = False
+        self.begin_change()
+        self.image.clear()
+        self.image.draw_image(0, 0, image)
+        self.commit_change()
+        self.update()
+
+    def set_tiles(self, image):
+        """Заменяет содержимое холста тайлами другого TiledImage без сборки сплошного QImage
+
+        Документ увеличивается до размера image, поэтому ничего не обрезается
+        по текущему размеру виджета. Тайлы разделяются с image неявно.
+        """
+        if image.tile_size != self.image.tile_size:
+            image = TiledImage.from_qimage(image.to_qimage(), self.image.tile_size)
+        self.end_stroke()
+        self.drawing = False
+        self.current_tool.release_painters()
+        self.begin_change()
+        self.image.clear()
+        self.image.resize(max(self.image.width(), image.width()),
+                          max(self.image.height(), image.height()))
+        for key, tile in image.tiles.items():
+            self.image.set_tile(key, QImage(tile))
+        self.commit_change()
+        self.update()
 
     def resizeEvent(self, event):
         """Обрабатывает изменение размера виджета"""
         super().resizeEvent(event)
         
-        # Создаем новое изображение при изменении размера
-        if self.image:
-            # Сохраняем старое изображение
-            old_image = self.image
-            
-            # Создаем новое изображение с новым размером
-            self.image = QImage(self.size(), QImage.Format.Format_RGB32)
-            self.image.fill(Qt.GlobalColor.white)
-            
-            # Копируем старое изображение в центр нового
-            painter = QPainter(self.image)
-            painter.drawImage(0, 0, old_image)
-            painter.end()
-        
+        # Во время перетаскивания края окна документ не трогаем, область
+        # за его границами просто рисуется белой
+        self.resize_timer.start(self.RESIZE_SETTLE_DELAY)
+        self.update()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.apply_document_size()
+
+    def apply_document_size(self):
+        """Подгоняет размер документа под размер виджета"""
+        self.resize_timer.stop()
+        if self.image is None or self.image.size() == self.size():
+            return
+        # QPainter мазка переоткроются при следующей отрисовке с новыми границами
+        self.current_tool.release_painters()
+        self.image.resize(self.width(), self.height())
         self.update()
 
     def paintEvent(self, event):
+        # Перерисовываем только запрошенную область
+        rect = event.rect()
         painter = QPainter(self)
-        if self.image:
-            painter.drawImage(self.rect(), self.image, self.rect())
+        if self.image is not None:
+            painter.fillRect(rect, Qt.GlobalColor.white)
+            self.image.draw_to(painter, rect)
         
-        if self.drawing and self.temp_image:
-            painter.drawImage(self.rect(), self.temp_image, self.rect())
+        # Предпросмотр фигуры рисуется поверх холста векторно, без промежуточного буфера
+        if self.drawing and self.preview_point is not None:
+            painter.setClipRect(rect)
+            self.current_tool.draw(painter, self.start_point, self.preview_point,
+                                   self.current_color, self.brush_size)
 
     def mousePressEvent(self, event):
         if event.button() == Qt.MouseButton.LeftButton:
+            if self.resize_timer.isActive():
+                self.apply_document_size()
             self.drawing = True
             self.last_point = event.pos()
             self.start_point = event.pos()
@@ -60,52 +129,175 @@ class CanvasWidget(QWidget):
             if self.current_tool.name == "fill":
                 self.perform_fill(event.pos())
                 self.drawing = False
-            else:
-                self.temp_image = QImage(self.size(), QImage.Format.Format_ARGB32)
-                self.temp_image.fill(Qt.GlobalColor.transparent)
+            elif self.current_tool.name in ["brush", "eraser"]:
+                self.begin_stroke(event.pos())
 
     def mouseMoveEvent(self, event):
         if self.drawing and self.current_tool.name != "fill":
             if self.current_tool.name in ["brush", "eraser"]:
-                painter = QPainter(self.image)
-                self.current_tool.draw(painter, self.last_point, event.pos(), 
-                                     self.current_color, self.brush_size)
-                self.last_point = event.pos()
-                self.update()
+                self.pending_points.append(event.pos())
             else:
-                self.temp_image.fill(Qt.GlobalColor.transparent)
-                painter = QPainter(self.temp_image)
-                self.current_tool.draw(painter, self.start_point, event.pos(),
-                                     self.current_color, self.brush_size)
-                self.update()
+                self.preview_point = event.pos()
+            self.schedule_flush()
 
     def mouseReleaseEvent(self, event):
         if (event.button() == Qt.MouseButton.LeftButton and 
             self.drawing and self.current_tool.name != "fill"):
-            if self.current_tool.name not in ["brush", "eraser"]:
-                painter = QPainter(self.image)
-                self.current_tool.draw(painter, self.start_point, event.pos(),
-                                     self.current_color, self.brush_size)
-            self.temp_image = None
-            self.update()
+            self.flush_input()
+            if self.current_tool.name in ["brush", "eraser"]:
+                self.end_stroke()
+            else:
+                end_point = event.pos()
+                bounds = self.current_tool.bounding_rect(self.start_point, end_point,
+                                                         self.brush_size)
+                self.begin_change()
+                keys = self.image.paint(bounds, lambda painter: self.current_tool.draw(
+                    painter, self.start_point, end_point, self.current_color, self.brush_size))
+                self.image.compact(keys)
+                self.commit_change()
+                self.update_preview_rect(end_point)
+            self.preview_point = None
+            self.preview_rect = QRect()
             self.drawing = False
 
+    def frame_interval(self):
+        """Длительность кадра в мс по частоте обновления экрана"""
+        screen = self.screen()
+        rate = screen.refreshRate() if screen else 0
+        if rate <= 0:
+            rate = self.DEFAULT_REFRESH_RATE
+        return max(1, int(1000 / rate))
+
+    def schedule_flush(self):
+        """Планирует отрисовку накопленного ввода на следующий кадр"""
+        if not self.frame_timer.isActive():
+            self.frame_timer.start(self.frame_interval())
+
+    def flush_input(self):
+        """Отрисовывает накопленные за кадр точки одной ломаной"""
+        self.frame_timer.stop()
+        if not self.drawing:
+            self.pending_points = []
+            return
+        if self.pending_points:
+            points, self.pending_points = self.pending_points, []
+            self.add_points(points)
+        if self.preview_point is not None:
+            self.update_preview_rect(self.preview_point)
+
+    def begin_stroke(self, point):
+        """Начинает мазок кистью или ластиком"""
+        self.begin_change()
+        self.current_tool.begin_stroke(self.image, point, self.current_color, self.brush_size)
+        self.last_point = point
+
+    def add_points(self, points):
+        """Дорисовывает мазок и перерисовывает только затронутую область"""
+        dirty = self.current_tool.add_points(points)
+        if points:
+            self.last_point = points[-1]
+        if not dirty.isEmpty():
+            self.update(dirty)
+
+    def end_stroke(self):
+        """Завершает мазок"""
+        self.pending_points = []
+        self.current_tool.end_stroke()
+        self.commit_change()
+
+    def update_preview_rect(self, end_point):
+        """Перерисовывает объединение старой и новой области предпросмотра фигуры"""
+        rect = self.current_tool.bounding_rect(self.start_point, end_point, self.brush_size)
+        self.update(self.preview_rect.united(rect))
+        self.preview_rect = rect
+
     def perform_fill(self, point):
         """Выполняет заливку области"""
-        if self.current_tool.name == "fill" and hasattr(self.current_tool, 'flood_fill'):
-            success = self.current_tool.flood_fill(self.image, point, self.current_color)
+        if self.current_tool.name == "fill" and hasattr(self.current_tool, 'fill'):
+            self.begin_change()
+            success = self.current_tool.fill(self.image, point, self.current_color)
+            self.commit_change()
             if success:
                 self.update()
             else:
-                print("Заливка не выполнена")
+                trace.warning("Заливка не выполнена")
 
     def clear(self):
         """Очищает холст"""
-        if self.image:
-            self.image.fill(Qt.GlobalColor.white)
+        if self.image is not None:
+            self.end_stroke()
+            self.drawing = False
+            self.begin_change()
+            self.image.clear()
+            self.commit_change()
             self.update()
 
+    def begin_image_load(self, preview, target_size):
+        """Показывает превью открываемого изображения и ждет полосы в полном разрешении
+
+        Превью растягивается до target_size и записывается в историю одной
+        операцией, которая охватывает все тайлы изображения, поэтому полосы,
+        пришедшие позже, отменяются вместе с ней. Возвращает номер загрузки.
+        """
+        if preview is not None:
+            placeholder = preview.scaled(target_size, Qt.AspectRatioMode.IgnoreAspectRatio,
+                                         Qt.TransformationMode.SmoothTransformation)
+        else:
+            placeholder = QImage(target_size, QImage.Format.Format_RGB32)
+            placeholder.fill(Qt.GlobalColor.white)
+        self.set_image(placeholder)
+        self.image_load_token += 1
+        return self.image_load_token
+
+    def draw_loaded_band(self, token, y, band):
+        """Рисует полосу загруженного изображения; False - загрузка уже отменена"""
+        if token != self.image_load_token:
+            return False
+        self.image.draw_image(0, y, band)
+        self.update(QRect(0, y, band.width(), band.height()))
+        return True
+
+    def cancel_image_load(self):
+        """Прекращает прием полос: холст изменен раньше, чем загрузка завершилась"""
+        self.image_load_token += 1
+
+    def snapshot_image(self):
+        """Снимок документа для фоновой обработки (рисование при этом продолжается)"""
+        # Открытый QPainter писал бы прямо в разделяемые со снимком данные
+        self.current_tool.release_painters()
+        return self.image.snapshot()
+
+    def begin_change(self):
+        """Начинает запись изменения холста в историю"""
+        self.cancel_image_load()
+        self.undo_stack.begin(self.image)
+
+    def commit_change(self):
+        """Завершает запись изменения холста в историю"""
+        if self.undo_stack.commit():
+            self.history_changed.emit()
+
+    def undo(self):
+        """Отменяет последнее изменение холста"""
+        self.cancel_image_load()
+        self.end_stroke()
+        self.drawing = False
+        if self.undo_stack.undo(self.image):
+            self.update()
+        self.history_changed.emit()
+
+    def redo(self):
+        """Повторяет отмененное изменение холста"""
+        self.cancel_image_load()
+        self.end_stroke()
+        self.drawing = False
+        if self.undo_stack.redo(self.image):
+            self.update()
+        self.history_changed.emit()
+
     def set_tool(self, tool):
+        self.end_stroke()
+        self.drawing = False
         self.current_tool = tool
 
     def set_color(self, color):
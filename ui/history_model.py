@@ -0,0 +1,63 @@
+from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex
+from utils.database import HISTORY_PAGE_SIZE
+
+
+class ActionsHistoryModel(QAbstractTableModel):
+    """Модель истории действий сессии с постраничной подгрузкой
+
+    Представление запрашивает строки через fetchMore по мере прокрутки, а
+    страницы читаются из БД по ключу (id последней загруженной строки), поэтому
+    открытие и прокрутка не зависят от длины истории.
+    """
+
+    HEADERS = ["Время", "Инструмент", "Цвет", "Размер"]
+
+    def __init__(self, db_manager, session_id, page_size=HISTORY_PAGE_SIZE, parent=None):
+        super().__init__(parent)
+        self.db_manager = db_manager
+        self.session_id = session_id
+        self.page_size = page_size
+        self.rows = []
+        self.last_id = None
+        self.exhausted = False
+
+    def reload(self):
+        """Сбрасывает загруженные строки; первая страница подгрузится при отображении"""
+        self.beginResetModel()
+        self.rows = []
+        self.last_id = None
+        self.exhausted = False
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role != Qt.ItemDataRole.DisplayRole:
+            return None
+        # Первый элемент строки - id, он не отображается
+        return str(self.rows[index.row()][index.column() + 1])
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted and self.session_id is not None
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        page = self.db_manager.get_actions_page(self.session_id, self.last_id, self.page_size)
+        if len(page) < self.page_size:
+            self.exhausted = True
+        if not page:
+            return
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+        self.rows.extend(page)
+        self.last_id = page[-1][0]
+        self.endInsertRows()
@@ -1,34 +1,58 @@
 import os
+import threading
 
 from PyQt6.QtWidgets import (QMainWindow, QWidget, QVBoxLayout,
                              QHBoxLayout, QPushButton, QLabel,
                              QSlider, QMenuBar, QStatusBar,
                              QMessageBox, QFileDialog, QColorDialog,
-                             QSizePolicy, QApplication)
-from PyQt6.QtCore import Qt, QPoint, QFile, QTextStream
+                             QSizePolicy, QApplication, QSpinBox,
+                             QCheckBox, QProgressBar)
+from PyQt6.QtCore import Qt, QPoint, QFile, QTextStream, QThreadPool, pyqtSignal
 from PyQt6.QtGui import QAction, QPainter, QColor, QPen, QImage, QIcon
 from models.drawing_tools import BrushTool, LineTool, RectangleTool, EllipseTool, EraserTool, FillTool
 from utils.settings_manager import SettingsManager
-from utils.database import DatabaseManager
+from utils.database import get_database_manager
+from utils.history_export import export_history
+from utils import trace
+from utils.image_loader import ImageLoadTask, fit_size, read_preview
+from utils.project_file import is_project_file, load_project
+from utils.autosave import AutosaveService
 from ui.canvas_widget import CanvasWidget
 from ui.about_dialog import AboutDialog
 from ui.stats_dialog import StatsDialog
 
 
 class MainWindow(QMainWindow):
+    # Ход и итог фоновой очистки истории (испускаются из потока очистки)
+    retention_progress = pyqtSignal(str, int, object)
+    retention_finished = pyqtSignal(dict)
+    # Итог фонового сжатия файла истории (освобожденные байты или текст ошибки)
+    compaction_finished = pyqtSignal(object)
+    # Ход и итог фоновой выгрузки истории (итог - словарь или текст ошибки)
+    export_progress = pyqtSignal(int)
+    export_finished = pyqtSignal(object)
+
     def __init__(self):
         super().__init__()
         self.settings_manager = SettingsManager()
-        self.db_manager = DatabaseManager()
+        self.db_manager = get_database_manager()
         self.current_session_id = self.db_manager.start_session()
+        self.retention_job = None
+        self.export_thread = None
+        self.save_tasks = []
+        self.load_task = None
         self.setWindowTitle("Простой графический редактор")
         self.setGeometry(100, 100, 800, 600)
         
         self.current_color = QColor(0, 0, 0)
         self.brush_size = 5
         self.current_tool = "brush"
+        self.fill_tolerance = 0
+        self.fill_mode = FillTool.MODE_CONTIGUOUS
         
         self.setup_ui()
+        # Запускается из main.py после предложения восстановить прошлый сеанс
+        self.autosave = AutosaveService(self.canvas, parent=self)
         self.load_settings()
         
     def setup_ui(self):
@@ -114,6 +138,18 @@ class MainWindow(QMainWindow):
         self.size_label = QLabel("5px")
         settings_layout.addWidget(self.size_label)
         
+        # Допуск и режим заливки
+        settings_layout.addWidget(QLabel("Допуск:"))
+        self.tolerance_spin = QSpinBox()
+        self.tolerance_spin.setRange(0, 255)
+        self.tolerance_spin.setValue(0)
+        self.tolerance_spin.setToolTip("Допустимое отличие цвета при заливке (0 - точное совпадение)")
+        settings_layout.addWidget(self.tolerance_spin)
+        
+        self.replace_all_check = QCheckBox("Везде")
+        self.replace_all_check.setToolTip("Заменить цвет по всему изображению")
+        settings_layout.addWidget(self.replace_all_check)
+        
         right_layout.addWidget(settings_widget)
         
         # Холст (уменьшаем минимальный размер)
@@ -142,6 +178,13 @@ class MainWindow(QMainWindow):
         # Строка состояния
         self.status_bar = QStatusBar()
         self.setStatusBar(self.status_bar)
+        
+        # Индикатор фоновых сохранения и загрузки
+        self.task_progress = QProgressBar()
+        self.task_progress.setRange(0, 0)
+        self.task_progress.setMaximumWidth(120)
+        self.task_progress.hide()
+        self.status_bar.addPermanentWidget(self.task_progress)
         self.update_status()
         
         # Создаем меню
@@ -205,13 +248,13 @@ class MainWindow(QMainWindow):
                         stream = QTextStream(style_file)
                         app.setStyleSheet(stream.readAll())
                         style_file.close()
-                        print("Стили включены")
+                        trace.info("Стили включены")
                 except Exception as e:
-                    print(f"Ошибка загрузки стилей: {e}")
+                    trace.error("Ошибка загрузки стилей: {}", e)
         else:
             # Выключаем стили (стандартный вид Qt)
             app.setStyleSheet("")
-            print("Стили отключены")
+            trace.info("Стили отключены")
     
     def create_menu(self):
         menubar = self.menuBar()
@@ -225,6 +268,7 @@ class MainWindow(QMainWindow):
         self.open_action.setShortcut("Ctrl+O")
         self.save_action = QAction("Сохранить", self)
         self.save_action.setShortcut("Ctrl+S")
+        self.export_history_action = QAction("Экспорт истории...", self)
         exit_action = QAction("Выход", self)
         exit_action.setShortcut("Ctrl+Q")
         
@@ -232,10 +276,18 @@ class MainWindow(QMainWindow):
         file_menu.addAction(self.open_action)
         file_menu.addAction(self.save_action)
         file_menu.addSeparator()
+        file_menu.addAction(self.export_history_action)
+        file_menu.addSeparator()
         file_menu.addAction(exit_action)
         
         # Меню Правка
         edit_menu = menubar.addMenu("Правка")
+        self.undo_action = QAction("Отменить", self)
+        self.undo_action.setShortcut("Ctrl+Z")
+        self.undo_action.setEnabled(False)
+        self.redo_action = QAction("Повторить", self)
+        self.redo_action.setShortcut("Ctrl+Y")
+        self.redo_action.setEnabled(False)
         self.clear_action = QAction("Очистить", self)
         self.clear_action.setShortcut("Ctrl+Shift+N")
         
@@ -245,6 +297,9 @@ class MainWindow(QMainWindow):
         self.toggle_style_action.setCheckable(True)
         self.toggle_style_action.setChecked(True)  # Стиль включен по умолчанию
         
+        edit_menu.addAction(self.undo_action)
+        edit_menu.addAction(self.redo_action)
+        edit_menu.addSeparator()
         edit_menu.addAction(self.clear_action)
         edit_menu.addAction(self.toggle_style_action)  # Добавляем новый пункт
         
@@ -253,14 +308,24 @@ class MainWindow(QMainWindow):
         about_action = QAction("О программе", self)
         stats_action = QAction("Статистика", self)
         stats_action.setShortcut("Ctrl+T")
+        retention_action = QAction("Очистить старую историю", self)
+        compact_db_action = QAction("Сжать файл истории...", self)
+        trace_action = QAction("Сохранить журнал диагностики...", self)
         
         help_menu.addAction(about_action)
         help_menu.addAction(stats_action)
+        help_menu.addAction(retention_action)
+        help_menu.addAction(compact_db_action)
+        help_menu.addAction(trace_action)
         
         # Подключаем сигналы
         exit_action.triggered.connect(self.close)
         about_action.triggered.connect(self.show_about)
         stats_action.triggered.connect(self.show_stats)
+        retention_action.triggered.connect(self.clear_old_history)
+        compact_db_action.triggered.connect(self.compact_database)
+        trace_action.triggered.connect(self.save_trace)
+        self.export_history_action.triggered.connect(self.export_history)
         self.toggle_style_action.triggered.connect(self.toggle_styles)  # Новый сигнал
         
     def connect_signals(self):
@@ -283,14 +348,36 @@ class MainWindow(QMainWindow):
         # Размер кисти
         self.size_slider.valueChanged.connect(self.set_brush_size)
         
+        # Настройки заливки
+        self.tolerance_spin.valueChanged.connect(self.set_fill_tolerance)
+        self.replace_all_check.toggled.connect(self.set_fill_replace_all)
+        
         # Меню
         self.new_action.triggered.connect(self.new_file)
         self.open_action.triggered.connect(self.open_file)
         self.save_action.triggered.connect(self.save_file)
         self.clear_action.triggered.connect(self.clear_canvas)
+        self.undo_action.triggered.connect(self.canvas.undo)
+        self.redo_action.triggered.connect(self.canvas.redo)
+        self.canvas.history_changed.connect(self.update_history_actions)
+        self.retention_progress.connect(self.show_retention_progress)
+        self.retention_finished.connect(self.finish_retention)
+        self.compaction_finished.connect(self.finish_compaction)
+        self.export_progress.connect(self.show_export_progress)
+        self.export_finished.connect(self.finish_export)
     
     def load_settings(self):
         """Загружает настройки при запуске"""
+        # Бюджет памяти истории отмены
+        undo_memory_mb = self.settings_manager.get_setting("undo_memory_mb")
+        if undo_memory_mb:
+            self.canvas.undo_stack.set_memory_budget(undo_memory_mb * 1024 * 1024)
+        
+        # Интервал автосохранения
+        autosave_interval = self.settings_manager.get_setting("autosave_interval")
+        if autosave_interval:
+            self.autosave.set_interval(autosave_interval)
+        
         # Загрузка размера окна
         size = self.settings_manager.get_setting("window_size")
         if size:
@@ -312,6 +399,14 @@ class MainWindow(QMainWindow):
         if brush_size:
             self.set_brush_size(brush_size)
             self.size_slider.setValue(brush_size)
+        
+        # Загрузка настроек заливки
+        fill_tolerance = self.settings_manager.get_setting("fill_tolerance")
+        if fill_tolerance:
+            self.tolerance_spin.setValue(fill_tolerance)
+        fill_mode = self.settings_manager.get_setting("fill_mode")
+        if fill_mode == FillTool.MODE_GLOBAL:
+            self.replace_all_check.setChecked(True)
     
     def set_tool(self, tool):
         # Сбрасываем выделение всех кнопок инструментов
@@ -340,7 +435,7 @@ class MainWindow(QMainWindow):
             self.canvas.set_tool(EraserTool())
             self.eraser_btn.setChecked(True)
         elif tool == "fill":
-            self.canvas.set_tool(FillTool())
+            self.canvas.set_tool(self.create_fill_tool())
             self.fill_btn.setChecked(True)
             
         self.update_status()
@@ -368,6 +463,30 @@ class MainWindow(QMainWindow):
         self.update_status()
         self.settings_manager.set_setting("brush_size", size)
     
+    def create_fill_tool(self):
+        """Создает инструмент заливки с текущими допуском и режимом"""
+        fill_tool = FillTool()
+        fill_tool.set_tolerance(self.fill_tolerance)
+        fill_tool.set_mode(self.fill_mode)
+        return fill_tool
+    
+    def set_fill_tolerance(self, tolerance):
+        self.fill_tolerance = tolerance
+        if self.current_tool == "fill":
+            self.canvas.current_tool.set_tolerance(tolerance)
+        self.settings_manager.set_setting("fill_tolerance", tolerance)
+    
+    def set_fill_replace_all(self, checked):
+        self.fill_mode = FillTool.MODE_GLOBAL if checked else FillTool.MODE_CONTIGUOUS
+        if self.current_tool == "fill":
+            self.canvas.current_tool.set_mode(self.fill_mode)
+        self.settings_manager.set_setting("fill_mode", self.fill_mode)
+    
+    def update_history_actions(self):
+        """Обновляет доступность пунктов отмены и повтора"""
+        self.undo_action.setEnabled(self.canvas.undo_stack.can_undo())
+        self.redo_action.setEnabled(self.canvas.undo_stack.can_redo())
+    
     def update_status(self):
         color_name = self.get_color_name()
         self.status_bar.showMessage(f"Инструмент: {self.current_tool} | Цвет: {color_name} | Размер: {self.brush_size}px")
@@ -389,17 +508,88 @@ class MainWindow(QMainWindow):
         self.canvas.clear()
     
     def open_file(self):
-        """Открывает изображение"""
+        """Открывает изображение: сразу показывает превью, а полное разрешение догружает в фоне"""
         from utils.file_manager import FileManager
-        image = FileManager.load_image(self)
-        if image:
-            self.canvas.image = image.scaled(self.canvas.size(), Qt.AspectRatioMode.KeepAspectRatio)
-            self.canvas.update()
+        chosen = FileManager.choose_image_file(self)
+        if not chosen:
+            return
+        filename, source_size = chosen
+        
+        if is_project_file(filename):
+            self.open_project(filename)
+            return
+        
+        # Декодируем сразу в размер холста, а не в исходное разрешение файла
+        self.canvas.apply_document_size()
+        target_size = fit_size(source_size, self.canvas.size())
+        token = self.canvas.begin_image_load(read_preview(filename, target_size), target_size)
+        
+        if self.load_task is not None:
+            self.load_task.cancel()
+        self.load_task = ImageLoadTask(token, filename, target_size)
+        self.load_task.signals.band_loaded.connect(self.show_loaded_band)
+        self.load_task.signals.finished.connect(self.finish_load)
+        QThreadPool.globalInstance().start(self.load_task)
+        self.task_progress.show()
+        self.status_bar.showMessage(f"Загрузка {os.path.basename(filename)}...")
+    
+    def open_project(self, filename):
+        """Открывает проект .spaint (тайлы читаются из отображенного в память файла)"""
+        if self.load_task is not None:
+            self.load_task.cancel()
+            self.load_task = None
+        try:
+            image = load_project(filename)
+        except Exception as e:
+            trace.error("Ошибка открытия проекта {}: {}", filename, e)
+            QMessageBox.warning(self, "Ошибка", f"Не удалось открыть проект: {str(e)}")
+            return
+        self.canvas.apply_document_size()
+        self.canvas.set_tiles(image)
+        self.status_bar.showMessage(f"Проект загружен: {filename}", 5000)
+    
+    def show_loaded_band(self, token, y, band):
+        """Выводит полосу изображения, декодированную в фоне"""
+        if not self.canvas.draw_loaded_band(token, y, band) and self.load_task is not None:
+            # Холст уже изменен пользователем - дальше не декодируем
+            self.load_task.cancel()
+    
+    def finish_load(self, token, success):
+        """Завершение фоновой загрузки изображения"""
+        if self.load_task is None or self.load_task.token != token:
+            return
+        filename = self.load_task.filename
+        error = self.load_task.error
+        self.load_task = None
+        self.task_progress.setVisible(bool(self.save_tasks))
+        if success:
+            self.status_bar.showMessage(f"Изображение загружено: {filename}", 5000)
+        elif token == self.canvas.image_load_token:
+            QMessageBox.warning(self, "Ошибка",
+                                error or "Не удалось загрузить изображение или формат не поддерживается")
+        else:
+            self.status_bar.showMessage("Загрузка изображения прервана", 5000)
     
     def save_file(self):
-        """Сохраняет изображение"""
+        """Сохраняет изображение в фоне; рисовать при этом можно дальше"""
         from utils.file_manager import FileManager
-        FileManager.save_image(self.canvas.image, self, self.current_session_id, self.db_manager)
+        task = FileManager.save_image(self.canvas.snapshot_image(), self)
+        if task is None:
+            return
+        task.signals.finished.connect(self.finish_save)
+        self.save_tasks.append(task)
+        self.task_progress.show()
+        self.status_bar.showMessage(f"Сохранение {os.path.basename(task.filename)}...")
+    
+    def finish_save(self, token, filename, format_name, success, file_size):
+        """Завершение фонового сохранения: запись в БД и сообщение в строке состояния"""
+        self.save_tasks = [task for task in self.save_tasks if task.token != token]
+        self.task_progress.setVisible(bool(self.save_tasks) or self.load_task is not None)
+        if success:
+            self.db_manager.log_file_save(self.current_session_id, filename, format_name, file_size)
+            self.status_bar.showMessage(f"Изображение сохранено как {format_name}: {filename}", 5000)
+        else:
+            QMessageBox.warning(self, "Ошибка", "Не удалось сохранить изображение")
     
     def clear_canvas(self):
         """Очищает холст"""
@@ -418,9 +608,135 @@ class MainWindow(QMainWindow):
     
     def show_stats(self):
         """Показывает окно статистики"""
-        dialog = StatsDialog(self)
+        # Статистика читается из БД, поэтому дописываем отложенные действия
+        self.db_manager.flush()
+        dialog = StatsDialog(self, self.db_manager)
         dialog.exec()
     
+    def export_history(self):
+        """Выгружает историю рисования в файл в фоновом потоке"""
+        if self.export_thread is not None:
+            return
+        filename, _ = QFileDialog.getSaveFileName(
+            self,
+            "Экспорт истории",
+            "paint_history.csv",
+            "CSV (*.csv);;CSV gzip (*.csv.gz);;JSON Lines (*.jsonl);;JSON Lines gzip (*.jsonl.gz)"
+        )
+        if not filename:
+            return
+        self.db_manager.flush()
+
+        def run():
+            try:
+                result = export_history(self.db_manager, filename, progress=self.export_progress.emit)
+            except Exception as e:
+                result = str(e)
+            self.export_finished.emit(result)
+
+        self.export_thread = threading.Thread(target=run, name="history-export", daemon=True)
+        self.export_history_action.setEnabled(False)
+        self.export_thread.start()
+    
+    def show_export_progress(self, rows):
+        self.status_bar.showMessage(f"Экспорт истории: {rows} строк...")
+    
+    def finish_export(self, result):
+        """Сообщает итог выгрузки истории"""
+        self.export_thread = None
+        self.export_history_action.setEnabled(True)
+        if isinstance(result, dict):
+            self.status_bar.showMessage(
+                f"История выгружена: {result['rows']} строк за {result['seconds']:.1f} с "
+                f"({result['rows_per_second']:.0f} строк/с)", 5000
+            )
+        else:
+            QMessageBox.warning(self, "Ошибка", f"Не удалось выгрузить историю: {result}")
+    
+    def save_trace(self):
+        """Сохраняет журнал диагностики в файл"""
+        filename, _ = QFileDialog.getSaveFileName(
+            self,
+            "Сохранить журнал диагностики",
+            "paint_trace.log",
+            "Log Files (*.log);;All Files (*)"
+        )
+        if not filename:
+            return
+        try:
+            count = trace.dump(filename)
+            self.status_bar.showMessage(f"Журнал диагностики сохранен: {count} событий", 5000)
+        except Exception as e:
+            QMessageBox.warning(self, "Ошибка", f"Не удалось сохранить журнал: {e}")
+    
+    def clear_old_history(self):
+        """Запускает фоновую очистку истории старше срока из настроек"""
+        if self.retention_job is not None:
+            return
+        days = self.settings_manager.get_setting("history_retention_days")
+        self.db_manager.flush()
+        self.retention_job = self.db_manager.start_retention(
+            days,
+            progress=self.retention_progress.emit,
+            finished=self.retention_finished.emit
+        )
+        self.status_bar.showMessage(f"Очистка истории старше {days} дней...")
+    
+    def compact_database(self):
+        """Переводит файл истории в режим постепенного сжатия (однократный полный VACUUM в фоне)"""
+        if self.retention_job is not None:
+            self.status_bar.showMessage("Дождитесь окончания обслуживания истории", 5000)
+            return
+        if self.db_manager.is_incremental_vacuum():
+            self.status_bar.showMessage("Файл истории уже сжимается при каждой очистке", 5000)
+            return
+        answer = QMessageBox.question(
+            self,
+            "Сжатие файла истории",
+            "Файл истории будет переписан целиком в фоне. Для большой истории это может "
+            "занять несколько минут; рисовать можно дальше, действия запишутся после "
+            "окончания. Продолжить?"
+        )
+        if answer != QMessageBox.StandardButton.Yes:
+            return
+        self.retention_job = self.db_manager.start_compaction(
+            progress=self.retention_progress.emit,
+            finished=self.compaction_finished.emit
+        )
+        self.status_bar.showMessage("Сжатие файла истории...")
+    
+    def show_retention_progress(self, stage, done, total):
+        """Показывает ход очистки истории в строке состояния"""
+        stage_names = {
+            "actions": "действия",
+            "files": "файлы",
+            "sessions": "сессии",
+            "vacuum": "сжатие файла"
+        }
+        if stage == "compact":
+            self.status_bar.showMessage("Сжатие файла истории: файл переписывается...")
+            return
+        text = f"Очистка истории: {stage_names.get(stage, stage)} {done}"
+        if total:
+            text += f" из {total}"
+        self.status_bar.showMessage(text)
+    
+    def finish_retention(self, result):
+        """Сообщает итог очистки истории"""
+        self.retention_job = None
+        self.status_bar.showMessage(
+            f"История очищена: удалено действий {result['actions']}, "
+            f"освобождено {result['reclaimed_bytes'] // 1024} КБ", 5000
+        )
+    
+    def finish_compaction(self, result):
+        """Сообщает итог сжатия файла истории"""
+        self.retention_job = None
+        if isinstance(result, int):
+            self.status_bar.showMessage(f"Файл истории сжат: освобождено {result // 1024} КБ", 5000)
+        else:
+            QMessageBox.warning(self, "Ошибка", f"Не удалось сжать файл истории: {result}")
+    
     def closeEvent(self, event):
         """Сохраняет настройки при закрытии"""
         self.settings_manager.set_setting("window_size", [self.width(), self.height()])
@@ -430,6 +746,28 @@ class MainWindow(QMainWindow):
                                           self.current_color.green(), 
                                           self.current_color.blue()])
         self.settings_manager.set_setting("brush_size", self.brush_size)
+        self.settings_manager.flush()
+        
+        # Штатное закрытие: журнал автосохранения для восстановления не нужен
+        self.autosave.stop(discard=True)
+        self.canvas.undo_stack.shutdown()
+        
+        # Дожидаемся фоновых сохранений и обрабатываем их итог до закрытия БД
+        if self.load_task is not None:
+            self.load_task.cancel()
+        if self.save_tasks:
+            QThreadPool.globalInstance().waitForDone()
+            QApplication.sendPostedEvents()
+        
+        # Прерываем очистку истории: она останавливается после текущей пачки
+        if self.retention_job is not None:
+            thread, cancel = self.retention_job
+            cancel.set()
+            thread.join()
+        
+        # Выгрузка читает БД на своем соединении; дожидаемся ее до закрытия БД
+        if self.export_thread is not None:
+            self.export_thread.join()
         
         # Завершаем сессию в БД
         self.db_manager.end_session(self.current_session_id)
@@ -1,13 +1,30 @@
 from PyQt6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel, 
-                             QPushButton, QTableWidget, QTableWidgetItem,
+                             QPushButton, QTableView, QTableWidget, QTableWidgetItem,
                              QHeaderView, QTabWidget, QWidget)
-from PyQt6.QtCore import Qt
-from utils.database import DatabaseManager
+from PyQt6.QtCore import Qt, QThread, pyqtSignal
+from utils.database import get_database_manager, format_duration
+from ui.history_model import ActionsHistoryModel
+from utils import trace
+
+
+class AnalyticsWorker(QThread):
+    """Считает статистику за все время в фоновом потоке"""
+    analytics_ready = pyqtSignal(dict)
+
+    def __init__(self, db_manager, parent=None):
+        super().__init__(parent)
+        self.db_manager = db_manager
+
+    def run(self):
+        self.analytics_ready.emit(self.db_manager.get_all_time_analytics())
+
 
 class StatsDialog(QDialog):
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, db_manager=None):
         super().__init__(parent)
-        self.db_manager = DatabaseManager()
+        # Используем соединение главного окна, а не открываем новое
+        self.db_manager = db_manager or get_database_manager()
+        self.analytics_worker = None
         self.setWindowTitle("Статистика рисования")
         self.setFixedSize(500, 400)
         self.setup_ui()
@@ -28,6 +45,11 @@ class StatsDialog(QDialog):
         self.history_tab = QWidget()
         self.setup_history_tab()
         self.tabs.addTab(self.history_tab, "История действий")
+        
+        # Вкладка статистики за все время
+        self.all_time_tab = QWidget()
+        self.setup_all_time_tab()
+        self.tabs.addTab(self.all_time_tab, "За все время")
 
         layout.addWidget(self.tabs)
 
@@ -76,14 +98,94 @@ class StatsDialog(QDialog):
         layout = QVBoxLayout()
         
         # Таблица истории
-        self.history_table = QTableWidget()
-        self.history_table.setColumnCount(4)
-        self.history_table.setHorizontalHeaderLabels(["Время", "Инструмент", "Цвет", "Размер"])
+        self.history_model = ActionsHistoryModel(self.db_manager, self.get_current_session_id(), parent=self)
+        self.history_table = QTableView()
+        self.history_table.setModel(self.history_model)
+        self.history_table.verticalHeader().setVisible(False)
         self.history_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
         
         layout.addWidget(self.history_table)
         self.history_tab.setLayout(layout)
 
+    def setup_all_time_tab(self):
+        layout = QVBoxLayout()
+        
+        # Итоги и популярные инструменты
+        self.all_time_stats = QLabel("Загрузка...")
+        layout.addWidget(self.all_time_stats)
+        
+        # Активность по дням
+        self.daily_label = QLabel("Активность по дням:")
+        self.daily_label.setStyleSheet("font-weight: bold; margin-top: 10px;")
+        layout.addWidget(self.daily_label)
+        
+        self.daily_table = QTableWidget()
+        self.daily_table.setColumnCount(4)
+        self.daily_table.setHorizontalHeaderLabels(["День", "Сессий", "Действий", "Время"])
+        self.daily_table.verticalHeader().setVisible(False)
+        self.daily_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        layout.addWidget(self.daily_table)
+        
+        # Последние сессии
+        self.sessions_label = QLabel("Сессии:")
+        self.sessions_label.setStyleSheet("font-weight: bold; margin-top: 10px;")
+        layout.addWidget(self.sessions_label)
+        
+        self.sessions_table = QTableWidget()
+        self.sessions_table.setColumnCount(4)
+        self.sessions_table.setHorizontalHeaderLabels(["Сессия", "Начало", "Действий", "Длительность"])
+        self.sessions_table.verticalHeader().setVisible(False)
+        self.sessions_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        layout.addWidget(self.sessions_table)
+        
+        self.all_time_tab.setLayout(layout)
+
+    def load_all_time_stats(self):
+        """Запускает подсчет статистики за все время в фоновом потоке"""
+        self.analytics_worker = AnalyticsWorker(self.db_manager, self)
+        self.analytics_worker.analytics_ready.connect(self.show_all_time_stats)
+        self.analytics_worker.start()
+
+    def show_all_time_stats(self, analytics):
+        """Показывает статистику за все время"""
+        try:
+            if not analytics:
+                self.all_time_stats.setText("Нет данных")
+                return
+            
+            info_text = (f"Всего сессий: {analytics['sessions_count']}\n"
+                         f"Всего действий: {analytics['actions_count']}\n"
+                         f"Время рисования: {format_duration(analytics['duration'])}\n"
+                         f"Популярные инструменты: ")
+            info_text += ", ".join(f"{tool} ({count})" for tool, count in analytics["top_tools"]) or "нет"
+            self.all_time_stats.setText(info_text)
+            
+            daily = analytics["daily"]
+            self.daily_table.setRowCount(len(daily))
+            for row, (day, sessions_count, actions_count, duration) in enumerate(daily):
+                self.daily_table.setItem(row, 0, QTableWidgetItem(day))
+                self.daily_table.setItem(row, 1, QTableWidgetItem(str(sessions_count)))
+                self.daily_table.setItem(row, 2, QTableWidgetItem(str(actions_count)))
+                self.daily_table.setItem(row, 3, QTableWidgetItem(format_duration(duration)))
+            
+            sessions = analytics["sessions"]
+            self.sessions_table.setRowCount(len(sessions))
+            for row, (session_id, start_time, end_time, actions_count, duration) in enumerate(sessions):
+                self.sessions_table.setItem(row, 0, QTableWidgetItem(f"#{session_id}"))
+                self.sessions_table.setItem(row, 1, QTableWidgetItem(start_time.split('.')[0]))
+                self.sessions_table.setItem(row, 2, QTableWidgetItem(str(actions_count)))
+                duration_text = "В процессе" if duration is None else format_duration(duration)
+                self.sessions_table.setItem(row, 3, QTableWidgetItem(duration_text))
+                
+        except Exception as e:
+            trace.error("Ошибка загрузки статистики за все время: {}", e)
+
+    def done(self, result):
+        """Дожидается фонового подсчета перед закрытием окна"""
+        if self.analytics_worker is not None:
+            self.analytics_worker.wait()
+        super().done(result)
+
     def load_stats(self):
         """Загружает статистику из базы данных"""
         try:
@@ -110,25 +212,22 @@ class StatsDialog(QDialog):
 
             # История действий
             self.load_history()
+            
+            # Статистика за все время
+            self.load_all_time_stats()
 
         except Exception as e:
-            print(f"Ошибка загрузки статистики: {e}")
+            trace.error("Ошибка загрузки статистики: {}", e)
 
     def load_history(self):
         """Загружает историю действий в таблицу"""
         try:
-            history = self.db_manager.get_actions_history(self.get_current_session_id())
-            self.history_table.setRowCount(len(history))
+            # Строки подгружаются страницами по мере прокрутки (fetchMore)
+            self.history_model.reload()
+            self.history_model.fetchMore()
             
-            for row, action in enumerate(history):
-                time, tool, color, size = action
-                self.history_table.setItem(row, 0, QTableWidgetItem(time))
-                self.history_table.setItem(row, 1, QTableWidgetItem(tool))
-                self.history_table.setItem(row, 2, QTableWidgetItem(color))
-                self.history_table.setItem(row, 3, QTableWidgetItem(str(size)))
-                
         except Exception as e:
-            print(f"Ошибка загрузки истории: {e}")
+            trace.error("Ошибка загрузки истории: {}", e)
 
     def get_current_session_id(self):
         """Получает ID текущей сессии из родительского окна"""
@@ -0,0 +1,190 @@
+import os
+import queue
+import struct
+import threading
+import zlib
+
+from PyQt6.QtCore import QObject, QTimer
+from PyQt6.QtGui import QImage
+from models.tiled_image import TiledImage
+from utils import trace
+from utils.project_file import decode_tile, encode_tile
+
+AUTOSAVE_JOURNAL = os.path.join("data", "autosave.journal")
+
+# Интервал контрольных точек в секундах
+AUTOSAVE_INTERVAL = 30
+
+# Размер журнала, после которого следующая точка переписывает его целиком
+AUTOSAVE_COMPACT_BYTES = 64 * 1024 * 1024
+
+JOURNAL_MAGIC = b"SPJRNL01"
+JOURNAL_HEADER = struct.Struct("<8sH")
+
+# Запись журнала: тип, два целых (тайл или размер документа), длина данных, CRC32 данных
+RECORD_STRUCT = struct.Struct("<BiiII")
+RECORD_TILE = 1
+RECORD_BLANK = 2
+RECORD_COMMIT = 3
+
+
+def write_record(f, kind, a, b, data=b""):
+    f.write(RECORD_STRUCT.pack(kind, a, b, len(data), zlib.crc32(data)))
+    f.write(data)
+
+
+def replay_journal(path=AUTOSAVE_JOURNAL):
+    """Восстанавливает изображение из журнала контрольных точек
+
+    Применяются только точки, завершенные записью COMMIT; недописанный
+    хвост (аварийное завершение во время записи) отбрасывается. Возвращает
+    TiledImage или None, если в журнале нет ни одной целой точки.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    if len(data) < JOURNAL_HEADER.size:
+        return None
+    magic, tile_size = JOURNAL_HEADER.unpack_from(data, 0)
+    if magic != JOURNAL_MAGIC:
+        trace.warning("{} не является журналом автосохранения", path)
+        return None
+
+    image = None
+    pending = {}
+    position = JOURNAL_HEADER.size
+    while position + RECORD_STRUCT.size <= len(data):
+        kind, a, b, length, crc = RECORD_STRUCT.unpack_from(data, position)
+        position += RECORD_STRUCT.size
+        payload = data[position:position + length]
+        position += length
+        if len(payload) != length or zlib.crc32(payload) != crc:
+            break
+        if kind == RECORD_TILE:
+            pending[(a, b)] = payload
+        elif kind == RECORD_BLANK:
+            pending[(a, b)] = None
+        elif kind == RECORD_COMMIT:
+            if image is None:
+                image = TiledImage(a, b, tile_size)
+            image.resize(a, b)
+            for key, payload in pending.items():
+                image.set_tile(key, None if payload is None else
+                               decode_tile(payload, tile_size, QImage.Format.Format_RGB32))
+            pending = {}
+        else:
+            break
+    return image
+
+
+def discard_journal(path=AUTOSAVE_JOURNAL):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        trace.error("Ошибка удаления журнала автосохранения: {}", e)
+
+
+class AutosaveService(QObject):
+    """Автосохранение холста в журнал контрольных точек
+
+    По таймеру берется снимок изображения (копирование при записи, см.
+    TiledImage.snapshot), а фоновый поток дописывает в журнал только тайлы,
+    измененные с прошлой точки, и запись COMMIT. Если точка с момента
+    прошлой еще пишется или холст не менялся, тик пропускается. Когда
+    журнал разрастается, следующая точка записывает все тайлы в новый файл.
+    """
+
+    def __init__(self, canvas, path=AUTOSAVE_JOURNAL, interval=AUTOSAVE_INTERVAL, parent=None):
+        super().__init__(parent)
+        self.canvas = canvas
+        self.path = path
+        self.queue = queue.Queue(maxsize=1)
+        self.thread = None
+        self.queued_generation = None
+        # Состояние ниже меняет только поток записи
+        self.written_generation = None
+        self.journal_size = 0
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.checkpoint)
+        self.set_interval(interval)
+
+    def set_interval(self, seconds):
+        self.timer.setInterval(int(max(1, seconds) * 1000))
+
+    def start(self):
+        """Начинает новый журнал (прежний должен быть уже восстановлен или удален)"""
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.run, name="autosave", daemon=True)
+        self.thread.start()
+        self.timer.start()
+
+    def checkpoint(self):
+        """Ставит в очередь снимок холста, если он изменился с прошлой точки"""
+        image = self.canvas.image
+        if image is None or image.generation == self.queued_generation:
+            return False
+        if self.queue.full():
+            return False
+        snapshot = self.canvas.snapshot_image()
+        self.queue.put(snapshot)
+        self.queued_generation = snapshot.generation
+        return True
+
+    def stop(self, discard=True):
+        """Останавливает автосохранение; discard - удалить журнал (штатное закрытие)"""
+        self.timer.stop()
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        if discard:
+            discard_journal(self.path)
+
+    def run(self):
+        while True:
+            snapshot = self.queue.get()
+            if snapshot is None:
+                return
+            try:
+                self.write_checkpoint(snapshot)
+            except Exception as e:
+                trace.error("Ошибка автосохранения: {}", e)
+                # Следующая точка перепишет журнал целиком
+                self.written_generation = None
+
+    def write_checkpoint(self, snapshot):
+        full = self.written_generation is None or self.journal_size > AUTOSAVE_COMPACT_BYTES
+        if full:
+            keys = list(snapshot.tiles)
+            target = self.path + ".tmp"
+            mode = "wb"
+        else:
+            keys = snapshot.changed_since(self.written_generation)
+            target = self.path
+            mode = "ab"
+
+        with open(target, mode) as f:
+            if full:
+                f.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, snapshot.tile_size))
+            for key in keys:
+                tile = snapshot.tiles.get(key)
+                if tile is None:
+                    write_record(f, RECORD_BLANK, key[0], key[1])
+                else:
+                    write_record(f, RECORD_TILE, key[0], key[1], encode_tile(tile))
+            write_record(f, RECORD_COMMIT, snapshot.width(), snapshot.height())
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        if full:
+            os.replace(target, self.path)
+
+        self.journal_size = size
+        self.written_generation = snapshot.generation
+        trace.debug("Контрольная точка: {} тайлов, журнал {} байт", len(keys), size)
@@ -0,0 +1,253 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from PyQt6.QtCore import QPoint, QSize, Qt
+from PyQt6.QtGui import QColor, QGuiApplication, QImageReader
+from models.drawing_tools import FillTool
+from models.tiled_image import TiledImage
+from utils import trace
+from utils.database import DatabaseManager
+from utils.file_manager import FileManager
+from utils.image_loader import fit_size, read_scaled
+from utils.project_file import is_project_file, load_project
+
+# Формат результата по имени в командной строке
+OUTPUT_FORMATS = {"png": ".png", "jpeg": ".jpg", "bmp": ".bmp", "spaint": ".spaint"}
+
+THUMBNAIL_SIZE = 256
+
+# Экземпляр QGuiApplication процесса-исполнителя
+_worker_app = None
+
+
+def parse_point(text):
+    x, y = (int(part) for part in text.split(","))
+    return x, y
+
+
+def parse_color(text):
+    parts = tuple(int(part) for part in text.split(","))
+    if len(parts) not in (3, 4):
+        raise argparse.ArgumentTypeError("цвет задается как r,g,b или r,g,b,a")
+    return parts
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="main.py --batch",
+                                     description="Пакетная обработка изображений без интерфейса")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_common(command):
+        command.add_argument("inputs", nargs="+", metavar="FILE", help="исходные изображения")
+        command.add_argument("-o", "--output", required=True, metavar="DIR",
+                             help="папка для результатов")
+        command.add_argument("--format", choices=sorted(OUTPUT_FORMATS), default="png",
+                             help="формат результатов (по умолчанию png)")
+        command.add_argument("-j", "--jobs", type=int, default=None,
+                             help="число процессов (по умолчанию - число ядер)")
+
+    add_common(commands.add_parser("convert", help="преобразовать изображения в другой формат"))
+
+    fill = commands.add_parser("fill", help="залить изображения от заданных точек")
+    add_common(fill)
+    fill.add_argument("--seed", type=parse_point, action="append", metavar="X,Y",
+                      help="точка заливки (можно несколько; по умолчанию 0,0)")
+    fill.add_argument("--color", type=parse_color, default=(255, 255, 255), metavar="R,G,B",
+                      help="цвет заливки (по умолчанию белый)")
+    fill.add_argument("--tolerance", type=int, default=0, help="допуск заливки 0-255")
+    fill.add_argument("--mode", choices=("contiguous", "global"), default="contiguous",
+                      help="связная область или замена цвета по всему изображению")
+
+    thumbnail = commands.add_parser("thumbnail", help="создать уменьшенные копии")
+    add_common(thumbnail)
+    thumbnail.add_argument("--size", type=int, default=THUMBNAIL_SIZE,
+                           help="наибольшая сторона миниатюры в пикселях")
+    return parser
+
+
+def init_worker():
+    """Готовит процесс-исполнитель: Qt без экрана"""
+    global _worker_app
+    os.environ["QT_QPA_PLATFORM"] = "offscreen"
+    _worker_app = QGuiApplication.instance() or QGuiApplication([])
+
+
+def read_source(filename):
+    """Читает изображение или проект .spaint как QImage"""
+    if is_project_file(filename):
+        return load_project(filename).to_qimage()
+    reader = QImageReader(filename)
+    image = reader.read()
+    if image.isNull():
+        raise ValueError(reader.errorString())
+    return image
+
+
+def read_thumbnail(filename, size):
+    """Миниатюра: декодеры с поддержкой уменьшения (JPEG) сразу читают ее размер"""
+    bounds = QSize(size, size)
+    if is_project_file(filename):
+        return read_source(filename).scaled(bounds, Qt.AspectRatioMode.KeepAspectRatio,
+                                            Qt.TransformationMode.SmoothTransformation)
+    source_size = QImageReader(filename).size()
+    if not source_size.isValid():
+        raise ValueError("не удалось прочитать размер изображения")
+    image = read_scaled(filename, fit_size(source_size, bounds).expandedTo(QSize(1, 1)))
+    if image.isNull():
+        raise ValueError("не удалось прочитать изображение")
+    return image
+
+
+def new_result(filename, output, format_name, error=None):
+    return {"input": filename, "output": output, "format": format_name,
+            "success": False, "error": error, "input_bytes": 0, "output_bytes": 0,
+            "pixels": 0, "fills": 0, "seconds": 0.0}
+
+
+def process_file(command, filename, output, format_name, options):
+    """Обрабатывает один файл в процессе-исполнителе; возвращает словарь с итогом"""
+    started = time.perf_counter()
+    result = new_result(filename, output, format_name)
+    try:
+        result["input_bytes"] = os.path.getsize(filename)
+        if command == "thumbnail":
+            image = read_thumbnail(filename, options["size"])
+        else:
+            image = read_source(filename)
+        result["pixels"] = image.width() * image.height()
+
+        if command == "fill":
+            image = TiledImage.from_qimage(image)
+            tool = FillTool()
+            tool.set_mode(options["mode"])
+            tool.set_tolerance(options["tolerance"])
+            color = QColor(*options["color"])
+            for x, y in options["seeds"]:
+                if tool.fill(image, QPoint(x, y), color):
+                    result["fills"] += 1
+
+        success, file_size = FileManager.write_image(image, output, format_name)
+        if not success:
+            raise ValueError("не удалось записать результат")
+        result["success"] = True
+        result["output_bytes"] = file_size
+    except Exception as e:
+        result["error"] = str(e)
+    result["seconds"] = time.perf_counter() - started
+    return result
+
+
+def plan_outputs(inputs, output_dir, extension):
+    """Имена результатов: [(исходный файл, результат или None, ошибка или None)]
+
+    Результат называется по имени исходного файла. Если имена совпадают
+    (x.png из разных папок или a.png и a.jpg), к следующим добавляется
+    суффикс _2, _3 и т.д., чтобы процессы не писали в один файл. Результат,
+    который заменил бы исходный файл, не создается.
+    """
+    sources = {os.path.normcase(os.path.abspath(filename)) for filename in inputs}
+    taken = set()
+    plan = []
+    for filename in inputs:
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        output = os.path.join(output_dir, stem + extension)
+        number = 1
+        while os.path.normcase(os.path.abspath(output)) in taken:
+            number += 1
+            output = os.path.join(output_dir, f"{stem}_{number}{extension}")
+        key = os.path.normcase(os.path.abspath(output))
+        if key in sources:
+            plan.append((filename, None, f"результат {output} заменил бы исходный файл"))
+            continue
+        taken.add(key)
+        plan.append((filename, output, None))
+    return plan
+
+
+def log_results(results, command, options):
+    """Записывает итоги в историю: отдельная сессия, сохраненные файлы, действия заливки"""
+    db_manager = DatabaseManager(async_writes=False)
+    try:
+        session_id = db_manager.start_session()
+        if session_id is None:
+            return
+        for result in results:
+            if not result["success"]:
+                continue
+            if command == "fill":
+                for _ in range(result["fills"]):
+                    db_manager.log_action(session_id, "fill", options["color"], 0)
+            db_manager.log_file_save(session_id, result["output"], result["format"],
+                                     result["output_bytes"])
+        db_manager.end_session(session_id)
+    finally:
+        db_manager.close()
+
+
+def run_batch(argv, out=sys.stdout):
+    """Выполняет пакетную команду; возвращает код завершения процесса
+
+    Файлы обрабатываются в пуле процессов (Qt в каждом - без экрана, через
+    offscreen). Итог каждого файла печатается по мере готовности, в конце -
+    сводка скорости; успешные результаты записываются в историю.
+    """
+    args = build_parser().parse_args(argv)
+    extension = OUTPUT_FORMATS[args.format]
+    format_name = FileManager.format_for_filename("file" + extension)
+    os.makedirs(args.output, exist_ok=True)
+
+    options = {}
+    if args.command == "fill":
+        options = {"seeds": args.seed or [(0, 0)], "color": args.color,
+                   "tolerance": args.tolerance, "mode": args.mode}
+    elif args.command == "thumbnail":
+        options = {"size": max(1, args.size)}
+
+    total = len(args.inputs)
+    plan = plan_outputs(args.inputs, args.output, extension)
+    jobs = min(max(1, args.jobs or os.cpu_count() or 1), total)
+    results = []
+
+    def report(result):
+        results.append(result)
+        if result["success"]:
+            status = f"{result['output']} ({result['seconds'] * 1000:.0f} мс)"
+        else:
+            status = f"ошибка: {result['error']}"
+            trace.error("Ошибка обработки {}: {}", result["input"], result["error"])
+        print(f"[{len(results)}/{total}] {result['input']} -> {status}", file=out, flush=True)
+
+    started = time.perf_counter()
+    for filename, output, error in plan:
+        if error is not None:
+            report(new_result(filename, output, format_name, error))
+    # spawn: дочерние процессы не наследуют потоки и состояние Qt родителя
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context,
+                             initializer=init_worker) as executor:
+        futures = [executor.submit(process_file, args.command, filename, output,
+                                   format_name, options)
+                   for filename, output, error in plan if error is None]
+        for future in as_completed(futures):
+            report(future.result())
+    seconds = time.perf_counter() - started
+
+    succeeded = [result for result in results if result["success"]]
+    megapixels = sum(result["pixels"] for result in succeeded) / 1e6
+    megabytes = sum(result["input_bytes"] for result in succeeded) / (1024 * 1024)
+    rate = seconds if seconds > 0 else 1e-9
+    print(f"Готово: {len(succeeded)} из {total} файлов за {seconds:.2f} с "
+          f"({jobs} процессов): {len(succeeded) / rate:.1f} файлов/с, "
+          f"{megapixels / rate:.1f} Мпикс/с, {megabytes / rate:.1f} МБ/с", file=out)
+    trace.info("Пакетная обработка {}: {} из {} файлов за {:.2f} с",
+               args.command, len(succeeded), total, seconds)
+
+    try:
+        log_results(results, args.command, options)
+    except Exception as e:
+        trace.error("Ошибка записи итогов пакетной обработки: {}", e)
+    return 0 if len(succeeded) == total else 1
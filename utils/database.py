@@ -1,18 +1,371 @@
 import sqlite3
 import datetime
 import os
+import queue
+import threading
+import time
 from PyQt6.QtGui import QColor
+from utils import trace
+
+# Максимальное число записей в одной групповой транзакции фонового писателя
+WRITE_BATCH_SIZE = 500
+
+# Сколько писатель ждет новых записей, прежде чем проверить флаг остановки (сек)
+WRITER_POLL_INTERVAL = 0.5
+
+# Сколько раз при остановке повторяется запись в занятую БД и пауза между попытками (сек)
+WRITE_RETRY_ATTEMPTS = 5
+WRITE_RETRY_DELAY = 0.2
+
+INSERT_ACTION_SQL = '''INSERT INTO drawing_actions 
+                       (session_id, tool_id, color, brush_size, timestamp) 
+                       VALUES (?, ?, ?, ?, ?)'''
+
+# Инструмент, которого еще нет в справочнике, добавляет фоновый писатель, а
+# действие находит его id по имени (запросы пачки идут в порядке первого
+# появления, поэтому добавление инструмента выполняется раньше действия)
+INSERT_TOOL_SQL = 'INSERT OR IGNORE INTO tools (name) VALUES (?)'
+
+INSERT_ACTION_BY_NAME_SQL = '''INSERT INTO drawing_actions 
+                               (session_id, tool_id, color, brush_size, timestamp) 
+                               SELECT ?, id, ?, ?, ? FROM tools WHERE name = ?'''
+
+INSERT_FILE_SQL = '''INSERT INTO saved_files 
+                     (session_id, filename, file_format, save_time, file_size) 
+                     VALUES (?, ?, ?, ?, ?)'''
+
+# Упакованный цвет ARGB (INTEGER) в прежнем текстовом виде "r,g,b"
+COLOR_TEXT_SQL = "((color >> 16) & 255) || ',' || ((color >> 8) & 255) || ',' || (color & 255)"
+
+# Время действия (миллисекунды эпохи) в прежнем виде ISO 8601 по местному времени
+TIMESTAMP_TEXT_SQL = "strftime('%Y-%m-%dT%H:%M:%f', timestamp / 1000.0, 'unixepoch', 'localtime')"
+
+# Длительность сессии в секундах (NULL, пока сессия не завершена)
+DURATION_SECONDS_SQL = "CAST(round((julianday(end_time) - julianday(start_time)) * 86400) AS INTEGER)"
+
+# Сколько строк удаляется одной транзакцией при очистке старых данных
+RETENTION_BATCH_SIZE = 2000
+
+# Сколько свободных страниц возвращается файлу за один шаг incremental_vacuum
+VACUUM_SLICE_PAGES = 256
+
+# Значение PRAGMA auto_vacuum для режима INCREMENTAL
+AUTO_VACUUM_INCREMENTAL = 2
+
+# Размер страницы истории действий при постраничной загрузке
+HISTORY_PAGE_SIZE = 200
+
+
+def format_duration(seconds):
+    """Длительность в секундах в виде Ч:ММ:СС"""
+    return str(datetime.timedelta(seconds=int(seconds)))
+
+
+def pack_color(color):
+    """Упаковывает цвет (QColor, кортеж или строку "r,g,b[,a]") в целое ARGB"""
+    if isinstance(color, QColor):
+        return color.rgba()
+    if isinstance(color, str):
+        color = color.split(',')
+    channels = [int(channel) for channel in color]
+    red, green, blue = channels[:3]
+    alpha = channels[3] if len(channels) > 3 else 255
+    return (alpha << 24) | (red << 16) | (green << 8) | blue
+
+
+def epoch_ms(moment=None):
+    """Момент времени (по умолчанию текущий) в миллисекундах эпохи"""
+    moment = moment or datetime.datetime.now()
+    return int(moment.timestamp() * 1000)
+
+
+def migrate_stats_indexes(cursor):
+    """Индексы под запросы статистики, истории и очистки старых данных"""
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_actions_session_tool
+                      ON drawing_actions (session_id, tool_name)''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_actions_session_color
+                      ON drawing_actions (session_id, color)''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_actions_session_time
+                      ON drawing_actions (session_id, timestamp)''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_files_session_time
+                      ON saved_files (session_id, save_time)''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_sessions_start_time
+                      ON drawing_sessions (start_time)''')
+
+
+def migrate_session_rollups(cursor):
+    """Сводные таблицы по сессиям, которые триггеры обновляют в транзакции каждой записи"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS session_tool_counts (
+            session_id INTEGER NOT NULL,
+            tool_name TEXT NOT NULL,
+            usage_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (session_id, tool_name)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS session_color_counts (
+            session_id INTEGER NOT NULL,
+            color TEXT NOT NULL,
+            usage_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (session_id, color)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS session_totals (
+            session_id INTEGER PRIMARY KEY,
+            actions_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    
+    # Заполняем сводки по уже накопленным действиям
+    cursor.execute('''
+        INSERT OR REPLACE INTO session_tool_counts (session_id, tool_name, usage_count)
+        SELECT session_id, tool_name, COUNT(*) FROM drawing_actions
+        WHERE session_id IS NOT NULL GROUP BY session_id, tool_name
+    ''')
+    cursor.execute('''
+        INSERT OR REPLACE INTO session_color_counts (session_id, color, usage_count)
+        SELECT session_id, color, COUNT(*) FROM drawing_actions
+        WHERE session_id IS NOT NULL GROUP BY session_id, color
+    ''')
+    cursor.execute('''
+        INSERT OR REPLACE INTO session_totals (session_id, actions_count)
+        SELECT session_id, COUNT(*) FROM drawing_actions
+        WHERE session_id IS NOT NULL GROUP BY session_id
+    ''')
+    cursor.execute('''
+        UPDATE drawing_sessions SET tools_used = (
+            SELECT group_concat(tool_name, ',') FROM session_tool_counts
+            WHERE session_tool_counts.session_id = drawing_sessions.id
+        ) WHERE end_time IS NOT NULL
+    ''')
+    
+    create_rollup_triggers(cursor)
+
+
+def create_rollup_triggers(cursor):
+    """Триггеры, поддерживающие сводки по сессиям при вставке и удалении действий"""
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_actions_rollup_insert
+        AFTER INSERT ON drawing_actions
+        WHEN NEW.session_id IS NOT NULL
+        BEGIN
+            INSERT INTO session_tool_counts (session_id, tool_name, usage_count)
+            VALUES (NEW.session_id, NEW.tool_name, 1)
+            ON CONFLICT (session_id, tool_name) DO UPDATE SET usage_count = usage_count + 1;
+            
+            INSERT INTO session_color_counts (session_id, color, usage_count)
+            VALUES (NEW.session_id, NEW.color, 1)
+            ON CONFLICT (session_id, color) DO UPDATE SET usage_count = usage_count + 1;
+            
+            INSERT INTO session_totals (session_id, actions_count)
+            VALUES (NEW.session_id, 1)
+            ON CONFLICT (session_id) DO UPDATE SET actions_count = actions_count + 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_actions_rollup_delete
+        AFTER DELETE ON drawing_actions
+        WHEN OLD.session_id IS NOT NULL
+        BEGIN
+            UPDATE session_tool_counts SET usage_count = usage_count - 1
+            WHERE session_id = OLD.session_id AND tool_name = OLD.tool_name;
+            DELETE FROM session_tool_counts
+            WHERE session_id = OLD.session_id AND tool_name = OLD.tool_name AND usage_count <= 0;
+            
+            UPDATE session_color_counts SET usage_count = usage_count - 1
+            WHERE session_id = OLD.session_id AND color = OLD.color;
+            DELETE FROM session_color_counts
+            WHERE session_id = OLD.session_id AND color = OLD.color AND usage_count <= 0;
+            
+            UPDATE session_totals SET actions_count = actions_count - 1
+            WHERE session_id = OLD.session_id;
+            DELETE FROM session_totals
+            WHERE session_id = OLD.session_id AND actions_count <= 0;
+        END
+    ''')
+
+
+def _pack_color_text(text):
+    """Цвет из старой текстовой записи; нераспознанные значения становятся черным"""
+    try:
+        return pack_color(text)
+    except (TypeError, ValueError):
+        return 0xFF000000
+
+
+def _iso_to_epoch_ms(text):
+    try:
+        return epoch_ms(datetime.datetime.fromisoformat(text))
+    except (TypeError, ValueError):
+        return 0
+
+
+def migrate_compact_actions(cursor):
+    """Компактная запись действий: цвет - INTEGER ARGB, инструмент - ссылка на справочник,
+    время - миллисекунды эпохи"""
+    conn = cursor.connection
+    conn.create_function('pack_color_text', 1, _pack_color_text, deterministic=True)
+    conn.create_function('iso_to_epoch_ms', 1, _iso_to_epoch_ms, deterministic=True)
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tools (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO tools (name) SELECT DISTINCT tool_name FROM drawing_actions')
+    
+    # Перестраиваем таблицу действий; старые триггеры и индексы удаляются вместе с ней
+    cursor.execute('''
+        CREATE TABLE drawing_actions_compact (
+            id INTEGER PRIMARY KEY,
+            session_id INTEGER,
+            tool_id INTEGER NOT NULL,
+            color INTEGER NOT NULL,
+            brush_size INTEGER,
+            timestamp INTEGER NOT NULL,
+            FOREIGN KEY (session_id) REFERENCES drawing_sessions (id),
+            FOREIGN KEY (tool_id) REFERENCES tools (id)
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO drawing_actions_compact (id, session_id, tool_id, color, brush_size, timestamp)
+        SELECT a.id, a.session_id, t.id, pack_color_text(a.color), a.brush_size,
+               iso_to_epoch_ms(a.timestamp)
+        FROM drawing_actions a JOIN tools t ON t.name = a.tool_name
+    ''')
+    cursor.execute('DROP TABLE drawing_actions')
+    cursor.execute('ALTER TABLE drawing_actions_compact RENAME TO drawing_actions')
+    # id растет вместе со временем записи, поэтому индекс по сессии (с неявным rowid)
+    # отдает историю в хронологическом порядке без отдельного индекса по времени
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_actions_session
+                      ON drawing_actions (session_id)''')
+    
+    # Сводки переходят на те же целочисленные ключи
+    cursor.execute('DROP TABLE IF EXISTS session_tool_counts')
+    cursor.execute('DROP TABLE IF EXISTS session_color_counts')
+    cursor.execute('''
+        CREATE TABLE session_tool_counts (
+            session_id INTEGER NOT NULL,
+            tool_id INTEGER NOT NULL,
+            usage_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (session_id, tool_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE session_color_counts (
+            session_id INTEGER NOT NULL,
+            color INTEGER NOT NULL,
+            usage_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (session_id, color)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        INSERT INTO session_tool_counts (session_id, tool_id, usage_count)
+        SELECT session_id, tool_id, COUNT(*) FROM drawing_actions
+        WHERE session_id IS NOT NULL GROUP BY session_id, tool_id
+    ''')
+    cursor.execute('''
+        INSERT INTO session_color_counts (session_id, color, usage_count)
+        SELECT session_id, color, COUNT(*) FROM drawing_actions
+        WHERE session_id IS NOT NULL GROUP BY session_id, color
+    ''')
+    
+    cursor.execute('''
+        CREATE TRIGGER trg_actions_rollup_insert
+        AFTER INSERT ON drawing_actions
+        WHEN NEW.session_id IS NOT NULL
+        BEGIN
+            INSERT INTO session_tool_counts (session_id, tool_id, usage_count)
+            VALUES (NEW.session_id, NEW.tool_id, 1)
+            ON CONFLICT (session_id, tool_id) DO UPDATE SET usage_count = usage_count + 1;
+            
+            INSERT INTO session_color_counts (session_id, color, usage_count)
+            VALUES (NEW.session_id, NEW.color, 1)
+            ON CONFLICT (session_id, color) DO UPDATE SET usage_count = usage_count + 1;
+            
+            INSERT INTO session_totals (session_id, actions_count)
+            VALUES (NEW.session_id, 1)
+            ON CONFLICT (session_id) DO UPDATE SET actions_count = actions_count + 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER trg_actions_rollup_delete
+        AFTER DELETE ON drawing_actions
+        WHEN OLD.session_id IS NOT NULL
+        BEGIN
+            UPDATE session_tool_counts SET usage_count = usage_count - 1
+            WHERE session_id = OLD.session_id AND tool_id = OLD.tool_id;
+            DELETE FROM session_tool_counts
+            WHERE session_id = OLD.session_id AND tool_id = OLD.tool_id AND usage_count <= 0;
+            
+            UPDATE session_color_counts SET usage_count = usage_count - 1
+            WHERE session_id = OLD.session_id AND color = OLD.color;
+            DELETE FROM session_color_counts
+            WHERE session_id = OLD.session_id AND color = OLD.color AND usage_count <= 0;
+            
+            UPDATE session_totals SET actions_count = actions_count - 1
+            WHERE session_id = OLD.session_id;
+            DELETE FROM session_totals
+            WHERE session_id = OLD.session_id AND actions_count <= 0;
+        END
+    ''')
+
+
+# Миграции схемы по порядку: (версия, описание, функция(cursor))
+MIGRATIONS = [
+    (1, "индексы для статистики", migrate_stats_indexes),
+    (2, "сводные таблицы по сессиям", migrate_session_rollups),
+    (3, "компактная запись действий", migrate_compact_actions),
+]
+
+# Общий менеджер БД процесса (см. get_database_manager)
+_shared_manager = None
+
+
+def get_database_manager():
+    """Общий менеджер БД приложения: окна и диалоги используют одно соединение"""
+    global _shared_manager
+    if _shared_manager is None or _shared_manager.closed:
+        _shared_manager = DatabaseManager()
+    return _shared_manager
+
 
 class DatabaseManager:
-    def __init__(self):
+    def __init__(self, async_writes=True):
         self.data_dir = "data"
         self.db_file = os.path.join(self.data_dir, 'paint_history.db')
         
         # Создаем папку data если её нет
         os.makedirs(self.data_dir, exist_ok=True)
         
-        self.conn = sqlite3.connect(self.db_file)
+        self.conn = self.connect()
+        self.closed = False
         self.create_tables()
+        
+        # Кэш справочника инструментов: имя -> id
+        self.tool_ids = dict(self.conn.execute('SELECT name, id FROM tools').fetchall())
+        
+        # Отложенная запись: действия уходят в очередь, фоновый поток пишет их пачками
+        self.async_writes = async_writes
+        self.write_queue = queue.Queue()
+        self.writer_thread = None
+        if async_writes:
+            self.writer_thread = threading.Thread(target=self._writer_loop,
+                                                  name="db-writer", daemon=True)
+            self.writer_thread.start()
+
+    def connect(self):
+        """Открывает соединение с БД в режиме WAL с инкрементальным auto_vacuum"""
+        conn = sqlite3.connect(self.db_file)
+        # Действует только для нового файла; существующие переводятся по команде
+        # пользователя (см. enable_incremental_vacuum)
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
 
     def create_tables(self):
         """Создает таблицы в базе данных"""
@@ -54,7 +407,46 @@ class DatabaseManager:
             )
         ''')
         
+        # Таблица версий схемы
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_time TEXT NOT NULL
+            )
+        ''')
+        
         self.conn.commit()
+        self.migrate()
+
+    def get_schema_version(self):
+        """Получает текущую версию схемы БД"""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+        return cursor.fetchone()[0]
+
+    def migrate(self):
+        """Применяет к БД недостающие миграции схемы (существующие файлы обновляются на месте)"""
+        for version, description, migration in MIGRATIONS:
+            if version <= self.get_schema_version():
+                continue
+            try:
+                cursor = self.conn.cursor()
+                # Блокируем запись, чтобы два соединения не применили миграцию дважды
+                cursor.execute('BEGIN IMMEDIATE')
+                cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+                if cursor.fetchone()[0] < version:
+                    migration(cursor)
+                    cursor.execute(
+                        'INSERT INTO schema_version (version, description, applied_time) VALUES (?, ?, ?)',
+                        (version, description, datetime.datetime.now().isoformat())
+                    )
+                    trace.info("Схема БД обновлена до версии {}: {}", version, description)
+                self.conn.commit()
+            except Exception as e:
+                self.conn.rollback()
+                trace.error("Ошибка миграции схемы до версии {}: {}", version, e)
+                break
 
     def start_session(self):
         """Начинает новую сессию рисования"""
@@ -67,95 +459,181 @@ class DatabaseManager:
             )
             self.conn.commit()
             session_id = cursor.lastrowid
-            print(f"Сессия #{session_id} начата в {start_time}")
+            trace.info("Сессия #{} начата в {}", session_id, start_time)
             return session_id
         except Exception as e:
-            print(f"Ошибка начала сессии: {e}")
+            trace.error("Ошибка начала сессии: {}", e)
             return 1
 
+    def get_tool_id(self, tool_name):
+        """Получает id инструмента из справочника или None, если инструмента в нем еще нет
+
+        Только чтение: в режиме WAL оно не ждет фонового писателя.
+        """
+        tool_id = self.tool_ids.get(tool_name)
+        if tool_id is None:
+            row = self.conn.execute('SELECT id FROM tools WHERE name = ?', (tool_name,)).fetchone()
+            if row is not None:
+                tool_id = self.tool_ids[tool_name] = row[0]
+        return tool_id
+
     def log_action(self, session_id, tool_name, color, brush_size):
         """Логирует действие рисования"""
         try:
-            cursor = self.conn.cursor()
-            timestamp = datetime.datetime.now().isoformat()
-            
-            # Конвертируем QColor в строку
-            if isinstance(color, QColor):
-                color_str = f"{color.red()},{color.green()},{color.blue()}"
+            tool_id = self.get_tool_id(tool_name)
+            if tool_id is not None:
+                self.write(INSERT_ACTION_SQL,
+                           (session_id, tool_id, pack_color(color), brush_size, epoch_ms()))
             else:
-                color_str = str(color)
-            
-            cursor.execute(
-                '''INSERT INTO drawing_actions 
-                   (session_id, tool_name, color, brush_size, timestamp) 
-                   VALUES (?, ?, ?, ?, ?)''',
-                (session_id, tool_name, color_str, brush_size, timestamp)
-            )
-            self.conn.commit()
-            print(f"Действие записано: {tool_name}, цвет: {color_str}, размер: {brush_size}")
+                # Новый инструмент добавляется в справочник вместе с действием
+                self.write(INSERT_TOOL_SQL, (tool_name,))
+                self.write(INSERT_ACTION_BY_NAME_SQL,
+                           (session_id, pack_color(color), brush_size, epoch_ms(), tool_name))
         except Exception as e:
-            print(f"Ошибка записи действия: {e}")
+            trace.error("Ошибка записи действия: {}", e)
 
     def log_file_save(self, session_id, filename, file_format, file_size=0):
         """Логирует сохранение файла"""
         try:
-            cursor = self.conn.cursor()
             save_time = datetime.datetime.now().isoformat()
-            cursor.execute(
-                '''INSERT INTO saved_files 
-                   (session_id, filename, file_format, save_time, file_size) 
-                   VALUES (?, ?, ?, ?, ?)''',
-                (session_id, filename, file_format, save_time, file_size)
-            )
-            self.conn.commit()
-            print(f"Сохранение файла записано: {filename}")
+            self.write(INSERT_FILE_SQL,
+                       (session_id, filename, file_format, save_time, file_size))
+        except Exception as e:
+            trace.error("Ошибка записи информации о файле: {}", e)
+
+    def write(self, sql, params):
+        """Выполняет запись: в фоновом режиме ставит ее в очередь, иначе пишет сразу"""
+        if self.writer_thread is not None:
+            self.write_queue.put((sql, params))
+            return
+        self.conn.execute(sql, params)
+        self.conn.commit()
+
+    def _writer_loop(self):
+        """Фоновый писатель: забирает записи из очереди и пишет их групповыми транзакциями
+
+        Если БД занята другим соединением дольше таймаута ожидания, пачка не
+        теряется: она остается в pending и пишется вместе со следующей.
+        """
+        conn = self.connect()
+        pending = []
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                batch.append(self.write_queue.get(timeout=WRITER_POLL_INTERVAL))
+            except queue.Empty:
+                if not pending:
+                    continue
+            
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self.write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            # Служебные элементы: событие сброса (flush) или остановка (None)
+            records = pending + [entry for entry in batch if isinstance(entry, tuple)]
+            events = [entry for entry in batch if isinstance(entry, threading.Event)]
+            stopping = any(entry is None for entry in batch)
+            
+            attempts = WRITE_RETRY_ATTEMPTS if stopping else 1
+            while not self._write_batch(conn, records):
+                attempts -= 1
+                if attempts <= 0:
+                    break
+                time.sleep(WRITE_RETRY_DELAY)
+            else:
+                records = []
+            pending = records
+            if pending and stopping:
+                trace.error("БД занята, не записано действий: {}", len(pending))
+            
+            for event in events:
+                event.set()
+            for _ in batch:
+                self.write_queue.task_done()
+        conn.close()
+
+    def _write_batch(self, conn, records):
+        """Пишет пачку записей одной транзакцией, группируя одинаковые запросы
+
+        Возвращает False, если БД занята (пачку нужно повторить).
+        """
+        if not records:
+            return True
+        try:
+            grouped = {}
+            for sql, params in records:
+                grouped.setdefault(sql, []).append(params)
+            with conn:
+                for sql, rows in grouped.items():
+                    conn.executemany(sql, rows)
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e) or "busy" in str(e):
+                trace.warning("БД занята, запись {} действий отложена", len(records))
+                return False
+            trace.error("Ошибка фоновой записи в БД: {}", e)
         except Exception as e:
-            print(f"Ошибка записи информации о файле: {e}")
+            trace.error("Ошибка фоновой записи в БД: {}", e)
+        return True
+
+    def flush(self, timeout=None):
+        """Дожидается записи всех действий, поставленных в очередь"""
+        if self.writer_thread is None or not self.writer_thread.is_alive():
+            return
+        done = threading.Event()
+        self.write_queue.put(done)
+        done.wait(timeout)
 
     def end_session(self, session_id):
         """Завершает сессию рисования"""
         try:
+            self.flush()
             cursor = self.conn.cursor()
             end_time = datetime.datetime.now().isoformat()
-            cursor.execute(
-                'UPDATE drawing_sessions SET end_time = ? WHERE id = ?',
-                (end_time, session_id)
-            )
+            cursor.execute('''
+                UPDATE drawing_sessions 
+                SET end_time = ?,
+                    tools_used = (SELECT group_concat(t.name, ',') 
+                                  FROM session_tool_counts c JOIN tools t ON t.id = c.tool_id
+                                  WHERE c.session_id = ?)
+                WHERE id = ?
+            ''', (end_time, session_id, session_id))
             self.conn.commit()
-            print(f"Сессия #{session_id} завершена в {end_time}")
+            trace.info("Сессия #{} завершена в {}", session_id, end_time)
         except Exception as e:
-            print(f"Ошибка завершения сессии: {e}")
+            trace.error("Ошибка завершения сессии: {}", e)
 
     def get_tools_stats(self, session_id):
         """Получает статистику по использованию инструментов"""
         try:
             cursor = self.conn.cursor()
             cursor.execute('''
-                SELECT tool_name, COUNT(*) as usage_count 
-                FROM drawing_actions 
-                WHERE session_id = ? 
-                GROUP BY tool_name
-                ORDER BY usage_count DESC
+                SELECT t.name, c.usage_count 
+                FROM session_tool_counts c
+                JOIN tools t ON t.id = c.tool_id
+                WHERE c.session_id = ? 
+                ORDER BY c.usage_count DESC
             ''', (session_id,))
             return cursor.fetchall()
         except Exception as e:
-            print(f"Ошибка получения статистики инструментов: {e}")
+            trace.error("Ошибка получения статистики инструментов: {}", e)
             return []
 
     def get_colors_stats(self, session_id):
         """Получает статистику по использованию цветов"""
         try:
             cursor = self.conn.cursor()
-            cursor.execute('''
-                SELECT color, COUNT(*) as usage_count 
-                FROM drawing_actions 
+            cursor.execute(f'''
+                SELECT {COLOR_TEXT_SQL}, usage_count 
+                FROM session_color_counts 
                 WHERE session_id = ? 
-                GROUP BY color
                 ORDER BY usage_count DESC
             ''', (session_id,))
             return cursor.fetchall()
         except Exception as e:
-            print(f"Ошибка получения статистики цветов: {e}")
+            trace.error("Ошибка получения статистики цветов: {}", e)
             return []
 
     def get_session_info(self, session_id):
@@ -163,30 +641,53 @@ class DatabaseManager:
         try:
             cursor = self.conn.cursor()
             cursor.execute('''
-                SELECT start_time, 
-                       (SELECT COUNT(*) FROM drawing_actions WHERE session_id = ?) as actions_count
-                FROM drawing_sessions 
-                WHERE id = ?
-            ''', (session_id, session_id))
+                SELECT s.start_time, COALESCE(t.actions_count, 0) as actions_count
+                FROM drawing_sessions s
+                LEFT JOIN session_totals t ON t.session_id = s.id
+                WHERE s.id = ?
+            ''', (session_id,))
             return cursor.fetchone()
         except Exception as e:
-            print(f"Ошибка получения информации о сессии: {e}")
+            trace.error("Ошибка получения информации о сессии: {}", e)
             return None
 
     def get_actions_history(self, session_id, limit=50):
         """Получает историю действий"""
         try:
             cursor = self.conn.cursor()
-            cursor.execute('''
-                SELECT timestamp, tool_name, color, brush_size
+            cursor.execute(f'''
+                SELECT {TIMESTAMP_TEXT_SQL}, t.name, {COLOR_TEXT_SQL}, brush_size
                 FROM drawing_actions 
+                JOIN tools t ON t.id = drawing_actions.tool_id
                 WHERE session_id = ?
-                ORDER BY timestamp DESC
+                ORDER BY drawing_actions.id DESC
                 LIMIT ?
             ''', (session_id, limit))
             return cursor.fetchall()
         except Exception as e:
-            print(f"Ошибка получения истории действий: {e}")
+            trace.error("Ошибка получения истории действий: {}", e)
+            return []
+
+    def get_actions_page(self, session_id, before_id=None, limit=HISTORY_PAGE_SIZE):
+        """Получает страницу истории действий от новых к старым
+
+        Страницы выбираются по ключу (id < before_id), а не через OFFSET, поэтому
+        каждая следующая страница читается по индексу так же быстро, как первая.
+        Возвращает строки (id, время, инструмент, цвет, размер).
+        """
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(f'''
+                SELECT drawing_actions.id, {TIMESTAMP_TEXT_SQL}, t.name, {COLOR_TEXT_SQL}, brush_size
+                FROM drawing_actions 
+                JOIN tools t ON t.id = drawing_actions.tool_id
+                WHERE session_id = ? AND drawing_actions.id < ?
+                ORDER BY drawing_actions.id DESC
+                LIMIT ?
+            ''', (session_id, before_id if before_id is not None else 2 ** 63 - 1, limit))
+            return cursor.fetchall()
+        except Exception as e:
+            trace.error("Ошибка получения истории действий: {}", e)
             return []
 
     def get_saved_files(self, session_id):
@@ -201,7 +702,7 @@ class DatabaseManager:
             ''', (session_id,))
             return cursor.fetchall()
         except Exception as e:
-            print(f"Ошибка получения списка файлов: {e}")
+            trace.error("Ошибка получения списка файлов: {}", e)
             return []
 
     def get_all_sessions(self):
@@ -209,90 +710,315 @@ class DatabaseManager:
         try:
             cursor = self.conn.cursor()
             cursor.execute('''
-                SELECT id, start_time, end_time,
-                       (SELECT COUNT(*) FROM drawing_actions WHERE session_id = drawing_sessions.id) as actions_count
-                FROM drawing_sessions 
-                ORDER BY start_time DESC
+                SELECT s.id, s.start_time, s.end_time, COALESCE(t.actions_count, 0) as actions_count
+                FROM drawing_sessions s
+                LEFT JOIN session_totals t ON t.session_id = s.id
+                ORDER BY s.start_time DESC
             ''')
             return cursor.fetchall()
         except Exception as e:
-            print(f"Ошибка получения списка сессий: {e}")
+            trace.error("Ошибка получения списка сессий: {}", e)
             return []
 
     def get_session_duration(self, session_id):
         """Получает продолжительность сессии"""
         try:
             cursor = self.conn.cursor()
-            cursor.execute('''
-                SELECT start_time, end_time 
+            cursor.execute(f'''
+                SELECT {DURATION_SECONDS_SQL}
                 FROM drawing_sessions 
                 WHERE id = ?
             ''', (session_id,))
             result = cursor.fetchone()
-            if result and result[1]:
-                start = datetime.datetime.fromisoformat(result[0])
-                end = datetime.datetime.fromisoformat(result[1])
-                duration = end - start
-                return str(duration).split('.')[0]
+            if result and result[0] is not None:
+                return format_duration(result[0])
             return "В процессе"
         except Exception as e:
-            print(f"Ошибка получения продолжительности сессии: {e}")
+            trace.error("Ошибка получения продолжительности сессии: {}", e)
             return "Неизвестно"
 
-    def get_most_used_tool_all_time(self):
-        """Получает самый популярный инструмент за все время"""
+    def get_sessions_overview(self, limit=None, conn=None):
+        """Получает сессии с числом действий и длительностью одним запросом
+
+        Возвращает строки (id, начало, конец, действий, секунд); у незавершенных
+        сессий длительность None.
+        """
         try:
-            cursor = self.conn.cursor()
+            cursor = (conn or self.conn).cursor()
+            cursor.execute(f'''
+                SELECT s.id, s.start_time, s.end_time,
+                       COALESCE(t.actions_count, 0) as actions_count,
+                       {DURATION_SECONDS_SQL} as duration
+                FROM drawing_sessions s
+                LEFT JOIN session_totals t ON t.session_id = s.id
+                ORDER BY s.start_time DESC
+                LIMIT ?
+            ''', (-1 if limit is None else limit,))
+            return cursor.fetchall()
+        except Exception as e:
+            trace.error("Ошибка получения обзора сессий: {}", e)
+            return []
+
+    def get_top_tools(self, limit=5, conn=None):
+        """Получает самые используемые инструменты за все время"""
+        try:
+            cursor = (conn or self.conn).cursor()
             cursor.execute('''
-                SELECT tool_name, COUNT(*) as usage_count 
-                FROM drawing_actions 
-                GROUP BY tool_name
-                ORDER BY usage_count DESC
-                LIMIT 1
-            ''')
-            return cursor.fetchone()
+                SELECT t.name, SUM(c.usage_count) as total_count 
+                FROM session_tool_counts c
+                JOIN tools t ON t.id = c.tool_id
+                GROUP BY c.tool_id
+                ORDER BY total_count DESC
+                LIMIT ?
+            ''', (limit,))
+            return cursor.fetchall()
         except Exception as e:
-            print(f"Ошибка получения самого популярного инструмента: {e}")
-            return None
+            trace.error("Ошибка получения популярных инструментов: {}", e)
+            return []
+
+    def get_daily_activity(self, days=30, conn=None):
+        """Получает активность по дням: (день, сессий, действий, секунд рисования)
+
+        Сессия относится ко дню своего начала; действия берутся из сводок.
+        """
+        try:
+            cursor = (conn or self.conn).cursor()
+            since = (datetime.datetime.now() - datetime.timedelta(days=days)).isoformat()
+            cursor.execute(f'''
+                SELECT date(s.start_time) as day,
+                       COUNT(*) as sessions_count,
+                       COALESCE(SUM(t.actions_count), 0) as actions_count,
+                       COALESCE(SUM({DURATION_SECONDS_SQL}), 0) as duration
+                FROM drawing_sessions s
+                LEFT JOIN session_totals t ON t.session_id = s.id
+                WHERE s.start_time >= ?
+                GROUP BY day
+                ORDER BY day DESC
+            ''', (since,))
+            return cursor.fetchall()
+        except Exception as e:
+            trace.error("Ошибка получения активности по дням: {}", e)
+            return []
+
+    def get_all_time_analytics(self, sessions_limit=100, tools_limit=5, days=30):
+        """Собирает статистику за все время на отдельном соединении
+
+        Метод можно вызывать из фонового потока. Возвращает словарь с итогами,
+        последними сессиями, популярными инструментами и активностью по дням.
+        """
+        conn = None
+        try:
+            conn = self.connect()
+            totals = conn.execute(f'''
+                SELECT COUNT(*),
+                       COALESCE(SUM(t.actions_count), 0),
+                       COALESCE(SUM({DURATION_SECONDS_SQL}), 0)
+                FROM drawing_sessions s
+                LEFT JOIN session_totals t ON t.session_id = s.id
+            ''').fetchone()
+            return {
+                "sessions_count": totals[0],
+                "actions_count": totals[1],
+                "duration": totals[2],
+                "sessions": self.get_sessions_overview(sessions_limit, conn),
+                "top_tools": self.get_top_tools(tools_limit, conn),
+                "daily": self.get_daily_activity(days, conn),
+            }
+        except Exception as e:
+            trace.error("Ошибка получения статистики за все время: {}", e)
+            return {}
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def get_most_used_tool_all_time(self):
+        """Получает самый популярный инструмент за все время"""
+        top_tools = self.get_top_tools(limit=1)
+        return top_tools[0] if top_tools else None
 
     def get_total_actions_count(self):
         """Получает общее количество действий за все время"""
         try:
             cursor = self.conn.cursor()
-            cursor.execute('SELECT COUNT(*) FROM drawing_actions')
+            cursor.execute('SELECT COALESCE(SUM(actions_count), 0) FROM session_totals')
             return cursor.fetchone()[0]
         except Exception as e:
-            print(f"Ошибка получения общего количества действий: {e}")
+            trace.error("Ошибка получения общего количества действий: {}", e)
             return 0
 
-    def clear_old_data(self, days=30):
-        """Очищает данные старше указанного количества дней"""
+    def clear_old_data(self, days=30, batch_size=RETENTION_BATCH_SIZE, progress=None, cancel=None):
+        """Очищает данные старше указанного количества дней и возвращает место файлу
+
+        Удаление идет короткими транзакциями по batch_size строк на отдельном
+        соединении, поэтому метод можно вызывать из фонового потока: запись
+        действий не ждет дольше одной пачки. progress(stage, done, total)
+        вызывается после каждой пачки, cancel (threading.Event) прерывает работу.
+        Возвращает словарь с числом удаленных строк и освобожденными байтами.
+        """
+        result = {"actions": 0, "files": 0, "sessions": 0, "reclaimed_bytes": 0}
+        conn = None
         try:
-            cursor = self.conn.cursor()
+            conn = self.connect()
             cutoff_date = (datetime.datetime.now() - datetime.timedelta(days=days)).isoformat()
+            params = (cutoff_date,)
+            pages_before = conn.execute('PRAGMA page_count').fetchone()[0]
             
-            cursor.execute('''
-                DELETE FROM drawing_actions 
-                WHERE session_id IN (
-                    SELECT id FROM drawing_sessions 
-                    WHERE start_time < ?
-                )
-            ''', (cutoff_date,))
-            
-            cursor.execute('''
-                DELETE FROM saved_files 
-                WHERE session_id IN (
-                    SELECT id FROM drawing_sessions 
-                    WHERE start_time < ?
-                )
-            ''', (cutoff_date,))
-            
-            cursor.execute('DELETE FROM drawing_sessions WHERE start_time < ?', (cutoff_date,))
+            # Число действий к удалению берем из сводок, не пересчитывая таблицу
+            total_actions = conn.execute('''
+                SELECT COALESCE(SUM(actions_count), 0) FROM session_totals
+                WHERE session_id IN (SELECT id FROM drawing_sessions WHERE start_time < ?)
+            ''', params).fetchone()[0]
+            stages = [
+                ("actions", total_actions, '''
+                    DELETE FROM drawing_actions WHERE id IN (
+                        SELECT id FROM drawing_actions WHERE session_id IN (
+                            SELECT id FROM drawing_sessions WHERE start_time < ?
+                        ) LIMIT ?
+                    )
+                '''),
+                ("files", None, '''
+                    DELETE FROM saved_files WHERE id IN (
+                        SELECT id FROM saved_files WHERE session_id IN (
+                            SELECT id FROM drawing_sessions WHERE start_time < ?
+                        ) LIMIT ?
+                    )
+                '''),
+                ("sessions", None, '''
+                    DELETE FROM drawing_sessions WHERE id IN (
+                        SELECT id FROM drawing_sessions WHERE start_time < ? LIMIT ?
+                    )
+                '''),
+            ]
+            for stage, total, sql in stages:
+                result[stage] = self._delete_in_batches(conn, sql, params, batch_size,
+                                                        stage, total, progress, cancel)
+                if cancel is not None and cancel.is_set():
+                    trace.warning("Очистка старых данных прервана")
+                    return result
             
-            self.conn.commit()
-            print(f"Данные старше {days} дней очищены")
+            self._reclaim_space(conn, progress, cancel)
+            pages_after = conn.execute('PRAGMA page_count').fetchone()[0]
+            page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+            result["reclaimed_bytes"] = max(0, pages_before - pages_after) * page_size
+            trace.info("Данные старше {} дней очищены: {}", days, result)
         except Exception as e:
-            print(f"Ошибка очистки старых данных: {e}")
+            trace.error("Ошибка очистки старых данных: {}", e)
+        finally:
+            if conn is not None:
+                conn.close()
+        return result
+
+    def _delete_in_batches(self, conn, sql, params, batch_size, stage, total, progress, cancel):
+        """Повторяет удаление пачками по batch_size строк, каждая пачка - своя транзакция"""
+        deleted = 0
+        while cancel is None or not cancel.is_set():
+            with conn:
+                count = conn.execute(sql, params + (batch_size,)).rowcount
+            deleted += count
+            if progress is not None:
+                progress(stage, deleted, total)
+            if count < batch_size:
+                break
+        return deleted
+
+    def _reclaim_space(self, conn, progress=None, cancel=None):
+        """Возвращает свободные страницы файлу порциями через incremental_vacuum
+
+        Файл, созданный до включения auto_vacuum, не сжимается: перевести его
+        можно только полным VACUUM, который надолго блокирует запись, поэтому
+        он выполняется лишь по явной команде (см. enable_incremental_vacuum).
+        """
+        if not self.is_incremental_vacuum(conn):
+            trace.info("Файл БД не в режиме incremental auto_vacuum, место не возвращается")
+            return
+        
+        total = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        remaining = total
+        while remaining > 0 and (cancel is None or not cancel.is_set()):
+            # fetchall нужен, чтобы прагма выполнилась целиком, а не на одну страницу
+            conn.execute(f'PRAGMA incremental_vacuum({VACUUM_SLICE_PAGES})').fetchall()
+            remaining = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if progress is not None:
+                progress("vacuum", total - remaining, total)
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def is_incremental_vacuum(self, conn=None):
+        """Включен ли для файла БД режим auto_vacuum=INCREMENTAL
+
+        Без conn режим читается на новом соединении: основное соединение не
+        замечает перевода файла, выполненного в фоне (см. start_compaction).
+        """
+        if conn is not None:
+            return conn.execute('PRAGMA auto_vacuum').fetchone()[0] == AUTO_VACUUM_INCREMENTAL
+        conn = sqlite3.connect(self.db_file)
+        try:
+            return conn.execute('PRAGMA auto_vacuum').fetchone()[0] == AUTO_VACUUM_INCREMENTAL
+        finally:
+            conn.close()
+
+    def enable_incremental_vacuum(self):
+        """Переводит файл БД в режим incremental auto_vacuum полным VACUUM
+
+        VACUUM переписывает весь файл и все это время держит блокировку записи,
+        поэтому вызывается только по явной команде пользователя и на отдельном
+        соединении (см. start_compaction). Записи фонового писателя на это
+        время откладываются и повторяются позже. Возвращает число
+        освобожденных байт.
+        """
+        self.flush()
+        size_before = self.get_database_size()
+        conn = self.connect()
+        try:
+            conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            conn.execute('VACUUM')
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        finally:
+            conn.close()
+        reclaimed = max(0, size_before - self.get_database_size())
+        trace.info("Файл БД переведен в режим incremental auto_vacuum, освобождено {} байт", reclaimed)
+        return reclaimed
+
+    def start_retention(self, days=30, progress=None, finished=None):
+        """Запускает clear_old_data в фоновом потоке
+
+        finished(result) вызывается из фонового потока по завершении.
+        Возвращает (поток, событие отмены).
+        """
+        cancel = threading.Event()
+
+        def run():
+            result = self.clear_old_data(days, progress=progress, cancel=cancel)
+            if finished is not None:
+                finished(result)
+
+        thread = threading.Thread(target=run, name="db-retention", daemon=True)
+        thread.start()
+        return thread, cancel
+
+    def start_compaction(self, progress=None, finished=None):
+        """Запускает enable_incremental_vacuum в фоновом потоке
+
+        progress("compact", 0, None) вызывается перед VACUUM, finished(result) -
+        из фонового потока по завершении: число освобожденных байт или текст
+        ошибки. VACUUM не прерывается, событие отмены возвращается для
+        единообразия с start_retention. Возвращает (поток, событие отмены).
+        """
+        cancel = threading.Event()
+
+        def run():
+            if progress is not None:
+                progress("compact", 0, None)
+            try:
+                result = self.enable_incremental_vacuum()
+            except Exception as e:
+                trace.error("Ошибка сжатия файла истории: {}", e)
+                result = str(e)
+            if finished is not None:
+                finished(result)
+
+        thread = threading.Thread(target=run, name="db-compaction", daemon=True)
+        thread.start()
+        return thread, cancel
 
     def get_database_size(self):
         """Получает размер файла базы данных"""
@@ -301,13 +1027,18 @@ class DatabaseManager:
                 return os.path.getsize(self.db_file)
             return 0
         except Exception as e:
-            print(f"Ошибка получения размера БД: {e}")
+            trace.error("Ошибка получения размера БД: {}", e)
             return 0
 
     def close(self):
         """Закрывает соединение с БД"""
         try:
+            # Все действия из очереди записываются до закрытия
+            if self.writer_thread is not None and self.writer_thread.is_alive():
+                self.write_queue.put(None)
+                self.writer_thread.join()
             self.conn.close()
-            print("Соединение с БД закрыто")
+            self.closed = True
+            trace.info("Соединение с БД закрыто")
         except Exception as e:
-            print(f"Ошибка закрытия БД: {e}")
\ No newline at end of file
+            trace.error("Ошибка закрытия БД: {}", e)
\ No newline at end of file
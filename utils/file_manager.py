@@ -1,60 +1,128 @@
 from PyQt6.QtWidgets import QFileDialog, QMessageBox
-from PyQt6.QtGui import QImage
+from PyQt6.QtGui import QImage, QImageReader
+from PyQt6.QtCore import QObject, QRunnable, QSize, QThreadPool, pyqtSignal
+from models.tiled_image import TiledImage
+from utils import trace
+from utils.project_file import PROJECT_FORMAT, ProjectReader, is_project_file, save_project
+import itertools
 import os
 
+# Источник номеров задач фонового сохранения
+_save_tokens = itertools.count(1)
+
+
+class ImageSaveSignals(QObject):
+    """Сигналы фонового сохранения (испускаются из потока пула)"""
+    # Номер задачи, имя файла, формат, успех, размер файла в байтах
+    finished = pyqtSignal(int, str, str, bool, int)
+
+
+class ImageSaveTask(QRunnable):
+    """Сборка и кодирование изображения в файл в потоке QThreadPool
+
+    image - QImage или снимок TiledImage (см. TiledImage.snapshot), поэтому
+    изменения холста во время сохранения в файл не попадают. Проект .spaint
+    записывается из тайлов снимка без сборки сплошного изображения.
+    """
+
+    def __init__(self, image, filename, format_name):
+        super().__init__()
+        self.image = image
+        self.filename = filename
+        self.format_name = format_name
+        # Номер отличает задачу от других сохранений того же файла
+        self.token = next(_save_tokens)
+        self.signals = ImageSaveSignals()
+
+    def run(self):
+        success = False
+        file_size = 0
+        try:
+            success, file_size = FileManager.write_image(self.image, self.filename, self.format_name)
+        except Exception as e:
+            trace.error("Ошибка при сохранении {}: {}", self.filename, e)
+        self.image = None
+        self.signals.finished.emit(self.token, self.filename, self.format_name, success, file_size)
+
+
 class FileManager:
     @staticmethod
-    def save_image(image, parent_window, session_id=None, db_manager=None):
-        """Сохраняет изображение в файл"""
+    def format_for_filename(filename):
+        """Определяет формат изображения по расширению файла"""
+        if is_project_file(filename):
+            return PROJECT_FORMAT
+        if filename.lower().endswith('.jpg') or filename.lower().endswith('.jpeg'):
+            return "JPEG"
+        elif filename.lower().endswith('.bmp'):
+            return "BMP"
+        return "PNG"
+
+    @staticmethod
+    def write_image(image, filename, format_name):
+        """Записывает QImage или TiledImage в файл в текущем потоке; возвращает (успех, размер)"""
+        if format_name == PROJECT_FORMAT:
+            if isinstance(image, QImage):
+                image = TiledImage.from_qimage(image)
+            save_project(image, filename)
+            success = True
+        else:
+            if not isinstance(image, QImage):
+                image = image.to_qimage()
+            success = image.save(filename, format_name)
+        return success, os.path.getsize(filename) if success else 0
+
+    @staticmethod
+    def start_save(image, filename, format_name):
+        """Запускает фоновое сохранение; итог придет сигналом task.signals.finished"""
+        task = ImageSaveTask(image, filename, format_name)
+        QThreadPool.globalInstance().start(task)
+        return task
+
+    @staticmethod
+    def save_image(image, parent_window):
+        """Спрашивает имя файла и запускает фоновое сохранение изображения
+        
+        Возвращает запущенную задачу ImageSaveTask или None, если сохранение отменено.
+        """
         try:
             filename, selected_filter = QFileDialog.getSaveFileName(
                 parent_window,
                 "Сохранить изображение",
                 "my_drawing.png",
-                "PNG Files (*.png);;JPEG Files (*.jpg *.jpeg);;BMP Files (*.bmp);;All Files (*)"
+                "PNG Files (*.png);;JPEG Files (*.jpg *.jpeg);;BMP Files (*.bmp);;"
+                "SimplePaint Project (*.spaint);;All Files (*)"
             )
             
             if filename:
-                # Определяем формат по расширению
-                format_name = "PNG"
-                if filename.lower().endswith('.jpg') or filename.lower().endswith('.jpeg'):
-                    format_name = "JPEG"
-                elif filename.lower().endswith('.bmp'):
-                    format_name = "BMP"
-                
-                success = image.save(filename, format_name)
-                if success:
-                    # Логируем сохранение в БД
-                    if session_id and db_manager:
-                        file_size = os.path.getsize(filename) if os.path.exists(filename) else 0
-                        db_manager.log_file_save(session_id, filename, format_name, file_size)
-                    
-                    QMessageBox.information(parent_window, "Успех", f"Изображение сохранено как {format_name}!")
-                    return True
-                else:
-                    QMessageBox.warning(parent_window, "Ошибка", "Не удалось сохранить изображение")
-                    return False
-            return False
+                return FileManager.start_save(image, filename, FileManager.format_for_filename(filename))
+            return None
         except Exception as e:
             QMessageBox.critical(parent_window, "Ошибка", f"Ошибка при сохранении: {str(e)}")
-            return False
+            return None
 
     @staticmethod
-    def load_image(parent_window):
-        """Загружает изображение из файла"""
+    def choose_image_file(parent_window):
+        """Спрашивает файл изображения; возвращает (имя файла, размер) или None
+        
+        Размер читается из заголовка файла без декодирования пикселей.
+        """
         try:
             filename, _ = QFileDialog.getOpenFileName(
                 parent_window,
                 "Открыть изображение",
                 "",
-                "Images (*.png *.jpg *.jpeg *.bmp *.gif);;All Files (*)"
+                "Images (*.png *.jpg *.jpeg *.bmp *.gif *.spaint);;"
+                "SimplePaint Project (*.spaint);;All Files (*)"
             )
             
+            if filename and is_project_file(filename):
+                with ProjectReader(filename) as reader:
+                    return filename, QSize(reader.width, reader.height)
             if filename:
-                image = QImage(filename)
-                if not image.isNull():
-                    QMessageBox.information(parent_window, "Успех", "Изображение загружено!")
-                    return image
+                reader = QImageReader(filename)
+                size = reader.size()
+                if reader.canRead() and size.isValid():
+                    return filename, size
                 else:
                     QMessageBox.warning(parent_window, "Ошибка", "Не удалось загрузить изображение или формат не поддерживается")
                     return None
@@ -65,7 +133,7 @@ class FileManager:
 
     @staticmethod
     def export_to_png(image, parent_window):
-        """Экспорт в PNG с настройками"""
+        """Экспорт в PNG с настройками (в фоне, как save_image)"""
         try:
             filename, _ = QFileDialog.getSaveFileName(
                 parent_window,
@@ -75,13 +143,8 @@ class FileManager:
             )
             
             if filename:
-                success = image.save(filename, "PNG")
-                if success:
-                    return True
-                else:
-                    QMessageBox.warning(parent_window, "Ошибка", "Не удалось экспортировать изображение")
-                    return False
-            return False
+                return FileManager.start_save(image, filename, "PNG")
+            return None
         except Exception as e:
             QMessageBox.critical(parent_window, "Ошибка", f"Ошибка при экспорте: {str(e)}")
-            return False
\ No newline at end of file
+            return None
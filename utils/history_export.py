@@ -0,0 +1,124 @@
+import csv
+import gzip
+import json
+import os
+import time
+
+from utils import trace
+from utils.database import COLOR_TEXT_SQL, TIMESTAMP_TEXT_SQL
+
+# Сколько строк читается из БД за один fetchmany
+EXPORT_FETCH_SIZE = 1000
+
+EXPORT_FORMATS = ("csv", "jsonl")
+
+# Разделы выгрузки: (тип записи, столбцы, запрос)
+EXPORT_SECTIONS = [
+    ("session", ["id", "start_time", "end_time", "actions_count"], '''
+        SELECT s.id, s.start_time, s.end_time, COALESCE(t.actions_count, 0)
+        FROM drawing_sessions s
+        LEFT JOIN session_totals t ON t.session_id = s.id
+        ORDER BY s.id
+    '''),
+    ("action", ["id", "session_id", "timestamp", "tool", "color", "brush_size"], f'''
+        SELECT drawing_actions.id, session_id, {TIMESTAMP_TEXT_SQL}, t.name,
+               {COLOR_TEXT_SQL}, brush_size
+        FROM drawing_actions
+        JOIN tools t ON t.id = drawing_actions.tool_id
+        ORDER BY drawing_actions.id
+    '''),
+    ("file", ["id", "session_id", "filename", "file_format", "save_time", "file_size"], '''
+        SELECT id, session_id, filename, file_format, save_time, file_size
+        FROM saved_files
+        ORDER BY id
+    '''),
+]
+
+
+def iter_rows(cursor, size=EXPORT_FETCH_SIZE):
+    """Выдает строки результата запроса порциями fetchmany, не загружая его целиком"""
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield from rows
+
+
+def detect_format(path):
+    """Определяет формат и сжатие по расширению: .csv, .jsonl, с .gz или без"""
+    name = path.lower()
+    compress = name.endswith(".gz")
+    if compress:
+        name = name[:-3]
+    export_format = "jsonl" if name.endswith((".jsonl", ".json")) else "csv"
+    return export_format, compress
+
+
+class _CountingWriter:
+    """Обертка текстового файла, считающая записанные байты в UTF-8"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.written = 0
+
+    def write(self, text):
+        self.written += len(text.encode("utf-8"))
+        return self.stream.write(text)
+
+
+def export_history(db_manager, path, export_format=None, compress=None, progress=None):
+    """Выгружает сессии, действия и сохраненные файлы в CSV или JSON Lines
+
+    Строки читаются потоком на отдельном соединении, поэтому память не растет
+    с размером истории, а функцию можно вызывать из фонового потока. В CSV
+    каждая строка начинается с типа записи, перед каждым разделом идет строка
+    заголовков. progress(rows) вызывается после каждой порции строк.
+    Возвращает словарь с числом строк, байтами и скоростью выгрузки.
+    """
+    detected_format, detected_compress = detect_format(path)
+    export_format = export_format or detected_format
+    compress = detected_compress if compress is None else compress
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {export_format}")
+
+    started = time.perf_counter()
+    rows_count = 0
+    conn = db_manager.connect()
+    try:
+        if compress:
+            stream = gzip.open(path, "wt", encoding="utf-8", newline="")
+        else:
+            stream = open(path, "w", encoding="utf-8", newline="")
+        with stream:
+            output = _CountingWriter(stream)
+            csv_writer = csv.writer(output) if export_format == "csv" else None
+            for record_type, columns, sql in EXPORT_SECTIONS:
+                if csv_writer is not None:
+                    csv_writer.writerow(["type"] + columns)
+                cursor = conn.execute(sql)
+                for row in iter_rows(cursor):
+                    if csv_writer is not None:
+                        csv_writer.writerow((record_type,) + row)
+                    else:
+                        record = {"type": record_type}
+                        record.update(zip(columns, row))
+                        output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    rows_count += 1
+                    if progress is not None and rows_count % EXPORT_FETCH_SIZE == 0:
+                        progress(rows_count)
+            text_size = output.written
+    finally:
+        conn.close()
+
+    seconds = time.perf_counter() - started
+    result = {
+        "path": path,
+        "rows": rows_count,
+        "text_bytes": text_size,
+        "file_bytes": os.path.getsize(path),
+        "seconds": seconds,
+        "rows_per_second": rows_count / seconds if seconds > 0 else 0.0,
+    }
+    trace.info("История выгружена в {}: {} строк, {} байт за {:.2f} с ({:.0f} строк/с)",
+               path, rows_count, result["file_bytes"], seconds, result["rows_per_second"])
+    return result
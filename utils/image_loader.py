@@ -0,0 +1,122 @@
+from PyQt6.QtGui import QImage, QImageReader, QImageIOHandler
+from PyQt6.QtCore import QObject, QRunnable, QRect, QSize, Qt, pyqtSignal
+from models.tiled_image import TILE_SIZE
+from utils import trace
+
+# Во сколько раз по стороне превью меньше итогового изображения
+PREVIEW_SCALE = 4
+
+# Высота полосы, которую фоновая загрузка декодирует за один шаг
+LOAD_BAND_HEIGHT = TILE_SIZE
+
+# Предел памяти под одно декодирование (МБ). PNG, BMP и другие форматы без
+# уменьшения при чтении декодируются целиком в исходном разрешении, поэтому
+# файлы больше предела (около 64 Мпикс) не открываются.
+LOAD_ALLOCATION_LIMIT_MB = 256
+
+
+def fit_size(source_size, bounds):
+    """Размер изображения, вписанного в bounds с сохранением пропорций"""
+    return source_size.scaled(bounds, Qt.AspectRatioMode.KeepAspectRatio)
+
+
+def supports_region_decoding(reader):
+    """Умеет ли декодер сразу уменьшать изображение и читать его полосами (например, JPEG)"""
+    return (reader.supportsOption(QImageIOHandler.ImageOption.ScaledSize) and
+            reader.supportsOption(QImageIOHandler.ImageOption.ScaledClipRect))
+
+
+def read_scaled(filename, size, clip_rect=None):
+    """Декодирует файл сразу в размер size, при clip_rect - только эту область результата"""
+    reader = QImageReader(filename)
+    reader.setAllocationLimit(LOAD_ALLOCATION_LIMIT_MB)
+    reader.setScaledSize(size)
+    if clip_rect is not None:
+        reader.setScaledClipRect(clip_rect)
+    image = reader.read()
+    if image.isNull():
+        trace.warning("Не удалось прочитать {}: {}", filename, reader.errorString())
+    return image
+
+
+def full_decode_error(filename):
+    """Текст ошибки, если файл нельзя уменьшить при чтении и целиком он не помещается в предел"""
+    reader = QImageReader(filename)
+    if supports_region_decoding(reader):
+        return None
+    size = reader.size()
+    required_mb = size.width() * size.height() * 4 / (1024 * 1024)
+    if required_mb <= LOAD_ALLOCATION_LIMIT_MB:
+        return None
+    return (f"Изображение {size.width()}x{size.height()} в этом формате декодируется только "
+            f"целиком (около {required_mb:.0f} МБ), это больше предела {LOAD_ALLOCATION_LIMIT_MB} МБ. "
+            f"Преобразуйте его в JPEG, чтобы открыть с уменьшением.")
+
+
+def read_preview(filename, target_size):
+    """Быстрое уменьшенное превью или None, если декодер не умеет уменьшать при чтении"""
+    if not supports_region_decoding(QImageReader(filename)):
+        return None
+    preview_size = QSize(max(1, target_size.width() // PREVIEW_SCALE),
+                         max(1, target_size.height() // PREVIEW_SCALE))
+    preview = read_scaled(filename, preview_size)
+    return None if preview.isNull() else preview
+
+
+class ImageLoadSignals(QObject):
+    """Сигналы фоновой загрузки (испускаются из потока пула)"""
+    # Номер загрузки, верхняя координата полосы, полоса изображения
+    band_loaded = pyqtSignal(int, int, QImage)
+    # Номер загрузки, успех
+    finished = pyqtSignal(int, bool)
+
+
+class ImageLoadTask(QRunnable):
+    """Декодирует изображение в итоговом размере полосами в потоке QThreadPool
+
+    Декодеры с поддержкой ScaledClipRect (JPEG) читают только нужную полосу
+    уже уменьшенной, поэтому память ограничена размером полосы. Остальные
+    форматы (PNG, BMP) декодируются один раз в исходном разрешении и затем
+    уменьшаются, поэтому ограничены пределом LOAD_ALLOCATION_LIMIT_MB; при
+    превышении загрузка завершается неудачей с текстом в error.
+    """
+
+    def __init__(self, token, filename, target_size):
+        super().__init__()
+        self.token = token
+        self.filename = filename
+        self.target_size = target_size
+        self.cancelled = False
+        self.error = None
+        self.signals = ImageLoadSignals()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        success = False
+        try:
+            width, height = self.target_size.width(), self.target_size.height()
+            if supports_region_decoding(QImageReader(self.filename)):
+                for y in range(0, height, LOAD_BAND_HEIGHT):
+                    if self.cancelled:
+                        return
+                    band_rect = QRect(0, y, width, min(LOAD_BAND_HEIGHT, height - y))
+                    band = read_scaled(self.filename, self.target_size, band_rect)
+                    if band.isNull():
+                        return
+                    self.signals.band_loaded.emit(self.token, y, band)
+            else:
+                self.error = full_decode_error(self.filename)
+                if self.error is not None:
+                    trace.warning("{}: {}", self.filename, self.error)
+                    return
+                image = read_scaled(self.filename, self.target_size)
+                if image.isNull():
+                    return
+                self.signals.band_loaded.emit(self.token, 0, image)
+            success = True
+        except Exception as e:
+            trace.error("Ошибка загрузки изображения {}: {}", self.filename, e)
+        finally:
+            self.signals.finished.emit(self.token, success and not self.cancelled)
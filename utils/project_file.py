@@ -0,0 +1,327 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from PyQt6.QtGui import QImage
+from PyQt6.QtCore import QRect
+from models.tiled_image import TiledImage
+from utils import trace
+
+PROJECT_EXTENSION = ".spaint"
+# Имя формата в FileManager и в журнале сохраненных файлов
+PROJECT_FORMAT = "SPAINT"
+PROJECT_MAGIC = b"SPAINT\x00\x01"
+PROJECT_VERSION = 1
+
+# Заголовок: сигнатура, версия, размер тайла, ширина, высота, число слоев,
+# смещение и длина индекса, номер записи заголовка; за ним CRC32 этих полей.
+# В начале файла два слота по HEADER_SIZE байт, сохранения пишут их по очереди.
+HEADER_STRUCT = struct.Struct("<8sHHIIH2xQQQ")
+HEADER_CRC_STRUCT = struct.Struct("<I")
+HEADER_SIZE = 64
+HEADER_SLOTS = 2
+DATA_OFFSET = HEADER_SIZE * HEADER_SLOTS
+
+# Уровень сжатия тайлов zlib
+TILE_COMPRESSION_LEVEL = 1
+
+# Доля устаревших данных в файле, после которой сохранение переписывает его целиком
+COMPACT_GARBAGE_RATIO = 0.5
+
+
+class ProjectLayer:
+    """Слой проекта: тайловое изображение с именем, видимостью и прозрачностью"""
+
+    def __init__(self, image, name="Фон", visible=True, opacity=1.0):
+        self.image = image
+        self.name = name
+        self.visible = visible
+        self.opacity = opacity
+
+
+def encode_tile(tile):
+    """Сжимает пиксели тайла в формате ARGB32"""
+    if tile.format() not in (QImage.Format.Format_RGB32, QImage.Format.Format_ARGB32):
+        tile = tile.convertToFormat(QImage.Format.Format_ARGB32)
+    pointer = tile.constBits()
+    pointer.setsize(tile.sizeInBytes())
+    return zlib.compress(pointer.asstring(), TILE_COMPRESSION_LEVEL)
+
+
+def decode_tile(data, tile_size, image_format=QImage.Format.Format_ARGB32):
+    """Восстанавливает тайл из сжатых данных"""
+    raw = zlib.decompress(data)
+    # copy() отвязывает изображение от временного буфера raw
+    return QImage(raw, tile_size, tile_size, tile_size * 4, image_format).copy()
+
+
+def is_project_file(path):
+    return path.lower().endswith(PROJECT_EXTENSION)
+
+
+class ProjectFile:
+    """Файл проекта .spaint с инкрементальным сохранением
+
+    Файл состоит из заголовка, сжатых тайлов и индекса (сжатый JSON со
+    слоями и положением тайлов). При повторном сохранении того же документа
+    в конец файла дописываются только тайлы, измененные с прошлого
+    сохранения, и новый индекс. Затем заголовок со следующим номером
+    пишется в слот, не занятый действующим заголовком. Читатель берет слот
+    с наибольшим номером и верной CRC32, поэтому прерванная запись
+    заголовка оставляет действующим прежний.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Забывает состояние: следующее сохранение перепишет файл целиком"""
+        self.layers = None
+        self.document_ids = None
+        self.saved_generations = None
+        self.tile_size = None
+        self.file_stamp = None
+        self.index_length = 0
+        self.header_generation = 0
+        self.garbage = 0
+
+    def file_stamp_now(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def can_save_incrementally(self, layers):
+        """Файл записан нами из тех же документов и с тех пор не менялся"""
+        if self.layers is None or len(layers) != len(self.layers):
+            return False
+        if self.file_stamp is None or self.file_stamp != self.file_stamp_now():
+            return False
+        if self.garbage > COMPACT_GARBAGE_RATIO * self.file_stamp[0]:
+            return False
+        return all(layer.image.document_id == document_id and
+                   layer.image.tile_size == self.tile_size
+                   for layer, document_id in zip(layers, self.document_ids))
+
+    def save(self, layers):
+        """Сохраняет слои; возвращает число записанных тайлов"""
+        if isinstance(layers, TiledImage):
+            layers = [ProjectLayer(layers)]
+        with self.lock:
+            if self.can_save_incrementally(layers):
+                return self.save_incremental(layers)
+            return self.save_full(layers)
+
+    def layer_entries(self, layers):
+        return [{"name": layer.name, "visible": layer.visible, "opacity": layer.opacity,
+                 "tiles": {}} for layer in layers]
+
+    def write_index(self, f, layers, entries):
+        """Дописывает индекс в текущую позицию файла; возвращает (смещение, длина)"""
+        index = {"layers": [dict(entry, tiles=[[key[0], key[1], offset, length]
+                                               for key, (offset, length) in entry["tiles"].items()])
+                            for entry in entries]}
+        data = zlib.compress(json.dumps(index).encode("utf-8"))
+        offset = f.tell()
+        f.write(data)
+        return offset, len(data)
+
+    def write_header(self, f, layers, index_offset, index_length, generation):
+        """Пишет заголовок с номером generation в слот generation % HEADER_SLOTS"""
+        image = layers[0].image
+        header = HEADER_STRUCT.pack(PROJECT_MAGIC, PROJECT_VERSION, image.tile_size,
+                                    image.width(), image.height(), len(layers),
+                                    index_offset, index_length, generation)
+        header += HEADER_CRC_STRUCT.pack(zlib.crc32(header))
+        f.seek((generation % HEADER_SLOTS) * HEADER_SIZE)
+        f.write(header.ljust(HEADER_SIZE, b"\x00"))
+
+    def save_full(self, layers):
+        """Записывает проект целиком во временный файл и заменяет им прежний"""
+        temp_path = self.path + ".tmp"
+        entries = self.layer_entries(layers)
+        written = 0
+        with open(temp_path, "wb") as f:
+            f.write(b"\x00" * DATA_OFFSET)
+            for layer, entry in zip(layers, entries):
+                for key, tile in layer.image.tiles.items():
+                    data = encode_tile(tile)
+                    entry["tiles"][key] = (f.tell(), len(data))
+                    f.write(data)
+                    written += 1
+            index_offset, index_length = self.write_index(f, layers, entries)
+            self.write_header(f, layers, index_offset, index_length, 1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+        self.remember(layers, entries, 0, index_length, 1)
+        trace.info("Проект {} сохранен целиком: {} тайлов", self.path, written)
+        return written
+
+    def save_incremental(self, layers):
+        """Дописывает измененные тайлы и новый индекс, затем обновляет заголовок"""
+        entries = [dict(entry, tiles=dict(entry["tiles"])) for entry in self.layers]
+        garbage = self.garbage
+        written = 0
+        with open(self.path, "r+b") as f:
+            f.seek(0, os.SEEK_END)
+            for layer, entry, generation in zip(layers, entries, self.saved_generations):
+                entry.update(name=layer.name, visible=layer.visible, opacity=layer.opacity)
+                for key in layer.image.changed_since(generation):
+                    old = entry["tiles"].pop(key, None)
+                    if old is not None:
+                        garbage += old[1]
+                    tile = layer.image.tiles.get(key)
+                    if tile is None:
+                        continue
+                    data = encode_tile(tile)
+                    entry["tiles"][key] = (f.tell(), len(data))
+                    f.write(data)
+                    written += 1
+            garbage += self.index_length
+            index_offset, index_length = self.write_index(f, layers, entries)
+            # Заголовок переписывается только после того, как данные на диске
+            f.flush()
+            os.fsync(f.fileno())
+            generation = self.header_generation + 1
+            self.write_header(f, layers, index_offset, index_length, generation)
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.remember(layers, entries, garbage, index_length, generation)
+        trace.info("Проект {} сохранен инкрементально: {} тайлов", self.path, written)
+        return written
+
+    def remember(self, layers, entries, garbage, index_length, header_generation):
+        """Запоминает состояние записанного файла для следующего сохранения"""
+        self.layers = entries
+        self.document_ids = [layer.image.document_id for layer in layers]
+        self.saved_generations = [layer.image.generation for layer in layers]
+        self.tile_size = layers[0].image.tile_size
+        self.garbage = garbage
+        self.index_length = index_length
+        self.header_generation = header_generation
+        self.file_stamp = self.file_stamp_now()
+
+
+class ProjectReader:
+    """Чтение проекта .spaint через отображение файла в память
+
+    Тайлы распаковываются по запросу прямо из отображенного файла, без
+    чтения его целиком.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            header = self.read_header()
+            if header is None:
+                raise ValueError(f"{path} не является проектом SimplePaint или поврежден")
+            (magic, version, self.tile_size, self.width, self.height, layer_count,
+             index_offset, index_length, self.generation) = header
+            index = json.loads(zlib.decompress(self.map[index_offset:index_offset + index_length]))
+            self.layers = index["layers"]
+        except Exception:
+            self.close()
+            raise
+
+    def read_header(self):
+        """Действующий заголовок: слот с верной CRC32 и наибольшим номером"""
+        best = None
+        for slot in range(HEADER_SLOTS):
+            start = slot * HEADER_SIZE
+            if start + HEADER_STRUCT.size + HEADER_CRC_STRUCT.size > len(self.map):
+                break
+            data = self.map[start:start + HEADER_STRUCT.size]
+            (crc,) = HEADER_CRC_STRUCT.unpack_from(self.map, start + HEADER_STRUCT.size)
+            if zlib.crc32(data) != crc:
+                continue
+            header = HEADER_STRUCT.unpack(data)
+            if header[0] != PROJECT_MAGIC or header[1] > PROJECT_VERSION:
+                continue
+            if best is None or header[-1] > best[-1]:
+                best = header
+        return best
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if getattr(self, "map", None) is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+    def read_tile(self, offset, length, image_format=QImage.Format.Format_ARGB32):
+        return decode_tile(self.map[offset:offset + length], self.tile_size, image_format)
+
+    def read_layer(self, layer_index):
+        """Слой как TiledImage (тайлы в формате ARGB32)"""
+        image = TiledImage(self.width, self.height, self.tile_size)
+        for tile_x, tile_y, offset, length in self.layers[layer_index]["tiles"]:
+            image.tiles[(tile_x, tile_y)] = self.read_tile(offset, length)
+        return image
+
+    def flatten(self):
+        """Сводит видимые слои на белом фоне в одно TiledImage"""
+        layers = [layer for layer in self.layers if layer["visible"]]
+        if len(layers) == 1 and layers[0]["opacity"] >= 1.0:
+            # Один непрозрачный слой: тайлы используются как есть
+            image = TiledImage(self.width, self.height, self.tile_size)
+            for tile_x, tile_y, offset, length in layers[0]["tiles"]:
+                image.set_tile((tile_x, tile_y),
+                               self.read_tile(offset, length, QImage.Format.Format_RGB32))
+            return image
+
+        image = TiledImage(self.width, self.height, self.tile_size)
+        for layer in layers:
+            for tile_x, tile_y, offset, length in layer["tiles"]:
+                tile = self.read_tile(offset, length)
+                rect = QRect(tile_x * self.tile_size, tile_y * self.tile_size,
+                             self.tile_size, self.tile_size)
+
+                def draw(painter, tile=tile, rect=rect, opacity=layer["opacity"]):
+                    painter.setOpacity(opacity)
+                    painter.drawImage(rect.topLeft(), tile)
+
+                image.paint(rect, draw)
+        return image
+
+
+# Состояние сохраненных проектов по пути файла (для инкрементальных сохранений)
+_projects = {}
+_projects_lock = threading.Lock()
+
+
+def get_project(path):
+    """ProjectFile для пути; один объект на файл в пределах процесса"""
+    path = os.path.abspath(path)
+    with _projects_lock:
+        project = _projects.get(path)
+        if project is None:
+            project = ProjectFile(path)
+            _projects[path] = project
+        return project
+
+
+def save_project(image, path):
+    """Сохраняет TiledImage (или список ProjectLayer) в проект; возвращает число записанных тайлов"""
+    return get_project(path).save(image)
+
+
+def load_project(path):
+    """Загружает проект и возвращает сведенное изображение TiledImage"""
+    with ProjectReader(path) as reader:
+        return reader.flatten()
@@ -1,8 +1,14 @@
 import json
 import os
 
+from PyQt6.QtCore import QTimer
+from utils import trace
+
+# Пауза без изменений, после которой настройки записываются на диск (сек)
+SETTINGS_SAVE_DELAY = 1.0
+
 class SettingsManager:
-    def __init__(self):
+    def __init__(self, save_delay=SETTINGS_SAVE_DELAY):
         self.data_dir = "data"
         self.settings_file = os.path.join(self.data_dir, "app_settings.json")
         self.default_settings = {
@@ -10,6 +16,11 @@ class SettingsManager:
             "last_color": [0, 0, 0],
             "brush_size": 5,
             "last_tool": "brush",
+            "fill_tolerance": 0,
+            "fill_mode": "contiguous",
+            "undo_memory_mb": 64,
+            "history_retention_days": 30,
+            "autosave_interval": 30,
             "recent_files": []
         }
         
@@ -17,50 +28,86 @@ class SettingsManager:
         os.makedirs(self.data_dir, exist_ok=True)
         
         self.settings = self.load_settings()
+        
+        # Отложенная запись: изменения копятся в памяти и пишутся после паузы
+        # (save_delay=0 - запись сразу при каждом изменении). Один однократный
+        # таймер перезапускается при каждом изменении и срабатывает в потоке
+        # интерфейса, поэтому запись по таймеру и flush не пересекаются
+        self.save_delay = save_delay
+        self.dirty = False
+        self.save_timer = QTimer()
+        self.save_timer.setSingleShot(True)
+        self.save_timer.timeout.connect(self.flush)
 
     def load_settings(self):
         """Загружает настройки из файла"""
         try:
             if os.path.exists(self.settings_file):
-                print(f"Найден файл настроек: {self.settings_file}")
+                trace.info("Найден файл настроек: {}", self.settings_file)
                 with open(self.settings_file, 'r', encoding='utf-8') as f:
                     settings = json.load(f)
-                    print("Настройки загружены:", settings)
+                    trace.info("Настройки загружены: {} параметров", len(settings))
                     return settings
             else:
-                print("Файл настроек не найден, используются настройки по умолчанию")
+                trace.info("Файл настроек не найден, используются настройки по умолчанию")
                 return self.default_settings.copy()
         except Exception as e:
-            print(f"Ошибка загрузки настроек: {e}")
+            trace.error("Ошибка загрузки настроек: {}", e)
             return self.default_settings.copy()
 
     def save_settings(self):
-        """Сохраняет настройки в файл"""
+        """Сохраняет настройки в файл
+        
+        Запись идет во временный файл, который затем атомарно заменяет
+        основной, поэтому прерванная запись не портит настройки.
+        """
+        temp_file = self.settings_file + ".tmp"
         try:
-            with open(self.settings_file, 'w', encoding='utf-8') as f:
-                json.dump(self.settings, f, ensure_ascii=False, indent=2)
-            print("Настройки сохранены:", self.settings)
+            data = json.dumps(self.settings, ensure_ascii=False, indent=2)
+            self.dirty = False
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_file, self.settings_file)
+            trace.info("Настройки сохранены в {}", self.settings_file)
             return True
         except Exception as e:
-            print(f"Ошибка сохранения настроек: {e}")
+            self.dirty = True
+            trace.error("Ошибка сохранения настроек: {}", e)
             return False
 
+    def schedule_save(self):
+        """Откладывает запись до паузы в изменениях"""
+        if self.save_delay <= 0:
+            self.save_settings()
+            return
+        self.dirty = True
+        self.save_timer.start(int(self.save_delay * 1000))
+
+    def flush(self):
+        """Немедленно записывает отложенные изменения"""
+        self.save_timer.stop()
+        if self.dirty:
+            return self.save_settings()
+        return True
+
     def get_setting(self, key):
         """Получает значение настройки"""
         value = self.settings.get(key, self.default_settings.get(key))
-        print(f"Получена настройка {key}: {value}")
+        trace.debug("Получена настройка {}: {}", key, value)
         return value
 
     def set_setting(self, key, value):
-        """Устанавливает значение настройки"""
-        print(f"Установка настройки {key}: {value}")
+        """Устанавливает значение настройки (запись на диск отложена)"""
+        if key in self.settings and self.settings[key] == value:
+            return
         self.settings[key] = value
-        self.save_settings()
+        self.schedule_save()
 
     def add_recent_file(self, filepath):
         """Добавляет файл в список недавних"""
-        if filepath in self.settings["recent_files"]:
-            self.settings["recent_files"].remove(filepath)
-        self.settings["recent_files"].insert(0, filepath)
-        self.settings["recent_files"] = self.settings["recent_files"][:5]
-        self.save_settings()
\ No newline at end of file
+        recent_files = [path for path in self.settings.get("recent_files", [])
+                        if path != filepath]
+        self.settings["recent_files"] = [filepath] + recent_files[:4]
+        self.schedule_save()
\ No newline at end of file
@@ -0,0 +1,124 @@
+import collections
+import datetime
+import os
+import sys
+import threading
+import time
+
+# Уровни событий (совпадают по значениям с модулем logging)
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+
+# Сколько последних событий хранится в памяти
+TRACE_BUFFER_SIZE = 4096
+
+# Переменная окружения с уровнем записи (debug, info, warning, error)
+TRACE_LEVEL_ENV = "SIMPLEPAINT_TRACE"
+
+
+class Tracer:
+    """Журнал диагностики в кольцевом буфере фиксированного размера
+
+    Событие хранится как (время, уровень, поток, шаблон, аргументы) и
+    форматируется только при выгрузке, поэтому запись стоит одной проверки
+    уровня и добавления в deque, а при отключенном уровне - только проверки.
+    События уровня echo_level и выше дополнительно выводятся в stderr.
+    """
+
+    def __init__(self, capacity=TRACE_BUFFER_SIZE, level=INFO, echo_level=ERROR):
+        self.events = collections.deque(maxlen=capacity)
+        self.level = level
+        self.echo_level = echo_level
+
+    def set_level(self, level):
+        self.level = level
+
+    def enabled(self, level):
+        return level >= self.level
+
+    def trace(self, level, message, *args):
+        """Добавляет событие; message - шаблон str.format для args"""
+        if level < self.level:
+            return
+        event = (time.time(), level, threading.current_thread().name, message, args)
+        self.events.append(event)
+        if level >= self.echo_level:
+            print(self.format_event(event), file=sys.stderr)
+
+    def debug(self, message, *args):
+        self.trace(DEBUG, message, *args)
+
+    def info(self, message, *args):
+        self.trace(INFO, message, *args)
+
+    def warning(self, message, *args):
+        self.trace(WARNING, message, *args)
+
+    def error(self, message, *args):
+        self.trace(ERROR, message, *args)
+
+    @staticmethod
+    def format_event(event):
+        timestamp, level, thread_name, message, args = event
+        try:
+            text = message.format(*args) if args else message
+        except Exception:
+            text = f"{message} {args!r}"
+        moment = datetime.datetime.fromtimestamp(timestamp).isoformat(timespec="milliseconds")
+        return f"{moment} {LEVEL_NAMES.get(level, level)} [{thread_name}] {text}"
+
+    def dump(self, path):
+        """Записывает события буфера в файл; возвращает их количество"""
+        events = list(self.events)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for event in events:
+                f.write(self.format_event(event) + "\n")
+        return len(events)
+
+    def install_crash_handler(self, path):
+        """Выгружает буфер в файл при необработанном исключении в любом потоке"""
+        previous_hook = sys.excepthook
+        previous_thread_hook = threading.excepthook
+
+        def dump_on_crash(exc_type, exc_value):
+            self.error("Необработанное исключение: {}: {}", exc_type.__name__, exc_value)
+            try:
+                self.dump(path)
+                print(f"Журнал диагностики сохранен в {path}", file=sys.stderr)
+            except Exception as e:
+                print(f"Не удалось сохранить журнал диагностики: {e}", file=sys.stderr)
+
+        def excepthook(exc_type, exc_value, exc_traceback):
+            dump_on_crash(exc_type, exc_value)
+            previous_hook(exc_type, exc_value, exc_traceback)
+
+        def thread_excepthook(args):
+            dump_on_crash(args.exc_type, args.exc_value)
+            previous_thread_hook(args)
+
+        sys.excepthook = excepthook
+        threading.excepthook = thread_excepthook
+
+
+def level_from_name(name, default=INFO):
+    """Уровень по имени (debug, info, warning, error)"""
+    levels = {value.lower(): key for key, value in LEVEL_NAMES.items()}
+    return levels.get((name or "").strip().lower(), default)
+
+
+# Общий журнал процесса
+tracer = Tracer(level=level_from_name(os.environ.get(TRACE_LEVEL_ENV)))
+
+debug = tracer.debug
+info = tracer.info
+warning = tracer.warning
+error = tracer.error
+dump = tracer.dump
+install_crash_handler = tracer.install_crash_handler